@@ -0,0 +1,250 @@
+# Account Store Module
+# Registered accounts, friendships and pending friend requests live in the
+# database - the same users/friends tables the REST API uses - so they
+# survive restarts and are shared by every worker. This module keeps the hot
+# part in memory: reads hit an LRU cache first, writes go to the database and
+# then update the cache (write-through). Friend lists are cached as sets so
+# "already friends?" and "request pending?" are O(1).
+import threading
+import time
+from collections import OrderedDict
+
+import database
+from config import Config
+from presence import username_key
+
+# Columns kept per cached account (password_hash is only used to check logins)
+ACCOUNT_FIELDS = ('id', 'username', 'email', 'password_hash', 'gender', 'age', 'country', 'state', 'created_at')
+
+
+class LRUCache:
+    """Mapping bounded to `capacity` keys, evicting the least recently used.
+
+    Entries older than `ttl` seconds count as misses, which bounds how stale
+    a worker's copy can get when another worker changes the database.
+    """
+
+    def __init__(self, capacity, ttl=None, clock=time.monotonic):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()    # {key: (value, stored_at)}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (self.ttl is not None and self.clock() - entry[1] > self.ttl):
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """Cached value without counting a hit or refreshing recency (None if absent)"""
+        entry = self.entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, self.clock())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            return entry[0] if entry is not None else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None
+        }
+
+
+class AccountStore:
+    """Write-through cache over database.py's users and friends tables.
+
+    accounts: {account_id: account dict}      names: {username_key: account_id}
+    friends:  {account_id: set(friend ids)}   requests: {account_id: set(requester ids)}
+    """
+
+    def __init__(self, capacity=10000, ttl=300.0, db=database):
+        self.db = db
+        self.accounts = LRUCache(capacity, ttl)
+        self.names = LRUCache(capacity, ttl)
+        self.friends = LRUCache(capacity, ttl)
+        self.requests = LRUCache(capacity, ttl)
+
+    def _remember(self, row):
+        account = {field: row.get(field) for field in ACCOUNT_FIELDS}
+        self.accounts.put(account['id'], account)
+        self.names.put(username_key(account['username']), account['id'])
+        return account
+
+    # ---- accounts ----
+
+    def get(self, account_id):
+        """Account by id, or None"""
+        account = self.accounts.get(account_id)
+        if account is None:
+            row = self.db.get_user_by_id(account_id)
+            account = self._remember(row) if row else None
+        return account
+
+    def get_many(self, account_ids):
+        """{account_id: account} for those that exist; misses are loaded in batches"""
+        found, missing = {}, []
+        for account_id in account_ids:
+            account = self.accounts.get(account_id)
+            if account is None:
+                missing.append(account_id)
+            else:
+                found[account_id] = account
+        if missing:
+            for row in self.db.get_users_by_ids(missing):
+                found[row['id']] = self._remember(row)
+        return found
+
+    def find(self, username):
+        """Account by case-insensitive username, or None"""
+        key = username_key(username)
+        if not key:
+            return None
+        account_id = self.names.get(key)
+        if account_id is not None:
+            account = self.get(account_id)
+            if account is not None and username_key(account['username']) == key:
+                return account
+        row = self.db.get_user_by_username_key(key)
+        return self._remember(row) if row else None
+
+    def register(self, username, gender=None, age=None, country=None, state=None, email=None, password_hash=None):
+        """Create an account; returns it, or None if the name or email is taken"""
+        try:
+            account_id = self.db.create_user(username, email, password_hash, gender, age, country, state)
+        except self.db.IntegrityError:
+            return None
+        account = self._remember({
+            'id': account_id, 'username': username, 'email': email, 'password_hash': password_hash,
+            'gender': gender, 'age': age, 'country': country, 'state': state, 'created_at': time.time()
+        })
+        self.friends.put(account_id, set())
+        self.requests.put(account_id, set())
+        return account
+
+    # ---- friends ----
+
+    def friend_ids(self, account_id):
+        """Set of accepted friend ids - treat as read-only"""
+        ids = self.friends.get(account_id)
+        if ids is None:
+            ids = set(self.db.get_friend_ids(account_id))
+            self.friends.put(account_id, ids)
+        return ids
+
+    def request_ids(self, account_id):
+        """Set of ids with a pending request to account_id - treat as read-only"""
+        ids = self.requests.get(account_id)
+        if ids is None:
+            ids = set(self.db.get_pending_requester_ids(account_id))
+            self.requests.put(account_id, ids)
+        return ids
+
+    def are_friends(self, account_id, other_id):
+        return other_id in self.friend_ids(account_id)
+
+    def has_request(self, account_id, requester_id):
+        return requester_id in self.request_ids(account_id)
+
+    def send_request(self, requester_id, target_id, tx=None):
+        """Store a pending request; False if one already exists between them in that direction.
+
+        Inside a caller's transaction (tx) the cache is updated once it commits.
+        """
+        if not self.db.create_friend_request(requester_id, target_id, tx=tx):
+            return False
+
+        def cache():
+            pending = self.requests.peek(target_id)
+            if pending is not None:
+                pending.add(requester_id)
+
+        self.db.after_commit(tx, cache)
+        return True
+
+    def accept(self, account_id, requester_id, tx=None):
+        """Turn requester_id's pending request into a friendship.
+
+        Inside a caller's transaction (tx) the cache is updated once it commits.
+        """
+        self.db.accept_friend_request(account_id, requester_id, tx=tx)
+
+        def cache():
+            pending = self.requests.peek(account_id)
+            if pending is not None:
+                pending.discard(requester_id)
+            for me, other in ((account_id, requester_id), (requester_id, account_id)):
+                ids = self.friends.peek(me)
+                if ids is not None:
+                    ids.add(other)
+
+        self.db.after_commit(tx, cache)
+
+    def reject(self, account_id, requester_id):
+        """Drop requester_id's pending request to account_id"""
+        self.db.reject_friend_request(account_id, requester_id)
+        pending = self.requests.peek(account_id)
+        if pending is not None:
+            pending.discard(requester_id)
+
+    # ---- warm-up ----
+
+    def warm(self, limit=1000):
+        """Load the `limit` most recently seen accounts and their friend graph in a few batched queries"""
+        rows = self.db.get_recent_users(limit) if limit else []
+        ids = [self._remember(row)['id'] for row in rows]
+        friends = {account_id: set() for account_id in ids}
+        requests = {account_id: set() for account_id in ids}
+        for edge in self.db.get_friend_edges(ids):
+            user_id, friend_id = edge['user_id'], edge['friend_id']
+            if edge['status'] == 'accepted':
+                if user_id in friends:
+                    friends[user_id].add(friend_id)
+                if friend_id in friends:
+                    friends[friend_id].add(user_id)
+            elif edge['status'] == 'pending' and friend_id in requests:
+                requests[friend_id].add(user_id)
+        for account_id in ids:
+            self.friends.put(account_id, friends[account_id])
+            self.requests.put(account_id, requests[account_id])
+        return len(ids)
+
+    def get_stats(self):
+        """Get cache statistics"""
+        return {
+            'accounts': self.accounts.get_stats(),
+            'names': self.names.get_stats(),
+            'friends': self.friends.get_stats(),
+            'requests': self.requests.get_stats()
+        }
+
+
+# Shared by the Socket.IO handlers (app.py) and the REST API (api_routes.py),
+# so a change made through either is visible to both
+accounts = AccountStore(Config.ACCOUNT_CACHE_SIZE, ttl=Config.ACCOUNT_CACHE_TTL)
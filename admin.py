@@ -2,7 +2,32 @@
 import sqlite3
 import uuid
 from datetime import datetime, timedelta
-from database import get_db
+from database import get_db, fetch_all, queries, search_messages, ROW_ID
+
+# Keyset listings, newest first: the _BEFORE variants page back from a (created_at, id) key
+GET_USERS_PAGE = queries.define('admin_get_users', """
+    SELECT * FROM users ORDER BY created_at DESC, id DESC LIMIT ?
+""")
+GET_USERS_PAGE_BEFORE = queries.define('admin_get_users_before', """
+    SELECT * FROM users WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?
+""")
+GET_RECENT_MESSAGES = queries.define('admin_get_recent_messages', f"""
+    SELECT m.*, m.{ROW_ID} AS id, u1.username as sender_name, u2.username as receiver_name
+    FROM messages m
+    LEFT JOIN users u1 ON m.sender_id = u1.id
+    LEFT JOIN users u2 ON m.receiver_id = u2.id
+    ORDER BY m.created_at DESC, m.{ROW_ID} DESC
+    LIMIT ?
+""")
+GET_RECENT_MESSAGES_BEFORE = queries.define('admin_get_recent_messages_before', f"""
+    SELECT m.*, m.{ROW_ID} AS id, u1.username as sender_name, u2.username as receiver_name
+    FROM messages m
+    LEFT JOIN users u1 ON m.sender_id = u1.id
+    LEFT JOIN users u2 ON m.receiver_id = u2.id
+    WHERE (m.created_at, m.{ROW_ID}) < (?, ?)
+    ORDER BY m.created_at DESC, m.{ROW_ID} DESC
+    LIMIT ?
+""")
 
 class AdminManager:
     def __init__(self):
@@ -10,17 +35,11 @@ class AdminManager:
 
     # ============ USER MANAGEMENT ============
 
-    def get_all_users(self, limit=50, offset=0):
-        """Get all users with pagination"""
-        with self.db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM users
-                ORDER BY created_at DESC
-                LIMIT ? OFFSET ?
-            ''', (limit, offset))
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+    def get_all_users(self, limit=50, before=None):
+        """Get users newest first; before is a (created_at, id) key to page back from"""
+        if before:
+            return fetch_all(GET_USERS_PAGE_BEFORE, (*before, limit))
+        return fetch_all(GET_USERS_PAGE, (limit,))
 
     def get_user_by_id(self, user_id):
         """Get user by ID"""
@@ -65,42 +84,22 @@ class AdminManager:
 
     # ============ MESSAGE MANAGEMENT ============
 
-    def get_recent_messages(self, limit=100):
-        """Get recent messages"""
-        with self.db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT m.*, u1.username as sender_name, u2.username as receiver_name
-                FROM messages m
-                LEFT JOIN users u1 ON m.sender_id = u1.id
-                LEFT JOIN users u2 ON m.receiver_id = u2.id
-                ORDER BY m.created_at DESC
-                LIMIT ?
-            ''', (limit,))
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+    def get_recent_messages(self, limit=100, before=None):
+        """Get messages newest first; before is a (created_at, id) key to page back from"""
+        if before:
+            return fetch_all(GET_RECENT_MESSAGES_BEFORE, (*before, limit))
+        return fetch_all(GET_RECENT_MESSAGES, (limit,))
 
     def delete_message(self, message_id):
         """Delete a message"""
         with self.db() as conn:
             cursor = conn.cursor()
-            cursor.execute('DELETE FROM messages WHERE id = ?', (message_id,))
+            cursor.execute(f'DELETE FROM messages WHERE {ROW_ID} = ?', (message_id,))
             conn.commit()
 
-    def search_messages(self, query, limit=50):
-        """Search messages"""
-        with self.db() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT m.*, u1.username as sender_name
-                FROM messages m
-                LEFT JOIN users u1 ON m.sender_id = u1.id
-                WHERE m.content LIKE ?
-                ORDER BY m.created_at DESC
-                LIMIT ?
-            ''', (f'%{query}%', limit))
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+    def search_messages(self, query, limit=50, after=None):
+        """Search everyone's messages, best match first; after is a (score, id) key to page on from"""
+        return search_messages(None, query, limit, after)
 
     # ============ REPORTS MANAGEMENT ============
 
@@ -5,14 +5,16 @@ import jwt
 import uuid
 import re
 import os
+from concurrency import offload
+from queries import decode_cursor, next_page
+from accounts import accounts
 from database import (
-    init_database, get_db, create_user, get_user_by_id, get_user_by_username,
-    get_user_by_email, update_user_online_status, search_users,
-    create_message, get_messages, create_friend_request, get_friends,
-    get_pending_friend_requests, accept_friend_request, reject_friend_request,
-    create_room, get_rooms, get_room_by_id, join_room, leave_room,
-    get_room_messages, create_room_message, create_notification,
-    get_notifications, mark_notification_read, get_stats
+    init_database, get_db, transaction, get_user_by_id, get_users_by_ids,
+    get_user_by_username, get_user_by_email, update_user_online_status, search_users,
+    find_online_users, create_message, get_messages, get_friends,
+    get_pending_friend_requests, create_room, get_rooms, get_room_by_id, join_room, leave_room,
+    get_room_messages, get_room_messages_after, create_room_message,
+    create_notification, get_notifications, mark_notification_read, get_stats
 )
 
 # Create API blueprint
@@ -28,6 +30,13 @@ init_database()
 
 # ==================== HELPER FUNCTIONS ====================
 
+def invalid_cursor():
+    """Error response for a ?cursor= that isn't one of ours"""
+    return jsonify({
+        'success': False,
+        'error': {'code': 'INVALID_REQUEST', 'message': 'Invalid cursor'}
+    }), 400
+
 def generate_token(user_id, username):
     """Generate JWT token"""
     payload = {
@@ -154,9 +163,19 @@ def register():
             }
         }), 400
 
-    # Create user
-    password_hash = generate_password_hash(password)
-    user_id = create_user(username, email, password_hash, gender, age, country, state)
+    # Create user through the account cache, so the Socket.IO side sees it at once
+    password_hash = offload(generate_password_hash, password)
+    account = accounts.register(username, gender, age, country, state,
+                                email=email, password_hash=password_hash)
+    if account is None:
+        return jsonify({
+            'success': False,
+            'error': {
+                'code': 'USER_EXISTS',
+                'message': 'Username already taken'
+            }
+        }), 400
+    user_id = account['id']
 
     # Generate token
     token = generate_token(user_id, username)
@@ -202,7 +221,7 @@ def login():
         # Try email
         user = get_user_by_email(username_or_email.lower())
 
-    if not user or not check_password_hash(user['password_hash'], password):
+    if not user or not offload(check_password_hash, user['password_hash'], password):
         return jsonify({
             'success': False,
             'error': {
@@ -390,8 +409,19 @@ def send_friend_request():
             'error': {'code': 'INVALID_REQUEST', 'message': 'Cannot add yourself'}
         }), 400
 
-    # Create friend request
-    success = create_friend_request(user_id, target_user['id'])
+    # Create friend request and notify the target in one transaction
+    with transaction() as tx:
+        success = accounts.send_request(user_id, target_user['id'], tx=tx)
+        if success:
+            user = get_user_by_id(user_id, tx=tx)
+            create_notification(
+                target_user['id'],
+                'friend_request',
+                'New Friend Request',
+                f'{user["username"]} sent you a friend request',
+                '/friends',
+                tx=tx
+            )
 
     if not success:
         return jsonify({
@@ -399,16 +429,6 @@ def send_friend_request():
             'error': {'code': 'ALREADY_EXISTS', 'message': 'Friend request already exists'}
         }), 400
 
-    # Create notification
-    user = get_user_by_id(user_id)
-    create_notification(
-        target_user['id'],
-        'friend_request',
-        'New Friend Request',
-        f'{user["username"]} sent you a friend request',
-        '/friends'
-    )
-
     return jsonify({
         'success': True,
         'message': 'Friend request sent'
@@ -444,18 +464,18 @@ def accept_friend_request():
 
     user_id = payload['user_id']
 
-    # Accept request
-    accept_friend_request(user_id, requester_id)
-
-    # Notify requester
-    user = get_user_by_id(user_id)
-    create_notification(
-        requester_id,
-        'friend_accepted',
-        'Friend Request Accepted',
-        f'{user["username"]} accepted your friend request',
-        '/friends'
-    )
+    # Accept request and notify requester in one transaction
+    with transaction() as tx:
+        accounts.accept(user_id, requester_id, tx=tx)
+        user = get_user_by_id(user_id, tx=tx)
+        create_notification(
+            requester_id,
+            'friend_accepted',
+            'Friend Request Accepted',
+            f'{user["username"]} accepted your friend request',
+            '/friends',
+            tx=tx
+        )
 
     return jsonify({
         'success': True,
@@ -485,7 +505,7 @@ def reject_friend_request():
     requester_id = data.get('user_id')
 
     if requester_id:
-        reject_friend_request(payload['user_id'], requester_id)
+        accounts.reject(payload['user_id'], requester_id)
 
     return jsonify({
         'success': True,
@@ -547,11 +567,17 @@ def get_messages_api():
         }), 401
 
     message_type = request.args.get('type', 'received')
-    messages = get_messages(payload['user_id'], message_type)
+    limit = int(request.args.get('limit', 50))
+    try:
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return invalid_cursor()
+    messages, next_cursor = next_page(get_messages(payload['user_id'], message_type, limit + 1, before), limit)
 
     return jsonify({
         'success': True,
-        'data': messages
+        'data': messages,
+        'next_cursor': next_cursor
     })
 
 
@@ -585,20 +611,20 @@ def send_message_api():
 
     user_id = payload['user_id']
 
-    # Create message
-    message_id = create_message(user_id, receiver_id, content)
-
-    # Create notification
-    receiver = get_user_by_id(receiver_id)
-    if receiver:
-        sender = get_user_by_id(user_id)
-        create_notification(
-            receiver_id,
-            'new_message',
-            'New Message',
-            f'{sender["username"]} sent you a message',
-            '/inbox'
-        )
+    # Create message and notification in one transaction
+    with transaction() as tx:
+        message_id = create_message(user_id, receiver_id, content, tx=tx)
+
+        users = {user['id']: user for user in get_users_by_ids({user_id, receiver_id}, tx=tx)}
+        if receiver_id in users and user_id in users:
+            create_notification(
+                receiver_id,
+                'new_message',
+                'New Message',
+                f'{users[user_id]["username"]} sent you a message',
+                '/inbox',
+                tx=tx
+            )
 
     return jsonify({
         'success': True,
@@ -726,13 +752,33 @@ def leave_room_api(room_id):
 
 @api.route('/rooms/<room_id>/messages', methods=['GET'])
 def get_room_messages_api(room_id):
-    """Get room messages"""
+    """Get room messages (newest first, older pages via ?cursor=), or with ?after=<seq>
+    the ones after that sequence number"""
     limit = int(request.args.get('limit', 50))
-    messages = get_room_messages(room_id, limit)
+    after = request.args.get('after')
+    if after is not None:
+        try:
+            after = int(after)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': {'code': 'INVALID_REQUEST', 'message': 'after must be a sequence number'}
+            }), 400
+        return jsonify({
+            'success': True,
+            'data': get_room_messages_after(room_id, after, limit)
+        })
+
+    try:
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return invalid_cursor()
+    messages, next_cursor = next_page(get_room_messages(room_id, limit + 1, before), limit)
 
     return jsonify({
         'success': True,
-        'data': messages
+        'data': messages,
+        'next_cursor': next_cursor
     })
 
 
@@ -757,11 +803,16 @@ def get_notifications_api():
         }), 401
 
     limit = int(request.args.get('limit', 20))
-    notifications = get_notifications(payload['user_id'], limit)
+    try:
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return invalid_cursor()
+    notifications, next_cursor = next_page(get_notifications(payload['user_id'], limit + 1, before), limit)
 
     return jsonify({
         'success': True,
-        'data': notifications
+        'data': notifications,
+        'next_cursor': next_cursor
     })
 
 
@@ -815,40 +866,7 @@ def get_online_users():
     current_user_id = payload['user_id'] if payload else None
 
     # Get online users from database
-    if USE_POSTGRES:
-        if current_user_id:
-            online_users = fetch_all('''
-                SELECT id, username, gender, age, country, state, bio, avatar, is_online, last_seen, created_at
-                FROM users
-                WHERE is_online = 1 AND id != %s
-                ORDER BY last_seen DESC
-                LIMIT 50
-            ''', (current_user_id,))
-        else:
-            online_users = fetch_all('''
-                SELECT id, username, gender, age, country, state, bio, avatar, is_online, last_seen, created_at
-                FROM users
-                WHERE is_online = 1
-                ORDER BY last_seen DESC
-                LIMIT 50
-            ''')
-    else:
-        if current_user_id:
-            online_users = fetch_all('''
-                SELECT id, username, gender, age, country, state, bio, avatar, is_online, last_seen, created_at
-                FROM users
-                WHERE is_online = 1 AND id != ?
-                ORDER BY last_seen DESC
-                LIMIT 50
-            ''', (current_user_id,))
-        else:
-            online_users = fetch_all('''
-                SELECT id, username, gender, age, country, state, bio, avatar, is_online, last_seen, created_at
-                FROM users
-                WHERE is_online = 1
-                ORDER BY last_seen DESC
-                LIMIT 50
-            ''')
+    online_users = find_online_users(current_user_id)
 
     return jsonify({
         'success': True,
@@ -1,17 +1,17 @@
+import atexit
 import json
 import os
 import re
 import time
 import uuid
 import hashlib
-import threading
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from logging.handlers import RotatingFileHandler
 from flask import Flask, render_template, request, session, jsonify, redirect, url_for, send_from_directory, g
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from werkzeug.utils import secure_filename
-from collections import defaultdict
+from werkzeug.security import generate_password_hash, check_password_hash
 from config import get_config
 
 # Load configuration
@@ -252,13 +252,43 @@ import uuid
 import time
 import re
 import os
-from collections import defaultdict
 from config import Config
-from database import init_database
+from database import (init_database, get_db, get_pool, insert_chat_messages, get_user_by_email,
+                      update_user_online_status, insert_room_messages, get_room_by_id, get_room_last_seq,
+                      get_room_messages_after, search_messages, backfill_message_search)
 from api_routes import api
+from admin import admin
 from csrf import generate_csrf_token, validate_csrf_token
+from state_backend import create_state_backend
+from broadcast import PresenceBroadcaster
+from expiry import TimingWheel
+from presence import username_key, GENDERS
+from matchmaking import PREFERENCES, ALREADY_CLAIMED
+from rate_limit import rate_limiter, ban_list, is_ip_banned
+from blocklist import BlockList
+from typing_indicator import TypingTracker
+from journal import MessageJournal
+from outbound import OutboundQueues
+from snapshot import StateSnapshot
+from resume import ResumeWindow, DELIBERATE_DISCONNECTS
+from accounts import accounts
+from room_feed import RoomFeed, SharedRoomFeed
+from search_index import SearchBackfill
+from concurrency import offload
+from queries import Record, decode_cursor, next_page
+from flask.json.provider import DefaultJSONProvider
+
+class JSONProvider(DefaultJSONProvider):
+    """Serializes database rows (queries.Record) as JSON objects"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o._asdict()
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.config.from_object(Config)
 app.config['SECRET_KEY'] = config.SECRET_KEY
 
@@ -299,28 +329,96 @@ except Exception as e:
 # Register API blueprint
 app.register_blueprint(api)
 
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# With a message queue, emits and room joins reach clients on every worker
+# async_mode follows SOCKETIO_ASYNC_MODE; async_app.py serves on eventlet/gevent
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=config.SOCKETIO_ASYNC_MODE,
+                    message_queue=config.SOCKETIO_MESSAGE_QUEUE or None,
+                    serializer=config.SOCKETIO_SERIALIZER)
+
+# Each client's send queue is bounded: past the high-water mark typing is
+# dropped, count updates are coalesced, and clients that stay slow are cut off
+outbound = OutboundQueues(
+    socketio.server,
+    high_water=config.OUTBOUND_HIGH_WATER,
+    low_water=config.OUTBOUND_LOW_WATER,
+    max_depth=config.OUTBOUND_MAX_DEPTH,
+    slow_timeout=config.OUTBOUND_SLOW_TIMEOUT
+)
+outbound.install()
+socketio.start_background_task(outbound.run, socketio.sleep)
+
+@app.context_processor
+def inject_socketio_parser():
+    """Browser build of the msgpack parser, only needed in msgpack mode"""
+    msgpack = config.SOCKETIO_SERIALIZER == 'msgpack'
+    return {'socketio_parser_url': config.SOCKETIO_PARSER_URL if msgpack else ''}
+
+# Presence, queues and room membership live in the state backend so that
+# several workers can share them (see state_backend.py)
+state = create_state_backend(config.STATE_BACKEND_URL, matchmaking=config.MATCHMAKING_MODE,
+                             relax=config.MATCH_RELAX_SECONDS, lease_ttl=config.STATE_LEASE_TTL_SECONDS)
 
 # ==================== REAL-TIME USER TRACKING ====================
 
 # Track active Socket.IO connections
 # Format: {sid: {user_id, username, gender, country, current_room, connected_at}}
-active_connections = {}
+active_connections = state.active_connections
 
 # Global room for broadcasting user counts
 GLOBAL_ONLINE_ROOM = "global_online_users"
 
+# Counters and per-room member sets, maintained on every presence event
+presence = state.presence
+
+# Lookup indexes kept in step with connect/disconnect/profile/registration
+sessions = state.sessions           # {session_id: sid}
+user_sids = state.user_sids         # {user_id: sid}
+usernames = state.usernames         # {username_key: user_id} for online users
+
+def build_online_count():
+    return {
+        'total_online': len(active_connections),
+        'gender_counts': presence.gender_counts()
+    }
+
+# Count updates are coalesced and sent at most once per interval
+presence_broadcaster = PresenceBroadcaster(
+    lambda event, payload: socketio.emit(event, payload, room=GLOBAL_ONLINE_ROOM),
+    interval=config.PRESENCE_BROADCAST_INTERVAL_MS / 1000.0
+)
+socketio.start_background_task(presence_broadcaster.run, socketio.sleep)
+
+def broadcast_online_count():
+    """Queue an online_count_update for the next broadcast flush"""
+    presence_broadcaster.mark('online', 'online_count_update', build_online_count)
+
+def broadcast_room_count(room_id):
+    """Queue a room_count_update for the next broadcast flush (forgotten once the room empties)"""
+    presence_broadcaster.mark(f'room:{room_id}', 'room_count_update',
+                              lambda: {'room_id': room_id, 'count': presence.room_size(room_id)},
+                              retire=lambda payload: payload['count'] == 0)
+
+MAX_ROOM_ID_LENGTH = 64
+
+def is_known_room(room_id):
+    """Presence is tracked for the lobby and existing chat rooms only"""
+    if not isinstance(room_id, str) or not room_id or len(room_id) > MAX_ROOM_ID_LENGTH:
+        return False
+    return room_id == 'lobby' or room_id in room_feed.rooms or get_room_by_id(room_id) is not None
+
 # ==================== ANTI-BOT SECURITY SYSTEM ====================
 
-# Track connection attempts per IP
-ip_connections = defaultdict(list)
-ip_message_counts = defaultdict(list)
-ip_request_counts = defaultdict(list)
+# Per-IP connect/message/request limits are the named policies in rate_limit.py
 
-# Maximum connections per IP
-MAX_CONNECTIONS_PER_IP = 3
-MAX_MESSAGES_PER_MINUTE = 20
-MAX_REQUESTS_PER_MINUTE = 30
+# CIDR ranges (VPN/datacenter/spam sources) loaded from BLOCKLIST_PATH and
+# reloaded in the background whenever the file changes
+blocklist = BlockList(config.BLOCKLIST_PATH, interval=config.BLOCKLIST_RELOAD_SECONDS)
+blocklist.reload_if_changed()
+socketio.start_background_task(blocklist.watch, socketio.sleep)
+
+def is_ip_blocked(ip):
+    """Check an IP against the CIDR block list and the (temporary) ban list"""
+    return blocklist.is_blocked(ip) or is_ip_banned(ip)
 
 # Bot detection patterns
 BOT_USER_AGENTS = [
@@ -336,24 +434,11 @@ SUSPICIOUS_HEADERS = [
     'true-client-ip', 'x-cluster-client-ip'
 ]
 
-# Rate limiting decorator
+# Rate limiting
 def check_rate_limit(ip, action='message'):
-    """Check if IP has exceeded rate limits"""
-    current_time = time.time()
-
-    if action == 'message':
-        # Clean old entries
-        ip_message_counts[ip] = [t for t in ip_message_counts[ip] if current_time - t < 60]
-        if len(ip_message_counts[ip]) >= MAX_MESSAGES_PER_MINUTE:
-            return False
-        ip_message_counts[ip].append(current_time)
-    elif action == 'request':
-        ip_request_counts[ip] = [t for t in ip_request_counts[ip] if current_time - t < 60]
-        if len(ip_request_counts[ip]) >= MAX_REQUESTS_PER_MINUTE:
-            return False
-        ip_request_counts[ip].append(current_time)
-
-    return True
+    """Check if IP has exceeded the limit of the named policy"""
+    allowed, _ = rate_limiter.check_rate_limit(ip, action)
+    return allowed
 
 def get_client_ip():
     """Get real client IP address"""
@@ -364,6 +449,15 @@ def get_client_ip():
 
     return request.remote_addr
 
+def get_page_args(default_limit=50, max_limit=200):
+    """Read offset/limit query args, clamped to sane bounds"""
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', default_limit)), 1), max_limit)
+    except ValueError:
+        offset, limit = 0, default_limit
+    return offset, limit
+
 def is_bot_request():
     """Check if request appears to be from a bot"""
     user_agent = request.headers.get('User-Agent', '').lower()
@@ -404,28 +498,135 @@ def generate_honeypot_token():
     return hashlib.sha256(str(time.time()).encode()).hexdigest()[:16]
 
 # Store active users and queues
-users = {}
-registered_users = {}
-used_usernames = set()
-
-# Friends system - {user_id: [friend_id1, friend_id2, ...]}
-friends = {}
+users = state.users
+used_usernames = {}         # {username_key: None while a guest uses it, else when they left}
 
-# Friend requests - {user_id: [request_from_user_id1, request_from_user_id2, ...]}
-friend_requests = {}
+# Registered accounts, friends and friend requests are stored in the database
+# behind a write-through LRU cache (accounts, shared with the REST API)
+account_users = {}          # {account_id: user_id} for logged-in connections
 
 # Honeypot tokens storage
 honeypot_tokens = set()
 
 # Waiting queues by gender preference
-waiting_queues = {
-    'male': {'any': [], 'opposite': [], 'same': []},
-    'female': {'any': [], 'opposite': [], 'same': []}
-}
+matchmaker = state.matchmaker
+
+# A guest's name stays taken for GUEST_NAME_HOLD_SECONDS after they leave,
+# so they can come back to it; then it is free for anyone
+released_guest_names = TimingWheel(config.GUEST_NAME_HOLD_SECONDS, tick=60)
+
+def schedule_guest_names(now):
+    """Start the hold of every restored name (its guest's connection died with
+    the old process) and drop those whose hold has already run out"""
+    for key, left in list(used_usernames.items()):
+        left = now if left is None else left
+        if left + released_guest_names.timeout <= now:
+            del used_usernames[key]
+        else:
+            used_usernames[key] = left
+            released_guest_names.touch(key, left)
+
+# Taken guest names survive restarts through a periodic snapshot, loaded
+# here before any client connects
+snapshot = StateSnapshot(config.SNAPSHOT_PATH, {
+    'used_usernames': used_usernames
+}, interval=config.SNAPSHOT_INTERVAL_SECONDS)
+if config.SNAPSHOT_PATH:
+    try:
+        restored = snapshot.restore()
+        if restored:
+            logger.info(f"Restored {restored} rows from {config.SNAPSHOT_PATH} "
+                        f"in {snapshot.stats['restore_ms']} ms")
+    except Exception as e:
+        logger.error(f"Could not restore state snapshot {config.SNAPSHOT_PATH}: {e}")
+    schedule_guest_names(time.time())
+    socketio.start_background_task(snapshot.run, socketio.sleep, offload)
+    atexit.register(snapshot.close)
+
+def warm_accounts():
+    try:
+        warmed = accounts.warm(config.ACCOUNT_CACHE_WARM)
+        if config.DEBUG:
+            print(f"Account cache warmed with {warmed} accounts")
+    except Exception as e:
+        print(f"Account cache warm-up error: {e}")
+
+if config.ACCOUNT_CACHE_WARM:
+    socketio.start_background_task(warm_accounts)
 
 def generate_user_id():
     return str(uuid.uuid4())
 
+def index_username(user_id, old, new):
+    """Move user_id from its old username key to the new one"""
+    old_key, new_key = username_key(old), username_key(new)
+    if old_key and old_key != new_key and usernames.get(old_key) == user_id:
+        del usernames[old_key]
+    if new_key:
+        usernames[new_key] = user_id
+
+def take_guest_name(username):
+    """Reserve a guest's name for as long as they are online"""
+    key = username_key(username)
+    if key:
+        released_guest_names.cancel(key)
+        used_usernames[key] = None
+        snapshot.changed()
+
+def release_guest_name(username, now=None):
+    """Start the hold on a departed guest's name (unless someone online still uses it)"""
+    key = username_key(username)
+    if not key or key not in used_usernames or key in usernames:
+        return
+    now = time.time() if now is None else now
+    used_usernames[key] = now
+    released_guest_names.touch(key, now)
+    snapshot.changed()
+
+def expire_guest_names(now=None):
+    """Free guest names whose hold ran out"""
+    expired = [key for key in released_guest_names.advance(now)
+               if used_usernames.get(key) is not None]
+    for key in expired:
+        del used_usernames[key]
+    if expired:
+        snapshot.changed()
+    return len(expired)
+
+def set_username(user_id, username):
+    """Rename an online user and keep the username index in step"""
+    user = users.get(user_id)
+    if user is None:
+        return
+    old = user.get('username')
+    user['username'] = username
+    index_username(user_id, old, username)
+
+def link_account(user_id, account):
+    """Log a connection's user into a registered account"""
+    set_username(user_id, account['username'])
+    users[user_id].update({
+        'username': account['username'],
+        'gender': account.get('gender'),
+        'age': account.get('age'),
+        'country': account.get('country'),
+        'state': account.get('state'),
+        'account_id': account['id'],
+        'is_registered': True
+    })
+    account_users[account['id']] = user_id
+    update_user_online_status(account['id'], 1)
+
+def public_account(account):
+    """Account fields a client may see"""
+    return {
+        'username': account['username'],
+        'gender': account.get('gender'),
+        'age': account.get('age'),
+        'country': account.get('country'),
+        'state': account.get('state')
+    }
+
 def get_partner_gender(user_gender, preference):
     if preference == 'any':
         return None
@@ -435,41 +636,83 @@ def get_partner_gender(user_gender, preference):
         return user_gender
     return None
 
-def find_partner(user_id, user_gender, partner_pref):
-    partner_gender = get_partner_gender(user_gender, partner_pref)
-
-    if partner_pref == 'any':
-        for pref in ['any', 'same', 'opposite']:
-            queue = waiting_queues[user_gender][pref]
-            if queue:
-                return queue.pop(0)
-    elif partner_pref == 'opposite':
-        opposite_gender = 'female' if user_gender == 'male' else 'male'
-        for pref in ['any', 'opposite']:
-            queue = waiting_queues[opposite_gender][pref]
-            if queue:
-                return queue.pop(0)
-    elif partner_pref == 'same':
-        for pref in ['any', 'same']:
-            queue = waiting_queues[user_gender][pref]
-            if queue:
-                return queue.pop(0)
+def find_partner(user_id, user_gender, partner_pref, country=None, age=None):
+    return matchmaker.match(user_id, user_gender, partner_pref, country=country, age=age)
 
-    return None
-
-def add_to_queue(user_id, gender, preference):
-    waiting_queues[gender][preference].append(user_id)
+def add_to_queue(user_id, gender, preference, country=None, age=None):
+    matchmaker.enqueue(user_id, gender, preference, country=country, age=age)
 
 def remove_from_queue(user_id):
-    for gender in waiting_queues:
-        for pref in waiting_queues[gender]:
-            if user_id in waiting_queues[gender][pref]:
-                waiting_queues[gender][pref].remove(user_id)
+    matchmaker.cancel(user_id)
 
 def create_chat_room(user1_id, user2_id):
     room_id = str(uuid.uuid4())
     return room_id
 
+def pair_users(user_id, partner_id):
+    """Link two users in a new chat room, whichever worker their sockets are on"""
+    room_id = create_chat_room(user_id, partner_id)
+
+    users[user_id].update({'partner_id': partner_id, 'room': room_id})
+    partner = users[partner_id]
+    partner.update({'partner_id': user_id, 'room': room_id})
+    # Clears a shared matchmaker's claim on the partner now they are paired
+    remove_from_queue(partner_id)
+
+    join_room(room_id)
+    if partner.get('sid'):
+        join_room(room_id, sid=partner['sid'])
+
+    return room_id, partner
+
+def describe_user(user):
+    """'age | Country, state' line shown to a new partner"""
+    country = user.get('country')
+    info = f"{user.get('age') or ''} | {Config.COUNTRIES.get(country, country or '')}"
+    if user.get('state'):
+        info += f", {user['state']}"
+    return info
+
+def pair_waiting_users(user_id, partner_id):
+    """Pair two queued users outside any request (matchmaking sweep)"""
+    user, partner = users.get(user_id), users.get(partner_id)
+    if user is None or partner is None or not user.get('sid') or not partner.get('sid'):
+        return None
+
+    room_id = create_chat_room(user_id, partner_id)
+    user.update({'partner_id': partner_id, 'room': room_id})
+    partner.update({'partner_id': user_id, 'room': room_id})
+
+    for me, other in ((user, partner), (partner, user)):
+        socketio.server.enter_room(me['sid'], room_id, namespace='/')
+        socketio.emit('partner_found', {
+            'room': room_id,
+            'partner_gender': other.get('gender'),
+            'partner_name': other.get('username', 'Stranger'),
+            'partner_info': describe_user(other)
+        }, room=me['sid'])
+    return room_id
+
+def run_matchmaking_sweep():
+    """Pair waiters whose wait crossed a relaxation step (nearby mode)"""
+    while True:
+        socketio.sleep(config.MATCH_SWEEP_SECONDS)
+        try:
+            for user_id, partner_id in matchmaker.sweep():
+                if pair_waiting_users(user_id, partner_id) is None:
+                    # One of them left in the meantime - requeue whoever is still here
+                    for uid in (user_id, partner_id):
+                        user = users.get(uid)
+                        if user and user.get('sid') and not user.get('partner_id'):
+                            add_to_queue(uid, user.get('gender'), user.get('partner_pref'),
+                                         user.get('country'), user.get('age'))
+        except Exception as e:
+            print(f"Matchmaking sweep error: {e}")
+
+# Nearby matchmaking pairs long waiters with each other in the background
+if hasattr(matchmaker, 'sweep'):
+    socketio.start_background_task(run_matchmaking_sweep)
+
 # ==================== ROUTES ====================
 
 @app.route('/')
@@ -478,6 +721,7 @@ def index():
     honeypot_token = generate_honeypot_token()
     session['honeypot_token'] = honeypot_token
     session['session_start'] = time.time()
+    session.setdefault('sid', uuid.uuid4().hex)
     honeypot_tokens.add(honeypot_token)
 
     return render_template('index.html')
@@ -500,6 +744,7 @@ def guest_login():
     session['guest_country'] = country
     session['is_guest'] = True
     session['age_verified'] = True
+    session.setdefault('sid', uuid.uuid4().hex)
     
     # Use permanent session for longer login persistence
     session.permanent = True
@@ -545,8 +790,66 @@ def check_rate():
 
 # ==================== SOCKET HANDLERS ====================
 
+def track_connection(user_id, session_id, user, now):
+    """Index this socket for user_id and count it as online"""
+    active_connections[request.sid] = {
+        'user_id': user_id,
+        'session_id': session_id,
+        'username': user.get('username'),
+        'gender': user.get('gender'),
+        'country': user.get('country'),
+        'is_guest': user.get('is_guest', False),
+        'current_room': 'lobby',
+        'connected_at': now,
+        'last_ping': now
+    }
+    connection_reaper.touch(request.sid, now)
+    if state.lease:
+        state.lease.claim(request.sid, user_id)
+    sessions[session_id] = request.sid
+    user_sids[user_id] = request.sid
+    index_username(user_id, None, user.get('username'))
+
+    presence.add(request.sid, active_connections[request.sid], room='lobby')
+
+    # Join global online users room for broadcasting
+    join_room(GLOBAL_ONLINE_ROOM)
+
+    # Broadcast updated online count to all clients
+    broadcast_online_count()
+
+def resume_user(user_id, missed, session_id, now):
+    """Hand a held slot to this connection and replay what the user missed"""
+    user = users[user_id]
+    user['sid'] = request.sid
+    user['resume_token'] = resume.issue(user_id, session_id)
+    session['user_id'] = user_id
+    session['username'] = user.get('username')
+    session['gender'] = user.get('gender')
+    session['country'] = user.get('country')
+    track_connection(user_id, session_id, user, now)
+
+    emit('connected', {'user_id': user_id, 'username': user.get('username'), 'gender': user.get('gender'),
+                       'is_guest': user.get('is_guest', False), 'resume_token': user['resume_token'],
+                       'resumed': True})
+    for event, payload in missed:
+        emit(event, payload)
+
+    partner_id = user.get('partner_id')
+    partner = users.get(partner_id) if partner_id else None
+    if partner is not None and partner.get('partner_id') == user_id and user.get('room'):
+        join_room(user['room'])
+        resume.pairing_kept()
+        emit('chat_resumed', {'room': user['room'], 'partner_name': partner.get('username', 'Stranger'),
+                              'missed': len(missed)})
+    elif partner_id:
+        # The partner left or was paired again while this user was away
+        user['partner_id'] = None
+        user['room'] = None
+        emit('partner_disconnected')
+
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     client_ip = get_client_ip()
     
     # Check if blocked
@@ -563,20 +866,26 @@ def handle_connect():
 
     # Rate limit connections
     current_time = time.time()
-    ip_connections[client_ip] = [t for t in ip_connections[client_ip] if current_time - t < 60]
-
-    if len(ip_connections[client_ip]) >= MAX_CONNECTIONS_PER_IP:
+    if not check_rate_limit(client_ip, 'connect'):
         logger.warning(f"Connection limit exceeded from {client_ip}")
         emit('error', {'message': 'Too many connections from your IP'})
         return False
 
-    ip_connections[client_ip].append(current_time)
-
     # Validate session - allow guests with age_verified
     if not validate_session():
         emit('error', {'message': 'Invalid session. Please refresh the page.'})
         return False
 
+    # Cookie sessions have no id of their own; page loads issue one in 'sid'
+    session_id = session.setdefault('sid', uuid.uuid4().hex)
+
+    # Back within the resume window: same user, same partner
+    if isinstance(auth, dict) and auth.get('resume_token'):
+        user_id, missed = resume.claim(auth['resume_token'], session_id)
+        if user_id is not None and user_id in users:
+            resume_user(user_id, missed, session_id, current_time)
+            return
+
     user_id = generate_user_id()
     
     # Check if guest user
@@ -601,63 +910,94 @@ def handle_connect():
         'is_guest': is_guest,
         'connected_at': time.time(),
         'ip': client_ip,
+        'sid': request.sid,
         'messages_sent': 0,
-        'last_message_time': 0
+        'last_message_time': 0,
+        'resume_token': resume.issue(user_id, session_id)
     }
     
     # Track active connection for real-time user counting
-    active_connections[request.sid] = {
-        'user_id': user_id,
-        'session_id': session.sid,
-        'username': username,
-        'gender': gender,
-        'country': country,
-        'is_guest': is_guest,
-        'current_room': 'lobby',
-        'connected_at': current_time,
-        'last_ping': current_time
-    }
-    
-    # Join global online users room for broadcasting
-    join_room(GLOBAL_ONLINE_ROOM)
-    
-    # Broadcast updated online count to all clients
-    socketio.emit('online_count_update', {
-        'total_online': len(active_connections)
-    }, room=GLOBAL_ONLINE_ROOM)
+    track_connection(user_id, session_id, users[user_id], current_time)
     
     # Only log in debug mode
     if config.DEBUG:
         logger.info(f"User connected: {username} (ID: {user_id}) from {client_ip}")
     
-    emit('connected', {'user_id': user_id, 'username': username, 'gender': gender, 'is_guest': is_guest})
+    emit('connected', {'user_id': user_id, 'username': username, 'gender': gender, 'is_guest': is_guest,
+                       'resume_token': users[user_id]['resume_token']})
 
-def cleanup_stale_connections():
-    """Remove connections that haven't pinged in 5 minutes"""
-    current_time = time.time()
-    stale_threshold = 300  # 5 minutes
-    
-    stale_sids = []
-    for sid, conn in active_connections.items():
-        last_ping = conn.get('last_ping', conn.get('connected_at', 0))
-        if current_time - last_ping > stale_threshold:
-            stale_sids.append(sid)
-    
+def release_user(user_id):
+    """Unpair, dequeue and forget a user"""
+    user = users.get(user_id)
+    if user is None:
+        return
+
+    partner_id = user.get('partner_id')
+    # After next_person the old partner's link is stale; leave their new chat alone
+    if partner_id and partner_id in users and users[partner_id].get('partner_id') == user_id:
+        socketio.emit('partner_disconnected', room=user['room'])
+        users[partner_id]['partner_id'] = None
+        users[partner_id]['room'] = None
+
+    remove_from_queue(user_id)
+    resume.forget(user.get('resume_token'))
+    del users[user_id]
+    index_username(user_id, user.get('username'), None)
+    release_guest_name(user.get('username'))
+    if state.lease:
+        state.lease.release_user(user_id)
+
+    account_id = user.get('account_id')
+    if account_id and account_users.get(account_id) == user_id:
+        del account_users[account_id]
+        update_user_online_status(account_id, 0)
+
+def drop_connection(sid):
+    """Remove a connection record, its presence entry and its index entries"""
+    conn = active_connections.pop(sid, None)
+    entry = presence.remove(sid)
+    typing_tracker.forget(sid)
+    if state.lease:
+        state.lease.release(sid)
+    if entry:
+        broadcast_room_count(entry['room'])
+
+    conn = conn or entry
+    if conn:
+        session_id = conn.get('session_id')
+        if session_id and sessions.get(session_id) == sid:
+            del sessions[session_id]
+        if conn.get('user_id') and user_sids.get(conn['user_id']) == sid:
+            del user_sids[conn['user_id']]
+    return conn
+
+def is_current_sid(user_id, sid):
+    """False once a resumed connection has taken the user over from sid"""
+    user = users.get(user_id)
+    return user is None or user.get('sid') == sid
+
+def expire_connection(sid):
+    """Drop every trace of a connection that stopped pinging"""
+    conn = drop_connection(sid)
+    if conn and conn.get('user_id') and is_current_sid(conn['user_id'], sid):
+        release_user(conn['user_id'])
+
+def cleanup_stale_connections(now=None):
+    """Expire connections whose idle timer ran out - O(expired), not O(connections)"""
+    stale_sids = connection_reaper.advance(now)
     for sid in stale_sids:
-        if sid in active_connections:
-            del active_connections[sid]
-        if sid in users:
-            user_id = active_connections.get(sid, {}).get('user_id')
-            if user_id and user_id in users:
-                del users[user_id]
-    
+        expire_connection(sid)
+
+    rate_limiter.evict_idle(now)
+    expire_guest_names(now)
+
+    if stale_sids:
+        broadcast_online_count()
     return len(stale_sids)
 
-# Run cleanup every 5 minutes - reduced logging
-import threading
 def run_cleanup():
     while True:
-        time.sleep(300)  # 5 minutes
+        socketio.sleep(config.REAPER_TICK_SECONDS)
         try:
             cleaned = cleanup_stale_connections()
             if cleaned > 0 and config.DEBUG:
@@ -666,35 +1006,79 @@ def run_cleanup():
             if config.DEBUG:
                 print(f"Cleanup error: {e}")
 
-cleanup_thread = threading.Thread(target=run_cleanup, daemon=True)
-cleanup_thread.start()
+# Connections idle for longer than the timeout are expired by a timing wheel;
+# each ping pushes the deadline back instead of the reaper scanning everyone
+connection_reaper = TimingWheel(config.STALE_CONNECTION_TIMEOUT, tick=config.REAPER_TICK_SECONDS)
+socketio.start_background_task(run_cleanup)
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    user_id = session.get('user_id')
-    if user_id and user_id in users:
-        user = users[user_id]
+def install_activity_refresh(server):
+    """Count every event a client sends (messages, typing, ...) as activity,
+    so a connection in use is never reaped for lack of explicit pings"""
+    trigger_event = server._trigger_event
+
+    def trigger(event, namespace, *args):
+        # args[0] is the sender's sid for every event
+        if event not in ('connect', 'disconnect') and args:
+            connection_reaper.refresh(args[0])
+        return trigger_event(event, namespace, *args)
+
+    server._trigger_event = trigger
+
+install_activity_refresh(socketio.server)
+
+def reap_connection(sid):
+    """Drop a connection left behind by a dead worker"""
+    drop_connection(sid)
+    broadcast_online_count()
+
+def reap_user(user_id):
+    """Release a dead worker's user unless a live connection has taken it over"""
+    user = users.get(user_id)
+    if user is not None and user.get('sid') and user['sid'] in active_connections:
+        return
+    release_user(user_id)
+
+# With shared state, each worker heartbeats and owns the connections it serves;
+# a worker that dies without cleaning up has its entries purged by a survivor
+if state.lease:
+    socketio.start_background_task(state.lease.run, socketio.sleep, reap_connection, reap_user)
+    atexit.register(state.lease.stop)
 
-        if user.get('partner_id'):
-            partner_id = user['partner_id']
-            if partner_id in users:
-                emit('partner_disconnected', room=user['room'], broadcast=True)
+# A shared limiter pushes this worker's hits and pulls global counts in batches
+if rate_limiter.shared:
+    socketio.start_background_task(rate_limiter.run, socketio.sleep)
 
-            if partner_id in users:
-                users[partner_id]['partner_id'] = None
-                users[partner_id]['room'] = None
+# A shared ban list is reloaded in the background; connect checks stay local
+if ban_list.shared:
+    socketio.start_background_task(ban_list.run, socketio.sleep)
 
-        remove_from_queue(user_id)
-        del users[user_id]
+# A paired user whose socket drops keeps their partner for RESUME_WINDOW_SECONDS;
+# slots nobody reclaims are released like an ordinary disconnect
+resume = ResumeWindow(config.RESUME_WINDOW_SECONDS, buffer_size=config.RESUME_BUFFER_MESSAGES)
+if resume.enabled:
+    socketio.start_background_task(resume.run, socketio.sleep, release_user)
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    user_id = session.get('user_id')
+    user = users.get(user_id) if user_id else None
+    if user is not None and user.get('sid') != request.sid:
+        # A socket the user has already resumed from (or been held for)
+        # timing out: the live session is not this connection's to end
+        pass
+    elif user is not None and user.get('partner_id') \
+            and reason not in DELIBERATE_DISCONNECTS \
+            and resume.hold(user_id, user.get('resume_token'), session.get('sid')):
+        user['sid'] = None
+    elif user_id:
+        release_user(user_id)
 
     # Remove from active connections
-    if request.sid in active_connections:
-        del active_connections[request.sid]
+    connection_reaper.cancel(request.sid)
+    drop_connection(request.sid)
     
     # Broadcast updated online count
-    socketio.emit('online_count_update', {
-        'total_online': len(active_connections)
-    }, room=GLOBAL_ONLINE_ROOM)
+    broadcast_online_count()
 
     print(f'User {user_id} disconnected')
 
@@ -704,55 +1088,62 @@ def handle_disconnect():
 def handle_update_profile(data):
     """Update user profile info for tracking"""
     if request.sid in active_connections:
-        active_connections[request.sid].update({
+        profile = {
             'username': data.get('username'),
             'gender': data.get('gender'),
             'country': data.get('country')
-        })
+        }
+        active_connections[request.sid].update(profile)
+        presence.update(request.sid, **profile)
+        if profile['username']:
+            set_username(active_connections[request.sid]['user_id'], profile['username'])
+        broadcast_online_count()
 
 @socketio.on('ping')
 def handle_ping():
     """Update user's last ping timestamp"""
     if request.sid in active_connections:
-        active_connections[request.sid]['last_ping'] = time.time()
+        now = time.time()
+        active_connections[request.sid]['last_ping'] = now
+        connection_reaper.touch(request.sid, now)
         emit('pong', {'status': 'ok'})
 
 @socketio.on('join_room_tracking')
 def handle_join_room_tracking(data):
     """Track when user joins a room"""
-    room_id = data.get('room_id', 'lobby')
-    
+    room_id = data.get('room_id', 'lobby') if isinstance(data, dict) else None
+    if not is_known_room(room_id):
+        emit('error', {'message': 'Unknown room'})
+        return
+
     if request.sid in active_connections:
         active_connections[request.sid]['current_room'] = room_id
+        previous_room = presence.move(request.sid, room_id)
+        if previous_room and previous_room != room_id:
+            broadcast_room_count(previous_room)
     
     # Broadcast room user count
-    room_users = [c for c in active_connections.values() if c.get('current_room') == room_id]
-    socketio.emit('room_count_update', {
-        'room_id': room_id,
-        'count': len(room_users)
-    }, room=GLOBAL_ONLINE_ROOM)
+    broadcast_room_count(room_id)
 
 @socketio.on('leave_room_tracking')
 def handle_leave_room_tracking(data):
     """Track when user leaves a room"""
-    room_id = data.get('room_id', 'lobby')
-    
+    room_id = data.get('room_id', 'lobby') if isinstance(data, dict) else None
+    if not is_known_room(room_id):
+        emit('error', {'message': 'Unknown room'})
+        return
+
     if request.sid in active_connections:
         active_connections[request.sid]['current_room'] = 'lobby'
+        presence.move(request.sid, 'lobby')
     
     # Broadcast room user count
-    room_users = [c for c in active_connections.values() if c.get('current_room') == room_id]
-    socketio.emit('room_count_update', {
-        'room_id': room_id,
-        'count': len(room_users)
-    }, room=GLOBAL_ONLINE_ROOM)
+    broadcast_room_count(room_id)
 
 @socketio.on('request_online_count')
 def handle_request_online_count():
     """Send current online count to requesting client"""
-    emit('online_count_update', {
-        'total_online': len(active_connections)
-    })
+    emit('online_count_update', build_online_count())
 
 @socketio.on('verify_human')
 def handle_verify_human(data):
@@ -780,11 +1171,11 @@ def handle_check_username(data):
         emit('username_error', {'message': 'Username must contain letters'})
         return
 
-    if username in [u['username'].lower() for u in registered_users.values()]:
+    if accounts.find(username) is not None:
         emit('username_taken', {'username': username})
         return
 
-    if username in used_usernames:
+    if username_key(username) in used_usernames:
         emit('username_taken', {'username': username})
         return
 
@@ -805,36 +1196,24 @@ def handle_login(data):
         emit('login_error', {'message': 'Please enter username'})
         return
 
-    user_found = None
-    for uid, user_data in registered_users.items():
-        if user_data['username'].lower() == username.lower():
-            user_found = user_data
-            user_found['id'] = uid
-            break
+    user_id = session.get('user_id')
+    if not user_id or user_id not in users:
+        emit('login_error', {'message': 'Not connected properly'})
+        return
 
-    if not user_found:
+    account = accounts.find(username)
+    if not account:
         emit('login_error', {'message': 'User not found. Please register first.'})
         return
 
-    session['user_id'] = user_found['id']
-    users[user_found['id']].update({
-        'username': user_found['username'],
-        'gender': user_found['gender'],
-        'age': user_found.get('age'),
-        'country': user_found.get('country'),
-        'state': user_found.get('state'),
-        'is_registered': True
-    })
+    # Accounts created through the REST API have a password
+    if account.get('password_hash') and \
+            not offload(check_password_hash, account['password_hash'], data.get('password', '')):
+        emit('login_error', {'message': 'Invalid username or password'})
+        return
 
-    emit('login_success', {
-        'user': {
-            'username': user_found['username'],
-            'gender': user_found['gender'],
-            'age': user_found.get('age'),
-            'country': user_found.get('country'),
-            'state': user_found.get('state')
-        }
-    })
+    link_account(user_id, account)
+    emit('login_success', {'user': public_account(account)})
 
 @socketio.on('register')
 def handle_register(data):
@@ -865,41 +1244,23 @@ def handle_register(data):
         emit('register_error', {'message': 'Username can only contain letters, numbers, and underscores'})
         return
 
+    user_id = session.get('user_id')
+    if not user_id or user_id not in users:
+        emit('register_error', {'message': 'Not connected properly'})
+        return
+
     # Check if username exists
-    if username.lower() in [u['username'].lower() for u in registered_users.values()]:
+    if accounts.find(username) is not None:
         emit('register_error', {'message': 'Username already exists'})
         return
 
-    user_id = generate_user_id()
-    registered_users[user_id] = {
-        'username': username,
-        'gender': gender,
-        'age': age,
-        'country': country,
-        'state': state,
-        'created_at': time.time(),
-        'ip': client_ip
-    }
+    account = accounts.register(username, gender, int(age) if str(age).isdigit() else None, country, state)
+    if account is None:
+        emit('register_error', {'message': 'Username already exists'})
+        return
 
-    session['user_id'] = user_id
-    users[user_id].update({
-        'username': username,
-        'gender': gender,
-        'age': age,
-        'country': country,
-        'state': state,
-        'is_registered': True
-    })
-
-    emit('register_success', {
-        'user': {
-            'username': username,
-            'gender': gender,
-            'age': age,
-            'country': country,
-            'state': state
-        }
-    })
+    link_account(user_id, account)
+    emit('register_success', {'user': public_account(account)})
 
 @socketio.on('find_partner')
 def handle_find_partner(data):
@@ -916,11 +1277,20 @@ def handle_find_partner(data):
     state = data.get('state', '')
     is_guest = data.get('is_guest', True)
 
-    if not gender or not partner_pref:
+    # Queue buckets and wait histograms are keyed by these, so only known values get in
+    if not isinstance(gender, str) or gender not in GENDERS \
+            or not isinstance(partner_pref, str) or partner_pref not in PREFERENCES:
         emit('error', {'message': 'Please select gender and preference'})
         return
+    if not isinstance(country, str) or country not in Config.COUNTRIES:
+        country = ''
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        age = None
 
-    users[user_id]['username'] = username
+    previous = users[user_id].get('username')
+    set_username(user_id, username)
     users[user_id]['gender'] = gender
     users[user_id]['partner_pref'] = partner_pref
     users[user_id]['age'] = age
@@ -928,39 +1298,25 @@ def handle_find_partner(data):
     users[user_id]['state'] = state
 
     if is_guest:
-        used_usernames.add(username.lower())
-
-    remove_from_queue(user_id)
+        take_guest_name(username)
+        if username_key(previous) != username_key(username):
+            release_guest_name(previous)
 
-    partner_id = find_partner(user_id, gender, partner_pref)
+    # match() takes the user out of the queue itself, in the same step as the claim
+    partner_id = find_partner(user_id, gender, partner_pref, country, age)
+    if partner_id is ALREADY_CLAIMED:
+        return
 
     if partner_id and partner_id in users:
-        room_id = create_chat_room(user_id, partner_id)
-
-        users[user_id]['partner_id'] = partner_id
-        users[user_id]['room'] = room_id
-
-        users[partner_id]['partner_id'] = user_id
-        users[partner_id]['room'] = room_id
-
-        join_room(room_id)
+        room_id, partner = pair_users(user_id, partner_id)
 
-        partner = users[partner_id]
         partner_name = partner.get('username', 'Stranger')
-        partner_info = ''
-        if partner.get('country'):
-            country_name = Config.COUNTRIES.get(partner['country'], partner['country'])
-            partner_info = f"{partner.get('age', '')} | {country_name}"
-            if partner.get('state'):
-                partner_info += f", {partner['state']}"
-
-        user_info = f"{age} | {Config.COUNTRIES.get(country, country)}"
-        if state:
-            user_info += f", {state}"
+        partner_info = describe_user(partner) if partner.get('country') else ''
+        user_info = describe_user(users[user_id])
 
         emit('partner_found', {
             'room': room_id,
-            'partner_gender': users[partner_id]['gender'],
+            'partner_gender': partner['gender'],
             'partner_name': partner_name,
             'partner_info': partner_info
         })
@@ -970,12 +1326,25 @@ def handle_find_partner(data):
             'partner_gender': gender,
             'partner_name': username,
             'partner_info': user_info
-        }, room=room_id)
+        }, room=partner.get('sid') or room_id)
 
     else:
-        add_to_queue(user_id, gender, partner_pref)
+        add_to_queue(user_id, gender, partner_pref, country, age)
         emit('waiting', {'message': 'Looking for a stranger to chat with...'})
 
+# Chat messages are logged for moderation by a background batch writer;
+# whatever is still queued at exit is written before the process ends
+message_journal = MessageJournal(
+    insert_chat_messages,
+    interval=config.MESSAGE_JOURNAL_FLUSH_MS / 1000.0,
+    batch_rows=config.MESSAGE_JOURNAL_BATCH_ROWS,
+    max_rows=config.MESSAGE_JOURNAL_MAX_ROWS,
+    durability=config.MESSAGE_JOURNAL_DURABILITY,
+    max_attempts=config.MESSAGE_JOURNAL_MAX_ATTEMPTS
+)
+socketio.start_background_task(message_journal.run)
+atexit.register(message_journal.close)
+
 @socketio.on('send_message')
 def handle_message(data):
     user_id = session.get('user_id')
@@ -1004,27 +1373,40 @@ def handle_message(data):
         message = message[:Config.MAX_MESSAGE_LENGTH]
 
     # Track message count
+    now = time.time()
     user['messages_sent'] += 1
-    user['last_message_time'] = time.time()
+    user['last_message_time'] = now
 
     # Block if too many messages
     if user['messages_sent'] > 100:
         emit('error', {'message': 'Message limit reached. Please start a new chat.'})
         return
 
-    emit('new_message', {
+    # One packet per participant; clients compare 'from' with their own
+    # socket id to tell their messages from their partner's
+    payload = {
         'message': message,
-        'sender': 'you',
-        'timestamp': time.time()
-    }, room=user['room'])
-
-    emit('new_message', {
-        'message': message,
-        'sender': 'partner',
-        'timestamp': time.time()
-    }, room=user['room'])
-    
-    logger.info(f"Message sent by {username} to room {user['room']}")
+        'from': request.sid,
+        'timestamp': now
+    }
+    emit('new_message', payload, room=user['room'])
+    # A partner inside the resume window gets it on reconnect
+    if resume.is_held(user['partner_id']):
+        resume.buffer(user['partner_id'], 'new_message', payload)
+
+    message_journal.record(user['room'], user_id, user['partner_id'], user.get('username'),
+                           client_ip, message, datetime.utcfromtimestamp(now).isoformat())
+
+    logger.debug(f"Message sent by {user_id} to room {user['room']}")
+
+# Only typing started/stopped transitions reach the partner; quiet typists
+# are reported as stopped after TYPING_IDLE_SECONDS
+typing_tracker = TypingTracker(
+    lambda sid, room: socketio.emit('partner_typing', {'is_typing': False}, room=room, skip_sid=sid),
+    idle_timeout=config.TYPING_IDLE_SECONDS,
+    repeat_interval=config.TYPING_REPEAT_SECONDS
+)
+socketio.start_background_task(typing_tracker.run, socketio.sleep)
 
 @socketio.on('typing')
 def handle_typing(data):
@@ -1034,7 +1416,9 @@ def handle_typing(data):
 
     user = users[user_id]
     if user.get('room'):
-        emit('partner_typing', {'is_typing': data.get('is_typing', False)}, room=user['room'])
+        is_typing = bool(data.get('is_typing', False))
+        if typing_tracker.update(request.sid, user['room'], is_typing):
+            emit('partner_typing', {'is_typing': is_typing}, room=user['room'], include_self=False)
 
 @socketio.on('next_person')
 def handle_next_person():
@@ -1062,26 +1446,20 @@ def handle_next_person():
     partner_pref = user.get('partner_pref')
 
     if gender and partner_pref:
-        partner_id = find_partner(user_id, gender, partner_pref)
+        partner_id = find_partner(user_id, gender, partner_pref, user.get('country'), user.get('age'))
+        if partner_id is ALREADY_CLAIMED:
+            return
 
         if partner_id and partner_id in users:
-            room_id = create_chat_room(user_id, partner_id)
-
-            users[user_id]['partner_id'] = partner_id
-            users[user_id]['room'] = room_id
-
-            users[partner_id]['partner_id'] = user_id
-            users[partner_id]['room'] = room_id
-
-            join_room(room_id)
+            room_id, partner = pair_users(user_id, partner_id)
 
             emit('partner_found', {
                 'room': room_id,
-                'partner_gender': users[partner_id]['gender'],
-                'partner_name': users[partner_id].get('username', 'Stranger')
+                'partner_gender': partner['gender'],
+                'partner_name': partner.get('username', 'Stranger')
             }, room=room_id)
         else:
-            add_to_queue(user_id, gender, partner_pref)
+            add_to_queue(user_id, gender, partner_pref, user.get('country'), user.get('age'))
             emit('waiting', {'message': 'Looking for a stranger to chat with...'})
 
 @socketio.on('stop_chat')
@@ -1124,7 +1502,8 @@ def handle_report(data):
 def handle_add_friend(data):
     """Send a friend request to another user"""
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
+    account_id = users[user_id].get('account_id') if user_id and user_id in users else None
+    if not account_id:
         emit('friend_error', {'message': 'Please login first'})
         return
 
@@ -1133,53 +1512,45 @@ def handle_add_friend(data):
         emit('friend_error', {'message': 'Username required'})
         return
 
-    # Find target user
-    target_user_id = None
-    for uid, user_data in users.items():
-        if user_data.get('username', '').lower() == target_username.lower():
-            target_user_id = uid
-            break
-
-    # Also check registered users
-    if not target_user_id:
-        for uid, user_data in registered_users.items():
-            if user_data.get('username', '').lower() == target_username.lower():
-                target_user_id = uid
-                break
-
-    if not target_user_id:
+    # Friends are registered accounts
+    target = accounts.find(target_username)
+
+    if not target:
         emit('friend_error', {'message': 'User not found'})
         return
 
-    if target_user_id == user_id:
+    if target['id'] == account_id:
         emit('friend_error', {'message': 'Cannot add yourself'})
         return
 
     # Check if already friends
-    if user_id in friends and target_user_id in friends[user_id]:
+    if accounts.are_friends(account_id, target['id']):
         emit('friend_error', {'message': 'Already friends'})
         return
 
     # Send friend request
-    if target_user_id not in friend_requests:
-        friend_requests[target_user_id] = []
-    friend_requests[target_user_id].append(user_id)
+    if not accounts.send_request(account_id, target['id']):
+        emit('friend_error', {'message': 'Friend request already sent'})
+        return
 
     # Notify the request sender
     emit('friend_request_sent', {'message': f'Friend request sent to {target_username}'})
 
     # Notify the target user if online
-    if target_user_id in users:
+    target_sid = user_sids.get(account_users.get(target['id']))
+    if target_sid:
         emit('new_friend_request', {
+            'from_user_id': account_id,
             'from_user': users[user_id].get('username', 'Unknown'),
             'from_gender': users[user_id].get('gender', 'unknown')
-        }, room=target_user_id)
+        }, room=target_sid)
 
 @socketio.on('accept_friend')
 def handle_accept_friend(data):
     """Accept a friend request"""
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
+    account_id = users[user_id].get('account_id') if user_id and user_id in users else None
+    if not account_id:
         emit('friend_error', {'message': 'Please login first'})
         return
 
@@ -1189,52 +1560,187 @@ def handle_accept_friend(data):
         return
 
     # Check if request exists
-    if user_id not in friend_requests or from_user_id not in friend_requests[user_id]:
+    if not accounts.has_request(account_id, from_user_id):
         emit('friend_error', {'message': 'No friend request from this user'})
         return
 
-    # Remove from requests
-    friend_requests[user_id].remove(from_user_id)
-
-    # Add to friends
-    if user_id not in friends:
-        friends[user_id] = []
-    if from_user_id not in friends[user_id]:
-        friends[user_id].append(from_user_id)
+    accounts.accept(account_id, from_user_id)
 
-    if from_user_id not in friends:
-        friends[from_user_id] = []
-    if user_id not in friends[from_user_id]:
-        friends[from_user_id].append(user_id)
-
-    from_username = users.get(from_user_id, {}).get('username', 'Unknown')
+    from_account = accounts.get(from_user_id)
+    from_username = from_account['username'] if from_account else 'Unknown'
     emit('friend_accepted', {'message': f'You are now friends with {from_username}'})
 
 @socketio.on('get_friends')
 def handle_get_friends():
     """Get user's friends list"""
     user_id = session.get('user_id')
-    if not user_id or user_id not in users:
+    account_id = users[user_id].get('account_id') if user_id and user_id in users else None
+    if not account_id:
         emit('friend_error', {'message': 'Please login first'})
         return
 
-    user_friends = friends.get(user_id, [])
     friends_list = []
-
-    for friend_id in user_friends:
-        friend_info = {'id': friend_id}
-        if friend_id in users:
-            friend_info['username'] = users[friend_id].get('username', 'Unknown')
-            friend_info['gender'] = users[friend_id].get('gender', 'unknown')
-            friend_info['online'] = True
-        elif friend_id in registered_users:
-            friend_info['username'] = registered_users[friend_id].get('username', 'Unknown')
-            friend_info['gender'] = registered_users[friend_id].get('gender', 'unknown')
-            friend_info['online'] = False
-        friends_list.append(friend_info)
+    for friend_id, friend in accounts.get_many(accounts.friend_ids(account_id)).items():
+        friends_list.append({
+            'id': friend_id,
+            'username': friend.get('username', 'Unknown'),
+            'gender': friend.get('gender') or 'unknown',
+            'online': friend_id in account_users
+        })
 
     emit('friends_list', {'friends': friends_list})
 
+# ==================== GROUP ROOMS ====================
+
+def chat_room_channel(room_id):
+    """Socket.IO room for a group room's members (kept apart from 1-on-1 room ids)"""
+    return f'chatroom:{room_id}'
+
+def room_message_from_row(row):
+    """room_messages row -> the message dict clients get from the feed"""
+    created_at = row['created_at']
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return {
+        'room_id': row['room_id'],
+        'seq': row['seq'],
+        'user_id': row['user_id'],
+        'username': row.get('username'),
+        'content': row['content'],
+        'timestamp': created_at.replace(tzinfo=timezone.utc).timestamp()
+    }
+
+def load_room(room_id, limit):
+    """(last seq, recent messages) for RoomFeed.open, or None if the room doesn't exist"""
+    if not get_room_by_id(room_id):
+        return None
+    last_seq = get_room_last_seq(room_id)
+    rows = get_room_messages_after(room_id, max(last_seq - limit, 0), limit)
+    return last_seq, [room_message_from_row(row) for row in rows]
+
+# Group-room messages are persisted by their own write-behind journal
+room_journal = MessageJournal(
+    insert_room_messages,
+    interval=config.MESSAGE_JOURNAL_FLUSH_MS / 1000.0,
+    batch_rows=config.MESSAGE_JOURNAL_BATCH_ROWS,
+    max_rows=config.MESSAGE_JOURNAL_MAX_ROWS,
+    durability=config.MESSAGE_JOURNAL_DURABILITY,
+    max_attempts=config.MESSAGE_JOURNAL_MAX_ATTEMPTS
+)
+socketio.start_background_task(room_journal.run)
+atexit.register(room_journal.close)
+
+def emit_room_messages(room_id, messages):
+    socketio.emit('room_messages', {'room_id': room_id, 'messages': messages},
+                  room=chat_room_channel(room_id))
+
+def record_room_message(room_id, user_id, content, seq, now):
+    room_journal.record(room_id, user_id, content, seq,
+                        datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+
+# Messages reach members in one room_messages packet per room per interval;
+# joining clients are backfilled from the room's ring buffer. With shared
+# state, sequences and buffers live in the store and every worker's members
+# get the batches through the Socket.IO message queue.
+if state.shared:
+    if not config.SOCKETIO_MESSAGE_QUEUE:
+        print("WARNING: SOCKETIO_MESSAGE_QUEUE is not set, group-room messages only reach this worker's members")
+    room_feed = SharedRoomFeed(
+        state.client, emit_room_messages, load_room,
+        record=record_room_message,
+        buffer_size=config.ROOM_BUFFER_MESSAGES,
+        interval=config.ROOM_FANOUT_INTERVAL_MS / 1000.0,
+        prefix=f'{state.prefix}:rooms'
+    )
+else:
+    room_feed = RoomFeed(
+        emit_room_messages, load_room,
+        record=record_room_message,
+        buffer_size=config.ROOM_BUFFER_MESSAGES,
+        interval=config.ROOM_FANOUT_INTERVAL_MS / 1000.0
+    )
+socketio.start_background_task(room_feed.run, socketio.sleep)
+
+# Messages from before the search index existed are indexed in the background
+search_backfill = SearchBackfill(
+    backfill_message_search,
+    batch=config.SEARCH_BACKFILL_BATCH,
+    interval=config.SEARCH_BACKFILL_INTERVAL_MS / 1000.0
+)
+socketio.start_background_task(search_backfill.run, socketio.sleep)
+
+@socketio.on('join_chat_room')
+def handle_join_chat_room(data):
+    """Subscribe to a group room and get its history.
+
+    Without after_seq the client gets the buffered recent messages; with it,
+    only what came after (paged from the database if the buffer doesn't
+    reach back that far). Clients drop seqs they already have - a message
+    published while joining can arrive both here and in room_messages.
+    """
+    room_id = str(data.get('room_id') or '')
+    if not room_id or room_feed.open(room_id) is None:
+        emit('room_error', {'room_id': room_id, 'message': 'Room not found'})
+        return
+
+    after_seq = data.get('after_seq')
+    if after_seq is not None:
+        try:
+            after_seq = max(int(after_seq), 0)
+        except (TypeError, ValueError):
+            emit('room_error', {'room_id': room_id, 'message': 'Invalid after_seq'})
+            return
+
+    # Subscribe before reading the buffer so nothing falls in between
+    join_room(chat_room_channel(room_id))
+
+    if after_seq is None:
+        messages, complete = room_feed.recent(room_id), True
+    else:
+        messages, complete = room_feed.since(room_id, after_seq)
+        if not complete:
+            rows = get_room_messages_after(room_id, after_seq, config.ROOM_BACKFILL_LIMIT)
+            older = [room_message_from_row(row) for row in rows]
+            newest = older[-1]['seq'] if older else after_seq
+            messages = older + [message for message in messages if message['seq'] > newest]
+            complete = len(rows) < config.ROOM_BACKFILL_LIMIT
+
+    emit('room_history', {
+        'room_id': room_id,
+        'seq': room_feed.last_seq(room_id),
+        'messages': messages,
+        'complete': complete
+    })
+
+@socketio.on('leave_chat_room')
+def handle_leave_chat_room(data):
+    leave_room(chat_room_channel(str(data.get('room_id') or '')))
+
+@socketio.on('send_room_message')
+def handle_send_room_message(data):
+    user_id = session.get('user_id')
+    account_id = users[user_id].get('account_id') if user_id and user_id in users else None
+    if not account_id:
+        emit('room_error', {'message': 'Please login first'})
+        return
+
+    room_id = str(data.get('room_id') or '')
+    if chat_room_channel(room_id) not in rooms():
+        emit('room_error', {'room_id': room_id, 'message': 'Join the room first'})
+        return
+
+    if not check_rate_limit(get_client_ip(), 'message'):
+        emit('room_error', {'room_id': room_id, 'message': 'You are sending messages too fast. Please slow down.'})
+        return
+
+    message = str(data.get('message') or '').strip()
+    if not message:
+        return
+    if len(message) > Config.MAX_MESSAGE_LENGTH:
+        message = message[:Config.MAX_MESSAGE_LENGTH]
+
+    room_feed.publish(room_id, account_id, users[user_id].get('username'), message)
+
 def handle_next_partner_internal(user_id):
     if user_id not in users:
         return
@@ -1252,26 +1758,20 @@ def handle_next_partner_internal(user_id):
     partner_pref = user.get('partner_pref')
 
     if gender and partner_pref:
-        partner_id = find_partner(user_id, gender, partner_pref)
+        partner_id = find_partner(user_id, gender, partner_pref, user.get('country'), user.get('age'))
+        if partner_id is ALREADY_CLAIMED:
+            return
 
         if partner_id and partner_id in users:
-            room_id = create_chat_room(user_id, partner_id)
-
-            users[user_id]['partner_id'] = partner_id
-            users[user_id]['room'] = room_id
-
-            users[partner_id]['partner_id'] = user_id
-            users[partner_id]['room'] = room_id
-
-            join_room(room_id)
+            room_id, partner = pair_users(user_id, partner_id)
 
             emit('partner_found', {
                 'room': room_id,
-                'partner_gender': users[partner_id]['gender'],
-                'partner_name': users[partner_id].get('username', 'Stranger')
+                'partner_gender': partner['gender'],
+                'partner_name': partner.get('username', 'Stranger')
             }, room=room_id)
         else:
-            add_to_queue(user_id, gender, partner_pref)
+            add_to_queue(user_id, gender, partner_pref, user.get('country'), user.get('age'))
             emit('waiting', {'message': 'Looking for a stranger to chat with...'}, room=request.sid)
 
 # ==================== PAGE ROUTES ====================
@@ -1598,14 +2098,14 @@ def api_login():
     password = data.get('password', '')
 
     # Find user by email
-    for uid, user_data in registered_users.items():
-        if user_data.get('email', '').lower() == email:
-            # In production, verify password hash
-            session['user_id'] = uid
-            session['username'] = user_data['username']
-            session['login_time'] = time.time()
-            logger.info(f"User logged in: {user_data['username']} from {client_ip}")
-            return jsonify({'success': True})
+    user_data = get_user_by_email(email) if email else None
+    if user_data and user_data.get('password_hash') and \
+            offload(check_password_hash, user_data['password_hash'], password):
+        session['user_id'] = user_data['id']
+        session['username'] = user_data['username']
+        session['login_time'] = time.time()
+        logger.info(f"User logged in: {user_data['username']} from {client_ip}")
+        return jsonify({'success': True})
 
     logger.warning(f"Failed login attempt for {email} from {client_ip}")
     return jsonify({'success': False, 'message': 'Invalid credentials'}), 401
@@ -1636,19 +2136,18 @@ def api_register():
         return jsonify({'success': False, 'message': 'Password must be at least 6 characters'})
 
     # Check if email exists
-    for user_data in registered_users.values():
-        if user_data.get('email', '').lower() == email:
-            return jsonify({'success': False, 'message': 'Email already registered'})
+    if get_user_by_email(email):
+        return jsonify({'success': False, 'message': 'Email already registered'})
 
-    user_id = generate_user_id()
-    registered_users[user_id] = {
-        'username': username,
-        'email': email,
-        'gender': gender,
-        'created_at': time.time()
-    }
+    if accounts.find(username) is not None:
+        return jsonify({'success': False, 'message': 'Username already exists'})
 
-    session['user_id'] = user_id
+    account = accounts.register(username, gender, email=email,
+                                password_hash=offload(generate_password_hash, password))
+    if account is None:
+        return jsonify({'success': False, 'message': 'Username already exists'})
+
+    session['user_id'] = account['id']
     session['username'] = username
 
     return jsonify({'success': True})
@@ -1668,17 +2167,23 @@ def admin_page():
 # ==================== MESSAGE SEARCH API ====================
 
 @app.route('/api/messages/search')
-def search_messages():
-    """Search messages"""
+def search_user_messages():
+    """Search the user's messages, best match first; follow next_cursor for more"""
     query = request.args.get('q', '')
     user_id = session.get('user_id')
 
     if not user_id or not query:
         return jsonify({'success': False, 'messages': []})
 
-    # Search in messages
-    messages = database.search_messages(user_id, query)
-    return jsonify({'success': True, 'messages': messages})
+    _, limit = get_page_args(default_limit=20, max_limit=100)
+    try:
+        after = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
+    # Full-text index (search_index.py), one page past the cursor
+    messages, next_cursor = next_page(search_messages(user_id, query, limit + 1, after), limit, ('score', 'id'))
+    return jsonify({'success': True, 'messages': messages, 'next_cursor': next_cursor})
 
 @app.route('/api/admin/stats')
 def admin_stats():
@@ -1688,11 +2193,14 @@ def admin_stats():
 
 @app.route('/api/admin/users')
 def admin_users():
-    """Get all users"""
-    limit = int(request.args.get('limit', 50))
-    offset = int(request.args.get('offset', 0))
-    users = admin.get_all_users(limit, offset)
-    return jsonify({'success': True, 'data': users})
+    """Get all users, newest first; follow next_cursor for older pages"""
+    _, limit = get_page_args(default_limit=50)
+    try:
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    users, next_cursor = next_page(admin.get_all_users(limit + 1, before), limit)
+    return jsonify({'success': True, 'data': users, 'next_cursor': next_cursor})
 
 @app.route('/api/admin/users/<user_id>')
 def admin_user_detail(user_id):
@@ -1705,19 +2213,16 @@ def admin_user_detail(user_id):
 @app.route('/api/online/all')
 def get_all_online_users():
     """Get all online users including guests"""
-    from flask import jsonify
+    offset, limit = get_page_args(default_limit=100)
     users_list = []
     
-    # Get users from active_connections (includes both registered and guest users)
-    for sid, conn in active_connections.items():
-        username = conn.get('username') or 'Guest'
-        gender = conn.get('gender', 'unknown')
-        country = conn.get('country', '')
+    # Page straight out of the presence index (includes both registered and guest users)
+    for sid, conn in presence.list_users(offset, limit):
         users_list.append({
             'id': sid,
-            'username': username,
-            'gender': gender,
-            'country': country,
+            'username': conn.get('username') or 'Guest',
+            'gender': conn.get('gender') or 'unknown',
+            'country': conn.get('country') or '',
             'is_guest': conn.get('is_guest', False)
         })
     
@@ -1725,7 +2230,9 @@ def get_all_online_users():
         'success': True,
         'data': {
             'users': users_list,
-            'count': len(users_list)
+            'count': len(presence),
+            'offset': offset,
+            'limit': limit
         }
     })
 
@@ -1756,10 +2263,14 @@ def admin_delete_user(user_id):
 
 @app.route('/api/admin/messages')
 def admin_messages():
-    """Get recent messages"""
-    limit = int(request.args.get('limit', 100))
-    messages = admin.get_recent_messages(limit)
-    return jsonify({'success': True, 'data': messages})
+    """Get recent messages, newest first; follow next_cursor for older pages"""
+    _, limit = get_page_args(default_limit=100)
+    try:
+        before = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    messages, next_cursor = next_page(admin.get_recent_messages(limit + 1, before), limit)
+    return jsonify({'success': True, 'data': messages, 'next_cursor': next_cursor})
 
 @app.route('/api/admin/messages/<int:message_id>', methods=['DELETE'])
 def admin_delete_message(message_id):
@@ -1769,10 +2280,15 @@ def admin_delete_message(message_id):
 
 @app.route('/api/admin/messages/search')
 def admin_search_messages():
-    """Search messages"""
+    """Search messages, best match first; follow next_cursor for more"""
     query = request.args.get('q', '')
-    messages = admin.search_messages(query)
-    return jsonify({'success': True, 'data': messages})
+    _, limit = get_page_args(default_limit=50)
+    try:
+        after = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+    messages, next_cursor = next_page(admin.search_messages(query, limit + 1, after), limit, ('score', 'id'))
+    return jsonify({'success': True, 'data': messages, 'next_cursor': next_cursor})
 
 @app.route('/api/admin/reports')
 def admin_reports():
@@ -1834,43 +2350,33 @@ def get_online_count():
 @app.route('/api/online/users')
 def get_online_users_list():
     """Get list of online users (limited info for privacy)"""
+    offset, limit = get_page_args(default_limit=50)
     users_list = []
-    for sid, conn in active_connections.items():
-        if conn.get('username'):
-            users_list.append({
-                'id': conn.get('user_id'),
-                'username': conn.get('username', 'Anonymous'),
-                'gender': conn.get('gender', 'unknown'),
-                'country': conn.get('country', ''),
-                'room': conn.get('current_room', 'lobby')
-            })
+    for sid, conn in presence.list_users(offset, limit):
+        users_list.append({
+            'id': conn.get('user_id'),
+            'username': conn.get('username') or 'Anonymous',
+            'gender': conn.get('gender') or 'unknown',
+            'country': conn.get('country') or '',
+            'room': conn.get('room', 'lobby')
+        })
     
     return jsonify({
         'success': True,
         'data': {
-            'users': users_list[:50],  # Limit to 50 for performance
-            'count': len(users_list)
+            'users': users_list,
+            'count': len(presence),
+            'offset': offset,
+            'limit': limit
         }
     })
 
 @app.route('/api/rooms/stats')
 def get_room_stats():
     """Get chat room statistics with real user counts"""
-    room_stats = {}
-    
-    # Count users per room
-    for sid, conn in active_connections.items():
-        room_id = conn.get('current_room', 'lobby')
-        if room_id not in room_stats:
-            room_stats[room_id] = {'users': 0, 'gender_counts': {'male': 0, 'female': 0, 'other': 0}}
-        room_stats[room_id]['users'] += 1
-        gender = conn.get('gender', 'other')
-        if gender in room_stats[room_id]['gender_counts']:
-            room_stats[room_id]['gender_counts'][gender] += 1
-    
     return jsonify({
         'success': True,
-        'data': room_stats
+        'data': presence.room_stats()
     })
 
 # Admin Panel Routes
@@ -1887,10 +2393,7 @@ def load_content_data():
 
 def get_online_stats():
     """Get online user statistics"""
-    total = len(active_connections)
-    guests = sum(1 for c in active_connections.values() if c.get('is_guest'))
-    registered = total - guests
-    return {'total': total, 'guests': guests, 'registered': registered}
+    return presence.get_stats()
 
 @app.route('/api/debug/connections')
 def debug_connections():
@@ -1924,12 +2427,8 @@ def ping():
     """Keep-alive endpoint - updates user's last seen timestamp"""
     current_time = time.time()
     
-    # Try to find connection by session
-    sid = None
-    for conn_sid, conn in active_connections.items():
-        if conn.get('session_id') == session.get('sid'):
-            sid = conn_sid
-            break
+    # Find connection by session
+    sid = sessions.get(session.get('sid')) if session.get('sid') else None
     
     # Fall back to request.sid if available
     if not sid and hasattr(request, 'sid'):
@@ -1937,6 +2436,7 @@ def ping():
     
     if sid and sid in active_connections:
         active_connections[sid]['last_ping'] = current_time
+        connection_reaper.touch(sid, current_time)
         return jsonify({'success': True})
     
     return jsonify({'success': False, 'message': 'Not connected'})
@@ -2046,17 +2546,15 @@ def admin_panel():
     """Admin dashboard"""
     data = load_content_data()
     # Count online users by type
-    total = len(active_connections)
-    guests = sum(1 for c in active_connections.values() if c.get('is_guest'))
-    registered = total - guests
+    stats = get_online_stats()
     return render_template('admin.html', 
                          page='dashboard',
                          page_title='Dashboard',
                          faq_count=len(data.get('faqs', [])),
                          blog_count=len(data.get('blogs', [])),
-                         online_count=total,
-                         online_guests=guests,
-                         online_registered=registered)
+                         online_count=stats['total'],
+                         online_guests=stats['guests'],
+                         online_registered=stats['registered'])
 
 @app.route('/admin/edit/<page>')
 def edit_page(page):
@@ -2334,10 +2832,15 @@ def get_health_status():
     # Check database
     try:
         start = time.time()
-        db = get_db()
-        db.execute('SELECT 1')
+        with get_db() as conn:
+            conn.cursor().execute('SELECT 1')
         elapsed = (time.time() - start) * 1000
-        checks['database'] = {'status': 'healthy', 'response_time_ms': round(elapsed, 2)}
+        pool_stats = get_pool().get_stats()
+        checks['database'] = {
+            'status': 'warning' if pool_stats['in_use'] >= pool_stats['size'] else 'healthy',
+            'response_time_ms': round(elapsed, 2),
+            'pool': pool_stats
+        }
     except Exception as e:
         checks['database'] = {'status': 'error', 'message': str(e)}
         checks['overall'] = 'critical'
@@ -2370,13 +2873,24 @@ def get_health_status():
         pass
     
     # Check socket connections
-    total = len(active_connections)
-    guests = sum(1 for c in active_connections.values() if c.get('is_guest'))
+    stats = get_online_stats()
+    outbound_stats = outbound.get_stats()
     checks['socket'] = {
-        'status': 'healthy',
-        'total_connections': total,
-        'guests': guests,
-        'registered': total - guests
+        'status': 'warning' if outbound_stats['over_high_water'] else 'healthy',
+        'total_connections': stats['total'],
+        'guests': stats['guests'],
+        'registered': stats['registered'],
+        'typing': typing_tracker.get_stats(),
+        'matchmaking': matchmaker.get_stats(),
+        'journal': message_journal.get_stats(),
+        'outbound': outbound_stats,
+        'snapshot': snapshot.get_stats(),
+        'resume': resume.get_stats(),
+        'accounts': accounts.get_stats(),
+        'room_feed': room_feed.get_stats(),
+        'room_journal': room_journal.get_stats(),
+        'search_backfill': search_backfill.get_stats(),
+        'worker_lease': state.lease.get_stats() if state.lease else None
     }
     
     # Check uptime
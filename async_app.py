@@ -0,0 +1,19 @@
+# Green-thread entry point for the chat server
+# Runs the same Flask-SocketIO app on eventlet (default) or gevent, so idle
+# clients cost a green thread instead of an OS thread each.
+#
+#   gunicorn -k eventlet -w 1 --bind 0.0.0.0:$PORT async_app:app
+#   SOCKETIO_ASYNC_MODE=gevent gunicorn -k gevent -w 1 --bind 0.0.0.0:$PORT async_app:app
+#   python async_app.py
+import os
+
+os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'eventlet')
+
+from concurrency import monkey_patch, ASYNC_MODE
+
+monkey_patch(ASYNC_MODE)
+
+from app import app, socketio
+
+if __name__ == '__main__':
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,1411 @@
+# Benchmarks for the chat server's in-memory subsystems
+# Usage: python benchmark.py [name ...]    (runs everything when no name given)
+import io
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+GENDERS = ['male', 'female']
+PREFERENCES = ['any', 'opposite', 'same']
+
+
+def report(name, count, elapsed, unit):
+    """Print a single benchmark result line"""
+    rate = count / elapsed if elapsed else float('inf')
+    print(f'{name:<48} {rate:>14,.0f} {unit}/sec  ({count:,} in {elapsed * 1000:.1f} ms)')
+
+
+# ==================== MATCHMAKING ====================
+
+def bench_matchmaking(waiters=(10000, 100000), seed=42):
+    """Matches/sec with a pre-filled waiting pool, plus next-storm cancels"""
+    from matchmaking import MatchmakingEngine
+
+    for size in waiters:
+        rng = random.Random(seed)
+        engine = MatchmakingEngine()
+        for i in range(size):
+            engine.enqueue(f'w{i}', rng.choice(GENDERS), rng.choice(PREFERENCES))
+
+        seekers = [(f's{i}', rng.choice(GENDERS), rng.choice(PREFERENCES)) for i in range(size)]
+        matched = 0
+        start = time.perf_counter()
+        for user_id, gender, pref in seekers:
+            if engine.match(user_id, gender, pref) is None:
+                engine.enqueue(user_id, gender, pref)
+            else:
+                matched += 1
+        report(f'matchmaking: match ({size:,} waiting)', matched, time.perf_counter() - start, 'matches')
+
+        engine = MatchmakingEngine()
+        ids = [f'c{i}' for i in range(size)]
+        for user_id in ids:
+            engine.enqueue(user_id, rng.choice(GENDERS), rng.choice(PREFERENCES))
+        rng.shuffle(ids)
+        start = time.perf_counter()
+        for user_id in ids:
+            engine.cancel(user_id)
+        report(f'matchmaking: cancel ({size:,} waiting)', len(ids), time.perf_counter() - start, 'cancels')
+
+
+def bench_nearby(waiters=(10000, 100000), arrivals_per_sec=20, seconds=600, seed=42):
+    """Nearby matchmaking: matches/sec, then match quality and wait vs basic.
+
+    The simulation feeds both engines the same arrivals on a simulated clock
+    (sweeping once a second) and reports how many pairs share a country and
+    age band, and the waiters' time-to-match.
+    """
+    from matchmaking import MatchmakingEngine, NearbyMatchmaker, age_band
+
+    countries = ['US', 'GB', 'IN', 'PK', 'DE', 'BR', 'CA', 'AU', 'PH', 'NG'] + [f'C{i}' for i in range(30)]
+    weights = [20, 10, 10, 8, 6, 6, 5, 5, 4, 4] + [0.7] * 30
+
+    def profile(rng, i):
+        return (f'u{i}', rng.choice(GENDERS), rng.choice(PREFERENCES),
+                rng.choices(countries, weights)[0], rng.randint(18, 60))
+
+    for size in waiters:
+        rng = random.Random(seed)
+        engine = NearbyMatchmaker(clock=lambda: 0)
+        for i in range(size):
+            engine.enqueue(*profile(rng, i), now=-rng.uniform(0, 30))
+        seekers = [profile(rng, size + i) for i in range(size)]
+        matched = 0
+        start = time.perf_counter()
+        for user_id, gender, pref, country, age in seekers:
+            if engine.match(user_id, gender, pref, country, age) is None:
+                engine.enqueue(user_id, gender, pref, country, age)
+            else:
+                matched += 1
+        report(f'nearby: match ({size:,} waiting)', matched, time.perf_counter() - start, 'matches')
+
+    rng = random.Random(seed)
+    arrivals = []
+    for i in range(int(arrivals_per_sec * seconds)):
+        arrivals.append((rng.uniform(0, seconds),) + profile(rng, i))
+    arrivals.sort()
+    profiles = {a[1]: a for a in arrivals}
+
+    for name in ('basic', 'nearby'):
+        clock = {'now': 0.0}
+        engine = NearbyMatchmaker(clock=lambda: clock['now']) if name == 'nearby' else MatchmakingEngine()
+        joined, waits, pairs = {}, [], []
+
+        def paired(user_id, partner_id):
+            pairs.append((user_id, partner_id))
+            waits.append(clock['now'] - joined.pop(partner_id))
+            if user_id in joined:
+                waits.append(clock['now'] - joined.pop(user_id))
+
+        next_sweep = 1.0
+        for at, user_id, gender, pref, country, age in arrivals:
+            while name == 'nearby' and next_sweep <= at:
+                clock['now'] = next_sweep
+                for pair in engine.sweep():
+                    paired(*pair)
+                next_sweep += 1.0
+            clock['now'] = at
+            partner_id = engine.match(user_id, gender, pref, country, age)
+            if partner_id is None:
+                engine.enqueue(user_id, gender, pref, country, age)
+                joined[user_id] = at
+            else:
+                paired(user_id, partner_id)
+
+        same_country = sum(profiles[a][4] == profiles[b][4] for a, b in pairs)
+        same_band = sum(profiles[a][4] == profiles[b][4] and age_band(profiles[a][5]) == age_band(profiles[b][5])
+                        for a, b in pairs)
+        waits.sort()
+        print(f'nearby: {name:<6} {len(pairs):,} pairs, {same_country / len(pairs):>5.1%} same country, '
+              f'{same_band / len(pairs):>5.1%} same country+band, waiter p50 {waits[len(waits) // 2]:.1f} s, '
+              f'p95 {waits[int(len(waits) * 0.95)]:.1f} s, {len(engine):,} still waiting')
+
+
+# ==================== PRESENCE BROADCASTS ====================
+
+def bench_presence(clients=5000, churn_per_sec=(50, 500, 2000), seconds=10, interval=0.5, seed=42):
+    """Outbound packets/sec under connect/disconnect churn, per-event vs coalesced.
+
+    Every broadcast goes to the whole global room, so one emit costs one
+    packet per connected client. Time is simulated; nothing sleeps.
+    """
+    from broadcast import PresenceBroadcaster
+
+    for rate in churn_per_sec:
+        rng = random.Random(seed)
+        online = clients
+        emits = []
+        broadcaster = PresenceBroadcaster(lambda event, payload: emits.append(payload), interval=interval)
+
+        events = int(rate * seconds)
+        step = seconds / events
+        next_flush = interval
+        for i in range(events):
+            now = i * step
+            while now >= next_flush:
+                broadcaster.flush()
+                next_flush += interval
+            online += 1 if rng.random() < 0.5 else -1
+            broadcaster.mark('online', 'online_count_update', lambda n=online: {'total_online': n})
+        broadcaster.flush()
+
+        naive_packets = events * clients
+        coalesced_packets = len(emits) * clients
+        print(f'presence: {rate:>5} events/sec, {clients:,} clients -> '
+              f'per-event {naive_packets / seconds:>12,.0f} pkts/sec, '
+              f'coalesced {coalesced_packets / seconds:>10,.0f} pkts/sec '
+              f'({broadcaster.stats["unchanged"]} unchanged flushes skipped)')
+
+
+# ==================== STALE CONNECTION REAPER ====================
+
+def bench_soak(hours=24, connects_per_sec=5, session_secs=600, vanish_ratio=0.3,
+               timeout=300, tick=5, ping_every=25, ips=20000, seed=42):
+    """Simulated churn soak: tracked connections and IP windows stay bounded.
+
+    A share of clients vanish without a disconnect event (dropped mobile
+    sockets); only the reaper can clean those up. Time is simulated in
+    one-second steps; nothing sleeps.
+    """
+    from expiry import TimingWheel
+    from limiter import RateLimiter
+
+    rng = random.Random(seed)
+    reaper = TimingWheel(timeout, tick=tick, clock=lambda: 0)
+    limiter = RateLimiter(clock=lambda: 0)
+    connections = {}        # {sid: (ends_at, vanishes)}
+    pings = {}              # {second: [sid]} - next ping of each live client
+    next_sid = 0
+    peak = peak_ips = 0
+    reaped = 0
+    reap_time = 0.0
+
+    for now in range(hours * 3600):
+        for _ in range(connects_per_sec):
+            sid = next_sid
+            next_sid += 1
+            connections[sid] = (now + rng.expovariate(1 / session_secs), rng.random() < vanish_ratio)
+            reaper.touch(sid, now)
+            pings.setdefault(now + ping_every, []).append(sid)
+            limiter.check_rate_limit(rng.randrange(ips), 'connect', now)
+
+        # Live clients ping every ping_every seconds and disconnect cleanly
+        # when their session ends, unless they vanish
+        for sid in pings.pop(now, ()):
+            if sid not in connections:
+                continue
+            ends_at, vanishes = connections[sid]
+            if now < ends_at:
+                reaper.touch(sid, now)
+                pings.setdefault(now + ping_every, []).append(sid)
+            elif not vanishes:
+                del connections[sid]
+                reaper.cancel(sid)
+
+        if now % tick == 0:
+            start = time.perf_counter()
+            for sid in reaper.advance(now):
+                connections.pop(sid, None)
+                reaped += 1
+            limiter.evict_idle(now)
+            reap_time += time.perf_counter() - start
+
+        peak = max(peak, len(connections))
+        peak_ips = max(peak_ips, len(limiter))
+
+    total = next_sid
+    print(f'soak: {hours}h, {total:,} connections ({vanish_ratio:.0%} vanish) -> '
+          f'peak tracked {peak:,}, final {len(connections):,}, '
+          f'peak limiter keys {peak_ips:,}, final {len(limiter):,}')
+    report('soak: reaper advance', reaped, reap_time, 'expiries')
+
+
+# ==================== RATE LIMITER ====================
+
+def bench_ratelimit(keys=(1000, 100000), checks=500000, seed=42):
+    """Limiter checks/sec and memory per tracked key"""
+    from limiter import RateLimiter
+
+    for size in keys:
+        rng = random.Random(seed)
+        ips = [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(size)]
+        picks = [rng.choice(ips) for _ in range(checks)]
+        actions = [rng.choice(('message', 'request')) for _ in range(checks)]
+        limiter = RateLimiter()
+
+        start = time.perf_counter()
+        for ip, action in zip(picks, actions):
+            limiter.check_rate_limit(ip, action)
+        report(f'ratelimit: check ({size:,} keys)', checks, time.perf_counter() - start, 'checks')
+
+        limiter = RateLimiter()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for ip in ips:
+            limiter.check_rate_limit(ip, 'message', now=0)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print(f'ratelimit: {used / size:.0f} bytes per tracked key ({size:,} keys, excluding key strings)')
+
+
+def bench_shared_ratelimit(workers=4, keys=10000, checks=200000, sync_every=0.1, seed=42):
+    """Cluster-wide limiter over LocalRedis: check latency and sync cost.
+
+    Hits are spread over `workers` limiters sharing one store; simulated time
+    advances so each worker syncs every `sync_every` seconds.
+    """
+    from state_backend import LocalRedis
+    from limiter import SharedRateLimiter
+
+    rng = random.Random(seed)
+    client = LocalRedis()
+    limiters = [SharedRateLimiter(client) for _ in range(workers)]
+    ips = [f'10.0.{i >> 8 & 255}.{i & 255}' for i in range(keys)]
+    hits = [(rng.randrange(workers), rng.choice(ips)) for _ in range(checks)]
+    step = 60.0 / checks      # spread the run over one minute
+
+    check_time = sync_time = 0.0
+    next_sync = sync_every
+    for i, (worker, ip) in enumerate(hits):
+        now = i * step
+        if now >= next_sync:
+            start = time.perf_counter()
+            for limiter in limiters:
+                limiter.sync(now)
+            sync_time += time.perf_counter() - start
+            next_sync += sync_every
+        start = time.perf_counter()
+        limiters[worker].check_rate_limit(ip, 'message', now)
+        check_time += time.perf_counter() - start
+
+    syncs = sum(limiter.stats['syncs'] for limiter in limiters)
+    report(f'ratelimit: shared check ({workers} workers)', checks, check_time, 'checks')
+    print(f'ratelimit: {check_time / checks * 1e6:.1f} us per check, '
+          f'{sync_time / syncs * 1000:.2f} ms per sync ({syncs:,} syncs)')
+
+
+# ==================== IP BLOCK LIST ====================
+
+def bench_blocklist(ranges=100000, lookups=200000, seed=42):
+    """Bulk load time and lookups/sec for the handle_connect block check"""
+    from blocklist import BlockList
+    from limiter import BanList
+
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(ranges):
+        if rng.random() < 0.9:
+            prefixlen = rng.choice((16, 20, 24, 24, 28, 32, 32))
+            lines.append(f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}/{prefixlen}')
+        else:
+            lines.append(f'2001:db8:{rng.randrange(65536):x}:{rng.randrange(65536):x}::/{rng.choice((48, 56, 64))}')
+
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        f.write('# benchmark block list\n' + '\n'.join(lines) + '\n')
+    try:
+        blocklist = BlockList(path)
+        start = time.perf_counter()
+        loaded = blocklist.load()
+        report(f'blocklist: bulk load ({loaded:,} ranges)', loaded, time.perf_counter() - start, 'ranges')
+    finally:
+        os.remove(path)
+
+    bans = BanList()
+    for _ in range(1000):
+        bans.ban(f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.0/24', 3600)
+
+    ips = [f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}'
+           for _ in range(lookups)]
+    start = time.perf_counter()
+    blocked = sum(1 for ip in ips if blocklist.is_blocked(ip) or bans.is_banned(ip))
+    report(f'blocklist: connect check ({blocked:,} blocked)', lookups, time.perf_counter() - start, 'lookups')
+
+
+# ==================== MESSAGE DELIVERY ====================
+
+def bench_messages(messages=200000, seed=42):
+    """Messages/sec through the send_message delivery path, old vs new.
+
+    A Socket.IO emit to a room encodes the packet once and writes it to every
+    member; here a room is the two chat partners. The old path emitted twice
+    per message (each client got both copies) and logged at INFO.
+    """
+    rng = random.Random(seed)
+    words = ['hey', 'hi', 'how', 'are', 'you', 'from', 'where', 'lol', 'nice', 'ok', 'cool', 'what']
+    texts = [' '.join(rng.choice(words) for _ in range(rng.randint(1, 12))) for _ in range(1000)]
+    room = ['sid-a', 'sid-b']
+
+    log = logging.getLogger('benchmark.messages')
+    log.propagate = False
+    log.addHandler(logging.StreamHandler(io.StringIO()))
+    log.setLevel(logging.INFO)
+
+    def run(name, encode, deliver):
+        sent = {'packets': 0, 'bytes': 0}
+
+        def emit(event, payload):
+            packet = encode([event, payload])
+            sent['packets'] += len(room)
+            sent['bytes'] += len(packet) * len(room)
+
+        start = time.perf_counter()
+        for i in range(messages):
+            deliver(emit, texts[i % len(texts)])
+        elapsed = time.perf_counter() - start
+        report(f'messages: {name}', messages, elapsed, 'msgs')
+        print(f'messages: {name:<20} {sent["packets"] / messages:.0f} packets/msg, '
+              f'{sent["bytes"] / messages:.0f} bytes/msg')
+
+    def old(emit, message):
+        emit('new_message', {'message': message, 'sender': 'you', 'timestamp': time.time()})
+        emit('new_message', {'message': message, 'sender': 'partner', 'timestamp': time.time()})
+        log.info(f"Message sent by user to room {room}")
+
+    def new(emit, message):
+        emit('new_message', {'message': message, 'from': 'sid-a', 'timestamp': time.time()})
+        log.debug(f"Message sent by user to room {room}")
+
+    json_packet = lambda data: '42' + json.dumps(data, separators=(',', ':'))
+    run('old (2 emits, json)', json_packet, old)
+    run('new (1 emit, json)', json_packet, new)
+    try:
+        import msgpack
+    except ImportError:
+        print('messages: msgpack not installed, skipping binary mode')
+    else:
+        run('new (1 emit, msgpack)', msgpack.packb, new)
+
+
+# ==================== TYPING INDICATORS ====================
+
+def bench_typing(typists=2000, seconds=60, keys_per_sec=5, seed=42):
+    """Typing events forwarded vs received for bursty typists.
+
+    Each typist alternates bursts of keystrokes (one typing=True event per
+    key) with pauses; some pauses end with an explicit typing=False, others
+    just go quiet. Time is simulated in 100 ms steps.
+    """
+    from typing_indicator import TypingTracker
+
+    rng = random.Random(seed)
+    stopped = []
+    tracker = TypingTracker(lambda sid, room: stopped.append(sid), clock=lambda: 0)
+    # {sid: (burst_ends_at, pause_ends_at, sends_stop)}
+    plans = {f's{i}': (0, rng.uniform(0, 5), False) for i in range(typists)}
+
+    start = time.perf_counter()
+    for step in range(seconds * 10):
+        now = step / 10
+        for sid, (burst_end, pause_end, sends_stop) in plans.items():
+            if now < burst_end:
+                if rng.random() < keys_per_sec / 10:
+                    tracker.update(sid, f'room-{sid}', True, now)
+            elif now < pause_end:
+                if sends_stop:
+                    tracker.update(sid, f'room-{sid}', False, now)
+                    plans[sid] = (burst_end, pause_end, False)
+            else:
+                burst = rng.uniform(1, 10)
+                plans[sid] = (now + burst, now + burst + rng.uniform(2, 15), rng.random() < 0.5)
+        if step % 10 == 0:
+            tracker.expire(now)
+    elapsed = time.perf_counter() - start
+
+    stats = tracker.stats
+    report('typing: simulated events processed', stats['received'], elapsed, 'events')
+    print(f'typing: {stats["received"]:,} received -> {stats["forwarded"] + stats["timed_out"]:,} sent '
+          f'({stats["suppressed"]:,} suppressed, {stats["timed_out"]:,} idle stops)')
+
+
+# ==================== MESSAGE JOURNAL ====================
+
+def bench_journal(rows=50000, per_row=2000, batch_rows=(100, 500, 2000), seed=42):
+    """Rows/sec persisting chat messages: one commit per row vs batched journal"""
+    import database
+    from journal import MessageJournal
+
+    rng = random.Random(seed)
+    words = ['hey', 'hi', 'how', 'are', 'you', 'from', 'where', 'lol', 'nice', 'ok', 'cool', 'what']
+    data = [(f'room{i % 500}', f'user{i % 1000}', f'user{(i + 1) % 1000}', f'name{i % 1000}', '10.0.0.1',
+             ' '.join(rng.choice(words) for _ in range(rng.randint(1, 12))), f'2026-01-01T00:00:{i % 60:02d}')
+            for i in range(rows)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not database.USE_POSTGRES:
+            database.DB_FILE = os.path.join(tmp, 'journal.db')
+        database.init_database()
+
+        insert = ('INSERT INTO chat_messages (room_id, sender_id, receiver_id, sender_name, sender_ip, content, created_at) '
+                  'VALUES (' + ', '.join(['%s' if database.USE_POSTGRES else '?'] * 7) + ')')
+        start = time.perf_counter()
+        for row in data[:per_row]:
+            database.execute_query(insert, row)
+        report('journal: one commit per row', per_row, time.perf_counter() - start, 'rows')
+
+        for durability in ('off', 'normal', 'full'):
+            for size in batch_rows:
+                database.execute_query('DELETE FROM chat_messages')
+                journal = MessageJournal(database.insert_chat_messages, batch_rows=size,
+                                         max_rows=rows, durability=durability)
+                start = time.perf_counter()
+                for row in data:
+                    journal.record(*row)
+                queued = time.perf_counter() - start
+                journal.flush()
+                elapsed = time.perf_counter() - start
+                report(f'journal: {durability:<6} batches of {size:,}', rows, elapsed, 'rows')
+                print(f'journal: {"":<6} record() {queued / rows * 1e6:.2f} us/row, '
+                      f'{journal.stats["flushes"]} transactions')
+
+
+# ==================== SLOW CONSUMERS ====================
+
+def bench_outbound(clients=1000, slow_ratio=0.01, emits=5000, seed=42):
+    """Packets buffered for clients that stop reading, unbounded vs OutboundQueues.
+
+    One busy room: every emit goes to all members, healthy members drain
+    their queue each step, slow ones never do. Ticks run every 100 emits.
+    """
+    import queue
+    from socketio import packet
+    from engineio import packet as eio_packet
+    from outbound import OutboundQueues
+
+    rng = random.Random(seed)
+    mix = [('partner_typing', {'is_typing': True})] * 4 + [('online_count_update', {'total_online': 1})] * 2 + \
+          [('room_count_update', {'room_id': 'lobby', 'count': 1})] + [('new_message', {'message': 'hi'})] * 3
+    encoded = [eio_packet.Packet(eio_packet.MESSAGE, packet.Packet(packet.EVENT, data=list(event)).encode())
+               for event in mix]
+    plan = [rng.choice(encoded) for _ in range(emits)]
+    slow = set(rng.sample(range(clients), int(clients * slow_ratio)))
+
+    class Socket:
+        def __init__(self):
+            self.queue = queue.Queue()
+
+    class Eio:
+        def __init__(self):
+            self.sockets = {i: Socket() for i in range(clients)}
+
+        def disconnect(self, sid):
+            self.sockets.pop(sid, None)
+
+    class Server:
+        packet_class = packet.Packet
+
+        def __init__(self):
+            self.eio = Eio()
+            self._send_eio_packet = lambda sid, pkt: self.eio.sockets[sid].queue.put(pkt)
+            self._send_packet = self._send_eio_packet
+
+    for guarded in (False, True):
+        server = Server()
+        guard = OutboundQueues(server, slow_timeout=float('inf'), clock=lambda: 0)
+        if guarded:
+            guard.install()
+        peak = 0
+        start = time.perf_counter()
+        for i, pkt in enumerate(plan):
+            for sid in list(server.eio.sockets):
+                server._send_eio_packet(sid, pkt)
+            for sid, socket in server.eio.sockets.items():
+                if sid not in slow:
+                    socket.queue.queue.clear()
+            if guarded and i % 100 == 99:
+                guard.tick()
+            peak = max(peak, max((server.eio.sockets[sid].queue.qsize() for sid in slow
+                                  if sid in server.eio.sockets), default=0))
+        elapsed = time.perf_counter() - start
+        name = 'guarded' if guarded else 'unbounded'
+        report(f'outbound: {name} ({len(slow)} slow of {clients:,})', emits * clients, elapsed, 'sends')
+        print(f'outbound: {name:<9} peak {peak:,} packets queued per slow client, '
+              f'{guard.stats["dropped"]:,} dropped, {guard.stats["coalesced"]:,} coalesced, '
+              f'{guard.stats["evicted"]} evicted')
+
+
+# ==================== DATABASE POOL ====================
+
+def bench_db_pool(users=10000, queries=5000, threads=(1, 8), seed=42):
+    """Queries/sec through database.py: a new connection per query (the old get_db) vs the pool"""
+    import sqlite3
+    import threading
+    from contextlib import contextmanager
+    import database
+
+    if database.USE_POSTGRES:
+        print('db_pool: skipped (benchmarks the SQLite path; unset DATABASE_URL)')
+        return
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'pool.db')
+        database.init_database()
+        ids = [f'user{i:06d}' for i in range(users)]
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO users (id, username, gender) VALUES (?, ?, ?)',
+                             [(uid, uid, rng.choice(GENDERS)) for uid in ids])
+            conn.commit()
+        lookups = [rng.choice(ids) for _ in range(queries)]
+
+        @contextmanager
+        def connect_per_query():
+            conn = sqlite3.connect(database.DB_FILE, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA cache_size=-64000')
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+        def run(workers, work):
+            chunks = [lookups[i::workers] for i in range(workers)]
+            pool = [threading.Thread(target=lambda chunk=chunk: [work(uid) for uid in chunk]) for chunk in chunks]
+            start = time.perf_counter()
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+            return time.perf_counter() - start
+
+        pooled_get_db = database.get_db
+        for workers in threads:
+            for label, get_db in (('new connection', connect_per_query), ('pooled', pooled_get_db)):
+                database.get_db = get_db
+                try:
+                    elapsed = run(workers, database.get_user_by_id)
+                    report(f'db_pool: get_user_by_id, {label}, {workers}T', queries, elapsed, 'queries')
+                    elapsed = run(workers, lambda uid: database.get_stats())
+                    report(f'db_pool: get_stats (4 queries), {label}, {workers}T', queries, elapsed, 'calls')
+                finally:
+                    database.get_db = pooled_get_db
+        print(f'db_pool: {database.get_pool().get_stats()}')
+
+
+# ==================== QUERY LAYER ====================
+
+def bench_queries(users=10000, lookups=20000, page=1000, pages=200, seed=42):
+    """Per-query overhead: SQL picked per call + dict(row) (the old helpers) vs registered
+    statements + Records, both on pooled connections"""
+    import database
+
+    if database.USE_POSTGRES:
+        print('queries: skipped (benchmarks the SQLite path; unset DATABASE_URL)')
+        return
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'queries.db')
+        database.init_database()
+        ids = [f'user{i:06d}' for i in range(users)]
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO users (id, username, gender, last_seen) VALUES (?, ?, ?, ?)',
+                             [(uid, uid, rng.choice(GENDERS), f'{i:08d}') for i, uid in enumerate(ids)])
+            conn.commit()
+        sample = [rng.choice(ids) for _ in range(lookups)]
+
+        def old_fetch(query, params, many):
+            with database.get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                if many:
+                    return [dict(row) for row in cursor.fetchall()]
+                row = cursor.fetchone()
+                return dict(row) if row is not None else None
+
+        def old_get_user_by_id(user_id):
+            return old_fetch('SELECT * FROM users WHERE id = %s' if database.USE_POSTGRES
+                             else 'SELECT * FROM users WHERE id = ?', (user_id,), False)
+
+        def old_get_recent_users(limit):
+            return old_fetch("SELECT * FROM users ORDER BY COALESCE(last_seen, '') DESC, created_at DESC LIMIT %s"
+                             if database.USE_POSTGRES else
+                             "SELECT * FROM users ORDER BY COALESCE(last_seen, '') DESC, created_at DESC LIMIT ?",
+                             (limit,), True)
+
+        for label, get_user, get_recent in (('dict rows', old_get_user_by_id, old_get_recent_users),
+                                            ('registry + records', database.get_user_by_id,
+                                             database.get_recent_users)):
+            start = time.perf_counter()
+            for user_id in sample:
+                get_user(user_id)
+            elapsed = time.perf_counter() - start
+            report(f'queries: get_user_by_id, {label}', lookups, elapsed, 'queries')
+            print(f'queries: get_user_by_id, {label:<18} {elapsed / lookups * 1e6:.1f} us per call')
+
+            start = time.perf_counter()
+            for _ in range(pages):
+                get_recent(page)
+            report(f'queries: {page}-row page, {label}', pages * page, time.perf_counter() - start, 'rows')
+
+
+# ==================== BULK WRITES ====================
+
+def bench_bulk_writes(users=10000, members=2000, dms=2000, seed=42):
+    """Rows/sec for a commit per row vs the bulk APIs, and the send-message path as
+    separate calls vs one transaction"""
+    import database
+
+    if database.USE_POSTGRES:
+        print('bulk_writes: skipped (benchmarks the SQLite path; unset DATABASE_URL)')
+        return
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'bulk.db')
+        database.init_database()
+        ids = [f'user{i:06d}' for i in range(users)]
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO users (id, username, gender) VALUES (?, ?, ?)',
+                             [(uid, uid, rng.choice(GENDERS)) for uid in ids])
+            conn.executemany("INSERT INTO room_members (room_id, user_id, role) VALUES ('lobby', ?, 'member')",
+                             [(uid,) for uid in ids[:members]])
+            conn.commit()
+        recipients = ids[:members]
+
+        start = time.perf_counter()
+        for uid in recipients:
+            database.create_notification(uid, 'announcement', 'Announcement', 'Lobby event at 8pm')
+        report(f'bulk_writes: {members} notifications, row at a time', members, time.perf_counter() - start, 'rows')
+
+        start = time.perf_counter()
+        database.notify_users(recipients, 'announcement', 'Announcement', 'Lobby event at 8pm')
+        report(f'bulk_writes: {members} notifications, notify_users', members, time.perf_counter() - start, 'rows')
+
+        start = time.perf_counter()
+        database.notify_room_members('lobby', 'announcement', 'Announcement', 'Lobby event at 8pm')
+        report(f'bulk_writes: {members} notifications, notify_room_members', members,
+               time.perf_counter() - start, 'rows')
+
+        rows = [(rng.choice(ids), rng.choice(ids), None, f'message {i}') for i in range(members)]
+        start = time.perf_counter()
+        database.create_messages(rows)
+        report(f'bulk_writes: {members} messages, create_messages', members, time.perf_counter() - start, 'rows')
+
+        pairs = [(rng.choice(ids), rng.choice(ids)) for _ in range(dms)]
+
+        def separate(sender_id, receiver_id):
+            # The old send_message_api: four connections and two commits
+            database.create_message(sender_id, receiver_id, 'hi')
+            if database.get_user_by_id(receiver_id):
+                sender = database.get_user_by_id(sender_id)
+                database.create_notification(receiver_id, 'new_message', 'New Message',
+                                             f'{sender["username"]} sent you a message', '/inbox')
+
+        def unit_of_work(sender_id, receiver_id):
+            with database.transaction() as tx:
+                database.create_message(sender_id, receiver_id, 'hi', tx=tx)
+                users = {user['id']: user for user in database.get_users_by_ids({sender_id, receiver_id}, tx=tx)}
+                if receiver_id in users:
+                    database.create_notification(receiver_id, 'new_message', 'New Message',
+                                                 f'{users[sender_id]["username"]} sent you a message', '/inbox',
+                                                 tx=tx)
+
+        for label, send in (('separate calls', separate), ('one transaction', unit_of_work)):
+            checkouts = database.get_pool().get_stats()['checkouts']
+            start = time.perf_counter()
+            for sender_id, receiver_id in pairs:
+                send(sender_id, receiver_id)
+            elapsed = time.perf_counter() - start
+            report(f'bulk_writes: send message, {label}', dms, elapsed, 'messages')
+            print(f'bulk_writes: send message, {label:<15} '
+                  f'{(database.get_pool().get_stats()["checkouts"] - checkouts) / dms:.1f} connections per message')
+
+
+# ==================== PAGINATION ====================
+
+def bench_pagination(rows=10_000_000, page=50, depths=(1_000, 100_000, 1_000_000, 5_000_000), receivers=1000,
+                     repeat=3):
+    """Page fetch time by depth on a large messages table: LIMIT/OFFSET (the old listings)
+    vs keyset cursors, for the admin message list and one user's inbox"""
+    import database
+    from admin import admin
+
+    if database.USE_POSTGRES:
+        print('pagination: skipped (benchmarks the SQLite path; unset DATABASE_URL)')
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'pages.db')
+        database.init_database()
+        start = time.perf_counter()
+        chunk = 1_000_000
+        with database.get_db() as conn:
+            # Three messages per second, so created_at ties are common
+            for first in range(0, rows, chunk):
+                conn.execute("""
+                    WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+                    INSERT INTO messages (sender_id, receiver_id, content, created_at)
+                    SELECT 'user' || (i * 7 % ?), 'user' || (i % ?), 'message ' || i,
+                           datetime('2026-01-01', '+' || (i / 3) || ' seconds')
+                    FROM n
+                """, (first, min(first + chunk, rows), receivers, receivers))
+                conn.commit()
+        print(f'pagination: filled {rows:,} messages in {time.perf_counter() - start:.1f} s')
+
+        def timed(fetch):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fetch()
+            return (time.perf_counter() - start) / repeat * 1000
+
+        offset_sql = """
+            SELECT m.*, u1.username as sender_name, u2.username as receiver_name
+            FROM messages m
+            LEFT JOIN users u1 ON m.sender_id = u1.id
+            LEFT JOIN users u2 ON m.receiver_id = u2.id
+            ORDER BY m.created_at DESC
+            LIMIT ? OFFSET ?
+        """
+        for depth in depths:
+            if depth >= rows:
+                continue
+            key = tuple(database.fetch_one(
+                'SELECT created_at, rowid FROM messages ORDER BY created_at DESC, rowid DESC LIMIT 1 OFFSET ?',
+                (depth - 1,)))
+            offset_ms = timed(lambda: database.fetch_all(offset_sql, (page, depth)))
+            keyset_ms = timed(lambda: admin.get_recent_messages(page, key))
+            print(f'pagination: admin messages at row {depth:>10,}  OFFSET {offset_ms:>9.2f} ms/page  '
+                  f'keyset {keyset_ms:>6.2f} ms/page')
+
+        # One user's whole inbox (rows / receivers messages), page by page
+        inbox = 'user7'
+        total = database.fetch_value('SELECT COUNT(*) FROM messages WHERE receiver_id = ?', (inbox,))
+        start = time.perf_counter()
+        for offset in range(0, total, page):
+            database.fetch_all('SELECT * FROM messages WHERE receiver_id = ? ORDER BY created_at DESC LIMIT ? OFFSET ?',
+                               (inbox, page, offset))
+        offset_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        before, fetched = None, 0
+        while True:
+            batch = database.get_messages(inbox, 'received', page, before)
+            fetched += len(batch)
+            if len(batch) < page:
+                break
+            before = (batch[-1]['created_at'], batch[-1]['id'])
+        keyset_elapsed = time.perf_counter() - start
+        pages = -(-total // page)
+        report(f'pagination: inbox of {total:,}, OFFSET', pages, offset_elapsed, 'pages')
+        report(f'pagination: inbox of {fetched:,}, keyset', pages, keyset_elapsed, 'pages')
+
+
+# ==================== MESSAGE SEARCH ====================
+
+def bench_search(rows=10_000_000, users=1000, page=50, repeat=3, backfill_rows=200_000):
+    """Search latency on a large messages table: content LIKE (the old search) vs the
+    full-text index, for rare to common words, plus backfill throughput"""
+    import database
+    from queries import next_page
+    from search_index import fts5_query, search_terms
+
+    if database.USE_POSTGRES:
+        print('search: skipped (benchmarks the SQLite path; unset DATABASE_URL)')
+        return
+    if not database.FULL_TEXT_SEARCH:
+        print('search: skipped (this SQLite build has no FTS5)')
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_FILE = os.path.join(tmp, 'search.db')
+        database.init_database()
+        start = time.perf_counter()
+        chunk = 1_000_000
+        # Six words a message from 10k, picked by two multiplicative hashes of the
+        # row and position: w<k> turns up about ln(10000 / k) times as often as
+        # w9999, so w0 is common and w9990 rare
+        words = [f"'w' || ((i * 2654435761 + {k * 40503}) % 4294967291 % "
+                 f"(1 + (i * 2246822519 + {k * 97}) % 4294967279 % 10000))" for k in range(6)]
+        with database.get_db() as conn:
+            for first in range(0, rows, chunk):
+                conn.execute(f"""
+                    WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+                    INSERT INTO messages (sender_id, receiver_id, content)
+                    SELECT 'user' || (i * 7 % ?), 'user' || (i % ?),
+                           {" || ' ' || ".join(words)}
+                    FROM n
+                """, (first, min(first + chunk, rows), users, users))
+                conn.commit()
+        print(f'search: filled and indexed {rows:,} messages in {time.perf_counter() - start:.1f} s')
+
+        like_sql = """
+            SELECT m.*, u1.username as sender_name
+            FROM messages m
+            LEFT JOIN users u1 ON m.sender_id = u1.id
+            WHERE m.content LIKE ?
+            ORDER BY m.created_at DESC
+            LIMIT ?
+        """
+
+        def timed(fetch):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = fetch()
+            return (time.perf_counter() - start) / repeat * 1000, result
+
+        for label, query in (('common', 'w0'), ('medium', 'w50'), ('rare', 'w9990'), ('two words', 'w3 w7')):
+            matches = database.fetch_value('SELECT COUNT(*) FROM messages_fts WHERE messages_fts MATCH ?',
+                                           (fts5_query(search_terms(query)),))
+            like_ms, _ = timed(lambda: database.fetch_all(like_sql, (f'%{query}%', page)))
+            fts_ms, found = timed(lambda: database.search_messages(None, query, page))
+            user_ms, _ = timed(lambda: database.search_messages('user7', query, page))
+            print(f'search: {label:<9} {query!r:<9} {matches:>7,} matches  LIKE {like_ms:>8.1f} ms  '
+                  f'full-text {fts_ms:>7.1f} ms  one user {user_ms:>7.1f} ms  ({len(found)} results)')
+
+        # A deep page costs the same as the first: ranking is over every match either way
+        after, pages = None, 0
+        start = time.perf_counter()
+        while pages < 20:
+            results, cursor = next_page(database.search_messages(None, 'w0', page + 1, after), page, ('score', 'id'))
+            pages += 1
+            if cursor is None:
+                break
+            after = (results[-1]['score'], results[-1]['id'])
+        report(f'search: {pages} pages of w0', pages, time.perf_counter() - start, 'pages')
+
+        # Backfill: forget the index for the oldest rows and index them again
+        with database.get_db() as conn:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+            conn.execute("UPDATE search_index_state SET end_id = ?, last_id = 0 WHERE name = 'messages'",
+                         (backfill_rows,))
+            conn.commit()
+        start = time.perf_counter()
+        left = True
+        while left:
+            _, left = database.backfill_message_search(5000)
+        report('search: backfill, batches of 5,000', backfill_rows, time.perf_counter() - start, 'rows')
+
+
+# ==================== GROUP ROOMS ====================
+
+def bench_rooms(members=1000, messages_per_sec=(20, 200), seconds=10, interval=0.05, history=10000, seed=42):
+    """Group-room fan-out to 1k members: one emit per message vs RoomFeed batches, and
+    backfill from the ring buffer vs the room_messages query"""
+    import socketio
+    import database
+    from room_feed import RoomFeed
+
+    rng = random.Random(seed)
+    server = socketio.Server(async_mode='threading')
+    sent = {'packets': 0, 'bytes': 0}
+    sizes = {}
+
+    def send_eio_packet(eio_sid, pkt):
+        # The manager encodes once per emit and reuses the packet for every member
+        size = sizes.get(id(pkt))
+        if size is None:
+            size = sizes[id(pkt)] = len(pkt.encode())
+        sent['packets'] += 1
+        sent['bytes'] += size
+
+    server._send_eio_packet = send_eio_packet
+    for i in range(members):
+        sid = server.manager.connect(f'eio{i}', '/')
+        server.manager.enter_room(sid, '/', 'chatroom:lobby')
+
+    def message(seq, now):
+        return {'room_id': 'lobby', 'seq': seq, 'user_id': f'u{rng.randrange(members)}',
+                'username': 'someone', 'content': 'hello everyone ' * rng.randint(1, 4), 'timestamp': now}
+
+    for rate in messages_per_sec:
+        count = rate * seconds
+        arrivals = sorted(rng.uniform(0, seconds) for _ in range(count))
+
+        sent.update(packets=0, bytes=0)
+        start = time.perf_counter()
+        for seq, now in enumerate(arrivals, 1):
+            server.emit('room_message', message(seq, now), room='chatroom:lobby')
+        elapsed = time.perf_counter() - start
+        report(f'rooms: {rate}/s per-message emit', sent['packets'], elapsed, 'packets')
+        print(f'rooms: {rate}/s per-message emit   {sent["packets"] / seconds / members:,.1f} packets/s per member, '
+              f'{sent["bytes"] / seconds / 1e6:,.1f} MB/s')
+
+        sent.update(packets=0, bytes=0)
+        feed = RoomFeed(lambda room_id, batch: server.emit('room_messages', {'room_id': room_id, 'messages': batch},
+                                                          room=f'chatroom:{room_id}'),
+                        lambda room_id, limit: (0, []), interval=interval)
+        feed.open('lobby')
+        start = time.perf_counter()
+        next_flush = interval
+        for now in arrivals:
+            while now >= next_flush:
+                feed.flush()
+                next_flush += interval
+            message_ = message(0, now)
+            feed.publish('lobby', message_['user_id'], message_['username'], message_['content'], now)
+        feed.flush()
+        elapsed = time.perf_counter() - start
+        report(f'rooms: {rate}/s batched every {int(interval * 1000)} ms', sent['packets'], elapsed, 'packets')
+        print(f'rooms: {rate}/s batched              {sent["packets"] / seconds / members:,.1f} packets/s per member, '
+              f'{sent["bytes"] / seconds / 1e6:,.1f} MB/s')
+
+    # Backfill for a joining client: the room's buffer vs the polled JOIN
+    with tempfile.TemporaryDirectory() as tmp:
+        if not database.USE_POSTGRES:
+            database.DB_FILE = os.path.join(tmp, 'rooms.db')
+        database.init_database()
+        mark = '%s' if database.USE_POSTGRES else '?'
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(f'INSERT INTO users (id, username) VALUES ({mark}, {mark})',
+                               [(f'u{i}', f'user{i}') for i in range(members)])
+            cursor.executemany(f'INSERT INTO room_messages (room_id, user_id, content, seq, created_at) '
+                               f'VALUES ({mark}, {mark}, {mark}, {mark}, {mark})',
+                               [(f'room{seq % 20}', f'u{rng.randrange(members)}', 'hello', seq // 20 + 1,
+                                 f'2026-01-01T00:00:{seq % 60:02d}.{seq:06d}') for seq in range(history * 20)])
+            conn.commit()
+
+        joins = 100
+        start = time.perf_counter()
+        for _ in range(joins):
+            database.get_room_messages('room0', 100)
+        report('rooms: backfill via room_messages query', joins, time.perf_counter() - start, 'joins')
+
+        feed = RoomFeed(lambda room_id, batch: None, lambda room_id, limit: (history, [message(seq, 0) for seq in
+                                                                                      range(history - limit + 1, history + 1)]))
+        feed.open('room0')
+        start = time.perf_counter()
+        for _ in range(joins):
+            feed.recent('room0')
+        report('rooms: backfill via ring buffer', joins, time.perf_counter() - start, 'joins')
+
+
+# ==================== ACCOUNTS ====================
+
+def bench_accounts(accounts=10000, friends_per_user=10, lookups=3000, warm=5000, seed=42):
+    """Friend checks and username lookups: straight from the database vs through the account cache"""
+    import database
+    from accounts import AccountStore
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        if not database.USE_POSTGRES:
+            database.DB_FILE = os.path.join(tmp, 'accounts.db')
+        database.init_database()
+
+        mark = '%s' if database.USE_POSTGRES else '?'
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            ids = [f'acct{i:06d}' for i in range(accounts)]
+            cursor.executemany(f'INSERT INTO users (id, username, gender, last_seen) VALUES ({mark}, {mark}, {mark}, {mark})',
+                               [(uid, f'user{i}', rng.choice(GENDERS), f'2026-01-01T{accounts - i:08d}')
+                                for i, uid in enumerate(ids)])
+            edges = {(a, b) for a in ids for b in rng.sample(ids, friends_per_user) if a < b}
+            cursor.executemany(f"INSERT INTO friends (user_id, friend_id, status) VALUES ({mark}, {mark}, 'accepted')",
+                               sorted(edges))
+            conn.commit()
+
+        # Skewed traffic: most lookups are for the recently active users warm() loads
+        hot = ids[:warm]
+        pairs = [(rng.choice(hot) if rng.random() < 0.9 else rng.choice(ids), rng.choice(ids)) for _ in range(lookups)]
+        names = [f'user{rng.randrange(warm) if rng.random() < 0.9 else rng.randrange(accounts)}' for _ in range(lookups)]
+
+        start = time.perf_counter()
+        for a, b in pairs:
+            b in database.get_friend_ids(a)
+        report('accounts: are_friends via database', lookups, time.perf_counter() - start, 'checks')
+        start = time.perf_counter()
+        for name in names:
+            database.get_user_by_username_key(name)
+        report('accounts: username lookup via database', lookups, time.perf_counter() - start, 'lookups')
+
+        store = AccountStore(capacity=warm * 2)
+        start = time.perf_counter()
+        loaded = store.warm(warm)
+        report('accounts: warm-up (batched)', loaded, time.perf_counter() - start, 'accounts')
+        start = time.perf_counter()
+        for a, b in pairs:
+            store.are_friends(a, b)
+        report('accounts: are_friends via cache', lookups, time.perf_counter() - start, 'checks')
+        start = time.perf_counter()
+        for name in names:
+            store.find(name)
+        report('accounts: username lookup via cache', lookups, time.perf_counter() - start, 'lookups')
+        stats = store.get_stats()
+        print(f'accounts: hit rate friends {stats["friends"]["hit_rate"]}, names {stats["names"]["hit_rate"]}')
+
+
+# ==================== WARM RESTART ====================
+
+def bench_snapshot(users=100000, friends_per_user=5, seed=42):
+    """Snapshot save/restore time for the in-memory tables, and the event-loop stall while saving.
+
+    A ticker thread sleeping 1 ms stands in for the event loop; its lateness
+    is measured at rest and while save() runs in another thread.
+    """
+    import pickle
+    import threading
+    import uuid
+    from snapshot import StateSnapshot
+
+    rng = random.Random(seed)
+    ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(users)]
+    registered_users = {uid: {'username': f'user{i}', 'gender': rng.choice(GENDERS), 'age': str(rng.randint(18, 60)),
+                              'country': rng.choice(['US', 'GB', 'DE', 'IN', 'BR']), 'state': '',
+                              'created_at': 1767225600.0 + i, 'ip': f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'}
+                        for i, uid in enumerate(ids)}
+    tables = {
+        'registered_users': registered_users,
+        'registered_usernames': {data['username']: uid for uid, data in registered_users.items()},
+        'used_usernames': {f'guest{i}': None if i % 2 else 1767225600.0 + i for i in range(users)},
+        'friends': {uid: rng.sample(ids, friends_per_user) for uid in ids[:users // 2]},
+        'friend_requests': {uid: rng.sample(ids, 2) for uid in ids[:users // 10]},
+    }
+    rows = sum(len(table) for table in tables.values())
+
+    def lateness(during):
+        """Ticker lateness (ms) while `during` runs in this thread"""
+        late, done = [], threading.Event()
+
+        def tick():
+            while not done.is_set():
+                start = time.perf_counter()
+                time.sleep(0.001)
+                late.append((time.perf_counter() - start - 0.001) * 1000)
+
+        ticker = threading.Thread(target=tick)
+        ticker.start()
+        time.sleep(0.05)
+        late.clear()
+        during()
+        done.set()
+        ticker.join()
+        late.sort()
+        return late[len(late) // 2], late[int(len(late) * 0.99)], late[-1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'state.snapshot')
+        snapshot = StateSnapshot(path, tables)
+        for name, during in (('idle', lambda: time.sleep(1.0)), ('saving', lambda: snapshot.save(force=True))):
+            p50, p99, worst = lateness(during)
+            print(f'snapshot: loop lateness {name:<7} p50 {p50:.2f} ms  p99 {p99:.2f} ms  max {worst:.2f} ms')
+        report(f'snapshot: save ({os.path.getsize(path) / 1e6:.1f} MB)', rows, snapshot.stats['last_save_ms'] / 1000, 'rows')
+
+        restored = StateSnapshot(path, {name: type(table)() for name, table in tables.items()})
+        start = time.perf_counter()
+        restored.restore()
+        report('snapshot: restore', rows, time.perf_counter() - start, 'rows')
+        assert restored.tables == tables
+
+        blob = pickle.dumps(tables, pickle.HIGHEST_PROTOCOL)
+        start = time.perf_counter()
+        pickle.loads(blob)
+        report(f'snapshot: pickle.loads of the dicts ({len(blob) / 1e6:.1f} MB)', rows,
+               time.perf_counter() - start, 'rows')
+
+
+# ==================== SESSION RESUME ====================
+
+def bench_resume(pairs=10000, blip_ratio=0.3, mean_outage=4.0, window=10.0, messages_per_outage=3, seed=42):
+    """Chats that survive a dropped connection, and the cost of holding slots.
+
+    A `blip_ratio` share of paired users lose their connection for an
+    exponentially distributed outage (mean `mean_outage` s) while their
+    partner keeps typing; the rest of the run is virtual time.
+    """
+    from resume import ResumeWindow
+
+    rng = random.Random(seed)
+    now = [0.0]
+    resume = ResumeWindow(window, buffer_size=50, clock=lambda: now[0])
+    blips = sorted((rng.uniform(0, 600), f'user{i}', rng.expovariate(1.0 / mean_outage))
+                   for i in range(int(pairs * 2 * blip_ratio)))
+    returns = []
+    start = time.perf_counter()
+    for when, user_id, outage in blips:
+        now[0] = when
+        resume.hold(user_id, f'token-{user_id}', 'session')
+        for _ in range(messages_per_outage):
+            resume.buffer(user_id, 'new_message', {'message': 'hi'})
+        returns.append((when + outage, user_id))
+    returns.sort()
+    for when, user_id in returns:
+        now[0] = when
+        resume.expire(when)
+        resume.claim(f'token-{user_id}', 'session')
+    resume.expire(now[0] + window * 2)
+    elapsed = time.perf_counter() - start
+
+    stats = resume.get_stats()
+    report('resume: hold + buffer + claim/expire', len(blips), elapsed, 'drops')
+    print(f'resume: {len(blips):,} drops, {stats["resumed"]:,} resumed within {window:.0f}s, '
+          f'{stats["expired"]:,} released; {stats["resumed"] * 2:,} find_partner calls avoided, '
+          f'{stats["replayed"]:,} messages replayed')
+
+
+# ==================== CONNECTION CAPACITY ====================
+
+# How bench_capacity starts each serving mode: app.py on its threading
+# server (one OS thread per client) or async_app.py on green threads. Each
+# runs in a subprocess on a throwaway database with in-process state, with
+# online counts broadcast once a minute so the clients measure what holding
+# a connection costs rather than the count fan-out (see bench_presence).
+CAPACITY_SERVERS = {
+    'threading': ['-c', "import os, app; app.socketio.run(app.app, host='127.0.0.1', "
+                        "port=int(os.environ['PORT']), allow_unsafe_werkzeug=True)"],
+    # eventlet.wsgi accepts 1024 connections unless max_size says otherwise
+    'eventlet': ['-c', "import os, async_app; async_app.socketio.run(async_app.app, host='127.0.0.1', "
+                       "port=int(os.environ['PORT']), max_size=100000)"],
+    'gevent': ['async_app.py'],
+}
+
+
+class IdleSocketClient:
+    """A browser that logs in as a guest, opens the Socket.IO websocket and sits idle.
+
+    Speaks Engine.IO v4 over a raw socket with wsproto: the handshake is
+    blocking, then pump() answers the server's pings so the connection
+    stays open for as long as the benchmark holds it.
+    """
+
+    def __init__(self, port, index, user_agent):
+        self.port = port
+        self.ip = f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}'
+        self.user_agent = user_agent
+        self.sock = None
+        self.ws = None
+        self.text = []
+
+    def _login(self):
+        """Session cookie of a verified guest"""
+        import http.client
+        import urllib.parse
+
+        http = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        try:
+            http.request('POST', '/guest-login', urllib.parse.urlencode({
+                'username': f'idle-{self.ip}', 'gender': 'male', 'age': '25', 'country': 'US'
+            }), {'Content-Type': 'application/x-www-form-urlencoded', 'User-Agent': self.user_agent,
+                 'X-Forwarded-For': self.ip})
+            response = http.getresponse()
+            response.read()
+            return '; '.join(c.split(';', 1)[0] for c in response.msg.get_all('Set-Cookie') or [])
+        finally:
+            http.close()
+
+    def connect(self):
+        """Open the websocket and join the default namespace; raises on refusal"""
+        import socket
+        from wsproto import ConnectionType, WSConnection
+        from wsproto.events import AcceptConnection, Message, RejectConnection, Request
+
+        cookie = self._login()
+        self.sock = socket.create_connection(('127.0.0.1', self.port), timeout=30)
+        self.ws = WSConnection(ConnectionType.CLIENT)
+        self.sock.sendall(self.ws.send(Request(
+            host=f'127.0.0.1:{self.port}', target='/socket.io/?EIO=4&transport=websocket',
+            extra_headers=[(b'user-agent', self.user_agent.encode()), (b'x-forwarded-for', self.ip.encode()),
+                           (b'cookie', cookie.encode())])))
+        accepted = joined = False
+        while not joined:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError('closed during handshake')
+            self.ws.receive_data(data)
+            for event in self.ws.events():
+                if isinstance(event, RejectConnection):
+                    raise ConnectionError(f'websocket rejected ({event.status_code})')
+                if isinstance(event, AcceptConnection):
+                    accepted = True
+                elif isinstance(event, Message) and accepted:
+                    packet = self._packet(event)
+                    if packet is None:
+                        continue
+                    if packet.startswith('0'):
+                        self.sock.sendall(self.ws.send(Message(data='40')))
+                    elif packet.startswith(('40', '42["connected"')):
+                        # handle_connect's 'connected' event can beat the namespace ack
+                        joined = True
+                    elif packet.startswith('44'):
+                        raise ConnectionError(f'connect refused: {packet[2:]}')
+        self.sock.setblocking(False)
+
+    def _packet(self, event):
+        """Whole text packet once its last fragment has arrived"""
+        self.text.append(event.data if isinstance(event.data, str) else '')
+        if not event.message_finished:
+            return None
+        packet, self.text = ''.join(self.text), []
+        return packet
+
+    def pump(self):
+        """Read what the server sent and answer pings; False once the server has closed"""
+        from wsproto.events import CloseConnection, Message, Ping
+
+        try:
+            data = self.sock.recv(262144)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        if not data:
+            return False
+        self.ws.receive_data(data)
+        replies = []
+        for event in self.ws.events():
+            if isinstance(event, Message):
+                if self._packet(event) == '2':
+                    replies.append(self.ws.send(Message(data='3')))
+            elif isinstance(event, Ping):
+                replies.append(self.ws.send(event.response()))
+            elif isinstance(event, CloseConnection):
+                return False
+        if replies:
+            try:
+                self.sock.sendall(b''.join(replies))
+            except OSError:
+                return False
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+
+def bench_capacity(clients=(1000, 5000, 15000), modes=('threading', 'eventlet', 'gevent'), settle=2.0):
+    """Idle Socket.IO clients each serving mode holds, and server RSS per connection"""
+    import resource
+    import selectors
+    import socket
+    import urllib.request
+    from loadtest import USER_AGENT
+
+    # Each client is a socket here and a socket (and, threaded, a thread) in the server
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    root = os.path.dirname(os.path.abspath(__file__))
+
+    def server_rss(pid):
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    for mode in modes:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        workdir = tempfile.mkdtemp(prefix='capacity-')
+        env = dict(os.environ, PORT=str(port), SOCKETIO_ASYNC_MODE=mode,
+                   DATABASE_URL=os.path.join(workdir, 'chat_online.db'), LOG_FILE=os.path.join(workdir, 'chat.log'),
+                   REDIS_URL='', STATE_BACKEND_URL='', SOCKETIO_MESSAGE_QUEUE='', RATELIMIT_STORAGE_URL='',
+                   SNAPSHOT_PATH='', PRESENCE_BROADCAST_INTERVAL_MS='60000')
+        # The server logs every request; a file, unlike a pipe, never fills up and blocks it
+        errors = open(os.path.join(workdir, 'server.err'), 'w+')
+        server = subprocess.Popen([sys.executable] + CAPACITY_SERVERS[mode], cwd=root, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=errors,
+                                  preexec_fn=lambda: resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard)))
+        held, selector = [], selectors.DefaultSelector()
+        try:
+            deadline = time.time() + 60
+            while True:
+                if server.poll() is not None:
+                    errors.seek(0)
+                    reason = errors.read().strip().splitlines()
+                    raise RuntimeError(reason[-1] if reason else f'exited with {server.returncode}')
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1).read()
+                    break
+                except OSError:
+                    if time.time() > deadline:
+                        raise RuntimeError('did not start within 60 s')
+                    time.sleep(0.2)
+            baseline = server_rss(server.pid)
+
+            def pump(timeout):
+                for key, _ in selector.select(timeout):
+                    if not key.data.pump():
+                        selector.unregister(key.fileobj)
+                        held.remove(key.data)
+                        key.data.close()
+
+            failure = None
+            for target in clients:
+                start = time.perf_counter()
+                while len(held) < target and failure is None:
+                    client = IdleSocketClient(port, len(held) + 1, USER_AGENT)
+                    try:
+                        client.connect()
+                    except Exception as e:
+                        client.close()
+                        failure = f'{type(e).__name__}: {e}' if str(e) else type(e).__name__
+                        break
+                    held.append(client)
+                    selector.register(client.sock, selectors.EVENT_READ, client)
+                    if len(held) % 50 == 0:
+                        pump(0)
+                elapsed = time.perf_counter() - start
+                settle_until = time.time() + settle
+                while time.time() < settle_until:
+                    pump(0.1)
+                used = server_rss(server.pid) - baseline
+                print(f'capacity: {mode:<10} {target:>7,} clients -> {len(held):>7,} held, '
+                      f'{used / max(len(held), 1) / 1024:>6.1f} KiB server RSS per connection '
+                      f'(connected in {elapsed:.1f} s)')
+                if failure is not None:
+                    print(f'capacity: {mode:<10} stopped at {len(held):,} clients ({failure})')
+                    break
+        except RuntimeError as e:
+            print(f'capacity: {mode:<10} skipped ({e})')
+        finally:
+            for client in held:
+                client.close()
+            selector.close()
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+            errors.close()
+
+
+# ==================== LOAD TEST ====================
+
+def bench_load(scenario='smoke'):
+    """Simulated clients against the real handlers (see loadtest.py for options)"""
+    import loadtest
+
+    result = loadtest.LoadGenerator(loadtest.SCENARIOS[scenario]).run()
+    loadtest.print_report(scenario, result)
+
+
+BENCHMARKS = {
+    'matchmaking': bench_matchmaking,
+    'nearby': bench_nearby,
+    'presence': bench_presence,
+    'soak': bench_soak,
+    'ratelimit': bench_ratelimit,
+    'shared_ratelimit': bench_shared_ratelimit,
+    'blocklist': bench_blocklist,
+    'messages': bench_messages,
+    'typing': bench_typing,
+    'journal': bench_journal,
+    'outbound': bench_outbound,
+    'db_pool': bench_db_pool,
+    'queries': bench_queries,
+    'bulk_writes': bench_bulk_writes,
+    'pagination': bench_pagination,
+    'search': bench_search,
+    'rooms': bench_rooms,
+    'accounts': bench_accounts,
+    'snapshot': bench_snapshot,
+    'resume': bench_resume,
+    'capacity': bench_capacity,
+    'load': bench_load,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f'Unknown benchmark: {name} (choose from {", ".join(BENCHMARKS)})')
+            sys.exit(1)
+        BENCHMARKS[name]()
@@ -0,0 +1,83 @@
+# Presence Broadcast Module
+# Coalesces online/room count updates so a burst of connects and disconnects
+# turns into at most one broadcast per key per interval.
+import threading
+
+
+class PresenceBroadcaster:
+    """Collects dirty presence keys and flushes them on a fixed interval.
+
+    Callers mark a key dirty with a function that builds its payload; the
+    payload is only built at flush time, and only sent if it differs from the
+    last payload sent for that key. A key whose `retire(payload)` is true
+    (an emptied room) is sent once more and then forgotten.
+    """
+
+    def __init__(self, emit, interval=0.5):
+        self.emit = emit            # emit(event, payload) - broadcasts one packet
+        self.interval = interval
+        self.pending = {}           # {key: (event, build_payload, retire)}
+        self.last_sent = {}         # {key: payload}
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {
+            'marked': 0,        # mark() calls
+            'coalesced': 0,     # marks folded into an already-pending key
+            'unchanged': 0,     # flushed keys whose value had not changed
+            'sent': 0,          # packets actually broadcast
+            'retired': 0        # keys forgotten after their last broadcast
+        }
+
+    def mark(self, key, event, build_payload, retire=None):
+        """Schedule a broadcast of event for key on the next flush"""
+        with self.lock:
+            self.stats['marked'] += 1
+            if key in self.pending:
+                self.stats['coalesced'] += 1
+            self.pending[key] = (event, build_payload, retire)
+
+    def flush(self):
+        """Send every pending key whose payload changed since it was last sent"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+
+        sent = 0
+        for key, (event, build_payload, retire) in pending.items():
+            payload = build_payload()
+            if self.last_sent.get(key) == payload:
+                self.stats['unchanged'] += 1
+                continue
+            if retire is not None and retire(payload):
+                self.last_sent.pop(key, None)
+                self.stats['retired'] += 1
+            else:
+                self.last_sent[key] = payload
+            self.emit(event, payload)
+            sent += 1
+
+        self.stats['sent'] += sent
+        return sent
+
+    def forget(self, key):
+        """Drop state for a key that no longer exists (e.g. an emptied room)"""
+        with self.lock:
+            self.pending.pop(key, None)
+        self.last_sent.pop(key, None)
+
+    def run(self, sleep):
+        """Flush loop - start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Presence broadcast error: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        """Get broadcaster statistics"""
+        return dict(self.stats, pending=len(self.pending), tracked=len(self.last_sent),
+                    interval_ms=int(self.interval * 1000))
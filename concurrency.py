@@ -0,0 +1,39 @@
+# Concurrency Module
+# Serving-mode helpers. In threading mode every Socket.IO client holds an OS
+# thread; eventlet/gevent serve the same handlers on green threads, where a
+# blocking call (database driver, password hashing) must be pushed to a real
+# thread pool so it doesn't stall every other connection.
+import os
+
+ASYNC_MODES = ('threading', 'eventlet', 'gevent')
+
+ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+
+
+def monkey_patch(mode):
+    """Patch the standard library for green threads; call before other imports"""
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    elif mode != 'threading':
+        raise ValueError(f'Unsupported async mode: {mode} (choose from {", ".join(ASYNC_MODES)})')
+
+
+def offload(fn, *args, **kwargs):
+    """Run a blocking call without stalling the event loop.
+
+    eventlet: eventlet.tpool (native thread pool)
+    gevent:   the hub's thread pool
+    threading: called inline - the caller already has its own OS thread
+    """
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
+
@@ -34,6 +34,13 @@ class Config:
     # Redis
     REDIS_URL = os.environ.get('REDIS_URL', '')
     
+    # Shared state for multi-worker deployments (presence, queues, rooms)
+    # '' keeps state in-process; redis:// shares it between workers/hosts
+    STATE_BACKEND_URL = os.environ.get('STATE_BACKEND_URL', REDIS_URL)
+    # A worker whose heartbeat is this many seconds old counts as dead and its
+    # users, connections and presence entries are purged by the others
+    STATE_LEASE_TTL_SECONDS = float(os.environ.get('STATE_LEASE_TTL_SECONDS', 30))
+    
     # Mail
     MAIL_SERVER = os.environ.get('MAIL_SERVER', '')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -48,7 +55,12 @@ class Config:
     
     # Rate Limiting
     RATELIMIT_DEFAULT = os.environ.get('RATELIMIT_DEFAULT', '200 per day')
-    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', '')
+    # Limits and IP bans are shared by all workers when this points at Redis
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', REDIS_URL)
+    RATELIMIT_SYNC_INTERVAL_MS = int(os.environ.get('RATELIMIT_SYNC_INTERVAL_MS', 100))
+    # CIDR block list file (one range per line), reloaded when it changes
+    BLOCKLIST_PATH = os.environ.get('BLOCKLIST_PATH', 'data/blocklist.txt')
+    BLOCKLIST_RELOAD_SECONDS = int(os.environ.get('BLOCKLIST_RELOAD_SECONDS', 30))
     
     # Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -57,6 +69,76 @@ class Config:
     # Socket.IO
     SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
     SOCKETIO_CORS_ORIGINS = '*'
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE', REDIS_URL)
+    # 'msgpack' sends binary packets (pip install msgpack); browsers then need
+    # a socket.io-msgpack-parser build served from SOCKETIO_PARSER_URL that
+    # sets window.socketParser
+    SOCKETIO_SERIALIZER = os.environ.get('SOCKETIO_SERIALIZER', 'default')
+    SOCKETIO_PARSER_URL = os.environ.get('SOCKETIO_PARSER_URL', '/static/js/socket.io-msgpack-parser.js')
+    # Random-chat matching: 'basic' (gender/preference) or 'nearby', which prefers
+    # the same country and age band and widens to same country, then anyone, once
+    # a waiter has waited MATCH_RELAX_SECONDS (two steps); waiters are re-checked
+    # every MATCH_SWEEP_SECONDS. Nearby mode needs in-process state.
+    MATCHMAKING_MODE = os.environ.get('MATCHMAKING_MODE', 'basic')
+    MATCH_RELAX_SECONDS = tuple(float(s) for s in os.environ.get('MATCH_RELAX_SECONDS', '5,15').split(','))
+    MATCH_SWEEP_SECONDS = float(os.environ.get('MATCH_SWEEP_SECONDS', 1))
+    # Online/room count updates are coalesced and flushed at most this often
+    PRESENCE_BROADCAST_INTERVAL_MS = int(os.environ.get('PRESENCE_BROADCAST_INTERVAL_MS', 500))
+    # Typing indicators: repeats are forwarded at most every TYPING_REPEAT_SECONDS
+    # and a silent typist is reported as stopped after TYPING_IDLE_SECONDS
+    TYPING_IDLE_SECONDS = float(os.environ.get('TYPING_IDLE_SECONDS', 5))
+    TYPING_REPEAT_SECONDS = float(os.environ.get('TYPING_REPEAT_SECONDS', 3))
+    # Per-client send queue (packets): above OUTBOUND_HIGH_WATER typing is dropped
+    # and count updates coalesced until it drains below OUTBOUND_LOW_WATER; a client
+    # at OUTBOUND_MAX_DEPTH or slow for OUTBOUND_SLOW_TIMEOUT seconds is disconnected
+    OUTBOUND_HIGH_WATER = int(os.environ.get('OUTBOUND_HIGH_WATER', 64))
+    OUTBOUND_LOW_WATER = int(os.environ.get('OUTBOUND_LOW_WATER', 16))
+    OUTBOUND_MAX_DEPTH = int(os.environ.get('OUTBOUND_MAX_DEPTH', 256))
+    OUTBOUND_SLOW_TIMEOUT = float(os.environ.get('OUTBOUND_SLOW_TIMEOUT', 30))
+    # Sockets that stop pinging are reaped after this many seconds
+    STALE_CONNECTION_TIMEOUT = int(os.environ.get('STALE_CONNECTION_TIMEOUT', 300))
+    REAPER_TICK_SECONDS = int(os.environ.get('REAPER_TICK_SECONDS', 5))
+    # Random-chat messages are logged in batches: every MESSAGE_JOURNAL_FLUSH_MS
+    # or once MESSAGE_JOURNAL_BATCH_ROWS are waiting, holding at most
+    # MESSAGE_JOURNAL_MAX_ROWS in memory. Durability: off | normal | full (fsync per batch)
+    MESSAGE_JOURNAL_FLUSH_MS = int(os.environ.get('MESSAGE_JOURNAL_FLUSH_MS', 200))
+    MESSAGE_JOURNAL_BATCH_ROWS = int(os.environ.get('MESSAGE_JOURNAL_BATCH_ROWS', 500))
+    MESSAGE_JOURNAL_MAX_ROWS = int(os.environ.get('MESSAGE_JOURNAL_MAX_ROWS', 50000))
+    MESSAGE_JOURNAL_DURABILITY = os.environ.get('MESSAGE_JOURNAL_DURABILITY', 'normal')
+    # A batch that fails this many times in a row is bisected, and rows the
+    # database rejects on their own are logged and dropped
+    MESSAGE_JOURNAL_MAX_ATTEMPTS = int(os.environ.get('MESSAGE_JOURNAL_MAX_ATTEMPTS', 3))
+    # Taken guest names are snapshotted to SNAPSHOT_PATH every
+    # SNAPSHOT_INTERVAL_SECONDS (when changed) and restored on startup; an
+    # empty path turns this off
+    SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'data/state.snapshot')
+    SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 30))
+    # A guest's name stays taken this long after they leave, then is released
+    GUEST_NAME_HOLD_SECONDS = float(os.environ.get('GUEST_NAME_HOLD_SECONDS', 3600))
+    # A paired user whose connection drops (not a deliberate disconnect) keeps
+    # their partner for RESUME_WINDOW_SECONDS (0 disables); up to
+    # RESUME_BUFFER_MESSAGES partner messages are replayed on reconnect
+    RESUME_WINDOW_SECONDS = float(os.environ.get('RESUME_WINDOW_SECONDS', 10))
+    RESUME_BUFFER_MESSAGES = int(os.environ.get('RESUME_BUFFER_MESSAGES', 50))
+    # Registered accounts and friend lists are cached in memory in front of
+    # the database: ACCOUNT_CACHE_SIZE entries per cache, refreshed after
+    # ACCOUNT_CACHE_TTL seconds; ACCOUNT_CACHE_WARM recent accounts preloaded at startup
+    ACCOUNT_CACHE_SIZE = int(os.environ.get('ACCOUNT_CACHE_SIZE', 10000))
+    ACCOUNT_CACHE_TTL = float(os.environ.get('ACCOUNT_CACHE_TTL', 300))
+    ACCOUNT_CACHE_WARM = int(os.environ.get('ACCOUNT_CACHE_WARM', 1000))
+    # Group rooms: the latest ROOM_BUFFER_MESSAGES per room are kept in memory
+    # for backfill, new messages go out in one packet per room every
+    # ROOM_FANOUT_INTERVAL_MS, and a client further behind than the buffer
+    # gets up to ROOM_BACKFILL_LIMIT messages from the database
+    ROOM_BUFFER_MESSAGES = int(os.environ.get('ROOM_BUFFER_MESSAGES', 100))
+    ROOM_FANOUT_INTERVAL_MS = int(os.environ.get('ROOM_FANOUT_INTERVAL_MS', 50))
+    ROOM_BACKFILL_LIMIT = int(os.environ.get('ROOM_BACKFILL_LIMIT', 200))
+    # Messages older than the search index are indexed SEARCH_BACKFILL_BATCH
+    # at a time, one batch every SEARCH_BACKFILL_INTERVAL_MS
+    SEARCH_BACKFILL_BATCH = int(os.environ.get('SEARCH_BACKFILL_BATCH', 5000))
+    SEARCH_BACKFILL_INTERVAL_MS = int(os.environ.get('SEARCH_BACKFILL_INTERVAL_MS', 100))
+    # Longer chat messages are truncated (the 1-on-1 chat input allows 1000)
+    MAX_MESSAGE_LENGTH = int(os.environ.get('MAX_MESSAGE_LENGTH', 1000))
     
     # Admin
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
@@ -67,6 +149,23 @@ class Config:
     UPLOAD_FOLDER = 'static/uploads'
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
+    # Country code -> display name for partner info (same list as the chat UI)
+    COUNTRIES = {
+        'US': 'United States', 'GB': 'United Kingdom', 'CA': 'Canada', 'AU': 'Australia',
+        'DE': 'Germany', 'FR': 'France', 'ES': 'Spain', 'IT': 'Italy', 'BR': 'Brazil',
+        'MX': 'Mexico', 'JP': 'Japan', 'KR': 'South Korea', 'CN': 'China', 'IN': 'India',
+        'PK': 'Pakistan', 'BD': 'Bangladesh', 'NG': 'Nigeria', 'ZA': 'South Africa',
+        'AE': 'UAE', 'SA': 'Saudi Arabia', 'SG': 'Singapore', 'MY': 'Malaysia',
+        'PH': 'Philippines', 'ID': 'Indonesia', 'TH': 'Thailand', 'VN': 'Vietnam',
+        'RU': 'Russia', 'UA': 'Ukraine', 'PL': 'Poland', 'NL': 'Netherlands',
+        'BE': 'Belgium', 'SE': 'Sweden', 'NO': 'Norway', 'DK': 'Denmark',
+        'FI': 'Finland', 'CH': 'Switzerland', 'AT': 'Austria', 'IE': 'Ireland',
+        'NZ': 'New Zealand', 'IL': 'Israel', 'TR': 'Turkey', 'GR': 'Greece',
+        'PT': 'Portugal', 'CZ': 'Czech Republic', 'HU': 'Hungary', 'RO': 'Romania',
+        'AR': 'Argentina', 'CL': 'Chile', 'CO': 'Colombia', 'PE': 'Peru',
+        'VE': 'Venezuela', 'EG': 'Egypt', 'MA': 'Morocco', 'KE': 'Kenya'
+    }
+
 
 class DevelopmentConfig(Config):
     """Development configuration"""
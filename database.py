@@ -2,11 +2,18 @@
 Chat Online Database Module
 Supports both SQLite (local) and PostgreSQL (production)
 """
+import io
 import os
 import sqlite3
+import threading
 import uuid
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from contextlib import contextmanager
+
+from concurrency import offload
+from db_pool import ConnectionPool
+from queries import QueryRegistry, Statement, records
+from search_index import fts5_query, highlight, search_terms, tsquery
 
 # Database configuration
 DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///chat_online.db')
@@ -17,7 +24,8 @@ USE_POSTGRES = 'postgresql' in DATABASE_URL.lower()
 if USE_POSTGRES:
     try:
         import psycopg2
-        from psycopg2.extras import RealDictCursor
+        from psycopg2.extensions import connection as PgConnection
+        from psycopg2.extras import RealDictCursor, execute_values
         # Silent in production
     except ImportError:
         print("WARNING: psycopg2 not installed, falling back to SQLite")
@@ -31,29 +39,144 @@ else:
     else:
         DB_FILE = DATABASE_URL
 
+# Raised by the driver in use when a write breaks a UNIQUE/foreign key constraint
+IntegrityError = psycopg2.IntegrityError if USE_POSTGRES else sqlite3.IntegrityError
+
 # ==================== DATABASE CONNECTION ====================
 
-@contextmanager
-def get_db():
-    """Get database connection"""
-    if USE_POSTGRES:
-        conn = psycopg2.connect(DATABASE_URL)
+# Connections are pooled: at most DB_POOL_SIZE open per process, waiting up to
+# DB_POOL_TIMEOUT seconds for a free one; PostgreSQL connections idle for more
+# than DB_POOL_CHECK_SECONDS are pinged before reuse
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_CHECK_SECONDS = float(os.environ.get('DB_POOL_CHECK_SECONDS', 30))
+
+# Statements compiled for this database; see the query definitions below
+queries = QueryRegistry('postgres' if USE_POSTGRES else 'sqlite')
+
+# SQLite doesn't make `id SERIAL PRIMARY KEY` an alias for the rowid, so those
+# ids are NULL there; keyset listings order by the rowid and return it as id.
+ROW_ID = 'id' if USE_POSTGRES else 'rowid'
+# Trailing columns of the keyset indexes - SQLite appends the rowid to every index itself
+KEYSET_COLUMNS = 'created_at, id' if USE_POSTGRES else 'created_at'
+
+def _sqlite_has_fts5():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(text)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+# Message search uses a full-text index (see search_index.py) unless this
+# SQLite build lacks FTS5, when it falls back to scanning with LIKE
+FULL_TEXT_SEARCH = USE_POSTGRES or _sqlite_has_fts5()
+# PostgreSQL text search configuration; 'simple' doesn't stem, so it treats
+# every language users write in alike
+SEARCH_CONFIG = 'simple'
+
+def _connect_sqlite():
+    # Shared between threads, but the pool lends it to one at a time; the
+    # statement cache keeps every registered query compiled
+    conn = sqlite3.connect(DB_FILE, timeout=30, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    # Enable WAL mode and pragmas for better SQLite performance
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-64000')  # 64MB cache
+    return conn
+
+def _reset_sqlite(conn):
+    # Uncommitted work is discarded, as closing the connection used to do
+    if conn.in_transaction:
+        conn.rollback()
+
+if USE_POSTGRES:
+    class PreparingConnection(PgConnection):
+        """psycopg2 connection that remembers which statements this session has PREPAREd"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
+
+def _connect_postgres():
+    conn = psycopg2.connect(DATABASE_URL, connection_factory=PreparingConnection)
+    conn.autocommit = True
+    return conn
+
+def _reset_postgres(conn):
+    if not conn.autocommit:
+        conn.rollback()
         conn.autocommit = True
+
+def _check_postgres(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """The connection pool for the configured database (rebuilt if DB_FILE is changed)"""
+    global _pool
+    target = DATABASE_URL if USE_POSTGRES else DB_FILE
+    pool = _pool
+    if pool is not None and pool.name == target:
+        return pool
+    with _pool_lock:
+        if _pool is None or _pool.name != target:
+            if _pool is not None:
+                _pool.close()
+            if USE_POSTGRES:
+                _pool = ConnectionPool(_connect_postgres, DB_POOL_SIZE, DB_POOL_TIMEOUT, reset=_reset_postgres,
+                                       check=_check_postgres, check_after=DB_POOL_CHECK_SECONDS,
+                                       broken_errors=(psycopg2.OperationalError, psycopg2.InterfaceError),
+                                       name=target)
+            else:
+                _pool = ConnectionPool(_connect_sqlite, DB_POOL_SIZE, DB_POOL_TIMEOUT, reset=_reset_sqlite,
+                                       broken_errors=(sqlite3.ProgrammingError,), name=target)
+        return _pool
+
+def get_db():
+    """Borrow a pooled database connection: with get_db() as conn: ..."""
+    return get_pool().connection()
+
+# Callbacks waiting for each open transaction to commit: {id(tx): [callback]}
+_after_commit = {}
+
+@contextmanager
+def transaction():
+    """Unit of work: with transaction() as tx: create_message(..., tx=tx) ...
+
+    Helpers given tx run on its one pooled connection instead of borrowing
+    their own and committing; the block commits once at the end, or rolls
+    everything back if it raises. Callbacks registered with after_commit()
+    run once the commit has succeeded.
+    """
+    with get_db() as conn:
+        if USE_POSTGRES:
+            conn.autocommit = False     # the pool's reset turns it back on
+        callbacks = _after_commit[id(conn)] = []
         try:
-            yield conn
+            try:
+                yield conn
+            except BaseException:
+                offload(conn.rollback)
+                raise
+            offload(conn.commit)
         finally:
-            conn.close()
+            del _after_commit[id(conn)]
+    for callback in callbacks:
+        callback()
+
+def after_commit(tx, callback):
+    """Run callback once tx commits (dropped if it rolls back), or now if tx is None"""
+    if tx is None:
+        callback()
     else:
-        # Enable WAL mode and pragmas for better SQLite performance
-        conn = sqlite3.connect(DB_FILE, timeout=30)
-        conn.row_factory = sqlite3.Row
-        conn.execute('PRAGMA journal_mode=WAL')
-        conn.execute('PRAGMA synchronous=NORMAL')
-        conn.execute('PRAGMA cache_size=-64000')  # 64MB cache
-        try:
-            yield conn
-        finally:
-            conn.close()
+        _after_commit[id(tx)].append(callback)
+
+def _connection(tx):
+    return nullcontext(tx) if tx is not None else get_db()
 
 def dict_from_row(row):
     """Convert row to dictionary"""
@@ -110,6 +233,21 @@ def init_database():
             )
         ''')
 
+        # Random 1-on-1 chat log (guests have no users row), written in
+        # batches by journal.MessageJournal
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id SERIAL PRIMARY KEY,
+                room_id TEXT NOT NULL,
+                sender_id TEXT NOT NULL,
+                receiver_id TEXT,
+                sender_name TEXT,
+                sender_ip TEXT,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
         # Friends table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS friends (
@@ -163,6 +301,7 @@ def init_database():
                 user_id TEXT NOT NULL,
                 content TEXT NOT NULL,
                 message_type TEXT DEFAULT 'text',
+                seq INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (room_id) REFERENCES rooms (id),
                 FOREIGN KEY (user_id) REFERENCES users (id)
@@ -226,15 +365,41 @@ def init_database():
             )
         ''')
 
+        # Backfill progress of the search index: messages up to end_id predate it
+        # and are indexed by search_index.SearchBackfill, which has reached last_id
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS search_index_state (
+                name TEXT PRIMARY KEY,
+                end_id INTEGER NOT NULL,
+                last_id INTEGER NOT NULL
+            )
+        ''')
+
+        # Per-room sequence numbers (room_feed.py) came after the table did
+        if USE_POSTGRES:
+            cursor.execute('ALTER TABLE room_messages ADD COLUMN IF NOT EXISTS seq INTEGER')
+        else:
+            cursor.execute('PRAGMA table_info(room_messages)')
+            if 'seq' not in [row[1] for row in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE room_messages ADD COLUMN seq INTEGER')
+
         # Create indexes
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages(sender_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_receiver ON messages(receiver_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_room ON messages(room_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at)')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_room ON chat_messages(room_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_sender ON chat_messages(sender_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_created ON chat_messages(created_at)')
         
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_friends_user ON friends(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_friends_friend ON friends(friend_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_friends_status ON friends(status)')
+        # Friend-list lookups filter on a user and a status; without these the
+        # planner can pick idx_friends_status and scan every accepted row
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_friends_user_status ON friends(user_id, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_friends_friend_status ON friends(friend_id, status)')
         
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_members_room ON room_members(room_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_members_user ON room_members(user_id)')
@@ -242,6 +407,17 @@ def init_database():
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_messages_room ON room_messages(room_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_messages_user ON room_messages(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_messages_created ON room_messages(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_room_messages_room_seq ON room_messages(room_id, seq)')
+
+        # Keyset pagination: (filter, created_at, id) so each page is one index range scan
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_messages_receiver_page ON messages(receiver_id, {KEYSET_COLUMNS})')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_messages_sender_page ON messages(sender_id, {KEYSET_COLUMNS})')
+        if USE_POSTGRES:
+            # On SQLite idx_messages_created already is this index
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_page ON messages(created_at, id)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_room_messages_room_page ON room_messages(room_id, {KEYSET_COLUMNS})')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_notifications_user_page ON notifications(user_id, {KEYSET_COLUMNS})')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_page ON users(created_at, id)')
         
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(is_read)')
@@ -253,328 +429,784 @@ def init_database():
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_verification_codes_user ON verification_codes(user_id)')
         
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users(LOWER(username))')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_online ON users(is_online)')
 
-        if not USE_POSTGRES:
+        if USE_POSTGRES:
+            _init_postgres_search(cursor)
+        else:
             conn.commit()
+            if FULL_TEXT_SEARCH:
+                _init_sqlite_search(conn)
 
         print("Database initialized successfully!")
 
+def _init_postgres_search(cursor):
+    """tsvector column kept by a trigger, its GIN index, and the backfill mark"""
+    cursor.execute('ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_tsv tsvector')
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION messages_content_tsv() RETURNS trigger AS $$
+        BEGIN
+            NEW.content_tsv := to_tsvector('{SEARCH_CONFIG}', COALESCE(NEW.content, ''));
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'messages_content_tsv'")
+    if cursor.fetchone() is None:
+        cursor.execute("""
+            CREATE TRIGGER messages_content_tsv BEFORE INSERT OR UPDATE OF content ON messages
+            FOR EACH ROW EXECUTE FUNCTION messages_content_tsv()
+        """)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_content_tsv ON messages USING GIN (content_tsv)')
+    # After the trigger, so every row past end_id already has its tsvector
+    cursor.execute("""
+        INSERT INTO search_index_state (name, end_id, last_id)
+        SELECT 'messages', COALESCE(MAX(id), 0), 0 FROM messages
+        ON CONFLICT (name) DO NOTHING
+    """)
+
+# A message is in the FTS index once it was written after the index existed
+# or the backfill has reached it; the triggers only touch rows that are, as
+# FTS5 corrupts an external-content index asked to delete a row it never had
+_FTS_INDEXED = """
+    {row}.rowid > (SELECT end_id FROM search_index_state WHERE name = 'messages')
+    OR {row}.rowid <= (SELECT last_id FROM search_index_state WHERE name = 'messages')
+"""
+
+def _init_sqlite_search(conn):
+    """FTS5 table over messages.content, the triggers that keep it, and the backfill mark"""
+    cursor = conn.cursor()
+    # One transaction, so no message lands between the mark and the triggers
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO search_index_state (name, end_id, last_id)
+        SELECT 'messages', COALESCE(MAX(rowid), 0), 0 FROM messages
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        WHEN {_FTS_INDEXED.format(row='new')}
+        BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        WHEN {_FTS_INDEXED.format(row='old')}
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages
+        WHEN {_FTS_INDEXED.format(row='old')}
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+        END
+    """)
+    conn.commit()
+
 # ==================== HELPER FUNCTIONS ====================
 
-def execute_query(query, params=(), fetch=False):
-    """Execute a query and optionally fetch results"""
-    with get_db() as conn:
-        if USE_POSTGRES:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-        else:
-            cursor = conn.cursor()
-        
+# Driver calls block; offload() keeps them off the event loop in eventlet/gevent mode.
+# `query` is a registered Statement, or SQL built at run time in the driver's
+# placeholder style (see queries.placeholders()). Rows come back as Records.
+# Pass tx from transaction() to run inside that unit of work.
+
+def _run(cursor, query, params):
+    if not isinstance(query, Statement):
         cursor.execute(query, params)
-        
+    elif USE_POSTGRES:
+        prepared = cursor.connection.prepared
+        if query.name not in prepared:
+            cursor.execute(query.prepare)
+            prepared.add(query.name)
+        cursor.execute(query.execute, params)
+    else:
+        cursor.execute(query.text, params)
+
+def _cursor(conn):
+    cursor = conn.cursor()
+    if not USE_POSTGRES:
+        cursor.row_factory = None   # plain tuples; records() adds the column names
+    return cursor
+
+def execute_query(query, params=(), fetch=False, tx=None):
+    """Execute a query and optionally fetch results"""
+    return offload(_execute_query, query, params, fetch, tx)
+
+def _execute_query(query, params, fetch, tx):
+    with _connection(tx) as conn:
+        cursor = _cursor(conn)
+        _run(cursor, query, params)
+
         if fetch:
-            rows = cursor.fetchall()
-            if USE_POSTGRES:
-                return [dict(row) for row in rows]
-            return [dict(row) for row in rows]
-        
-        if not USE_POSTGRES:
+            return records(cursor, cursor.fetchall(), query)
+
+        if not USE_POSTGRES and tx is None:
             conn.commit()
-        
+
         return cursor.lastrowid if hasattr(cursor, 'lastrowid') else None
 
-def fetch_one(query, params=()):
+def fetch_one(query, params=(), tx=None):
     """Fetch a single row"""
-    with get_db() as conn:
-        if USE_POSTGRES:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
-        else:
-            cursor = conn.cursor()
-        
-        cursor.execute(query, params)
+    return offload(_fetch_one, query, params, tx)
+
+def _fetch_one(query, params, tx):
+    with _connection(tx) as conn:
+        cursor = _cursor(conn)
+        _run(cursor, query, params)
         row = cursor.fetchone()
-        
-        if row is None:
-            return None
-        
-        if USE_POSTGRES:
-            return dict(row)
-        return dict(row)
+        return records(cursor, [row], query)[0] if row is not None else None
 
-def fetch_all(query, params=()):
+def fetch_all(query, params=(), tx=None):
     """Fetch all rows"""
-    with get_db() as conn:
-        if USE_POSTGRES:
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
+    return offload(_fetch_all, query, params, tx)
+
+def _fetch_all(query, params, tx):
+    with _connection(tx) as conn:
+        cursor = _cursor(conn)
+        _run(cursor, query, params)
+        return records(cursor, cursor.fetchall(), query)
+
+def fetch_value(query, params=(), default=None, tx=None):
+    """First column of the first row, or default"""
+    row = fetch_one(query, params, tx)
+    return row[0] if row is not None and row[0] is not None else default
+
+# Bulk inserts send many rows per statement: multi-row VALUES, chunked to
+# BULK_PARAMS parameters (the limit of SQLite builds before 3.32), or on
+# PostgreSQL a COPY once a batch reaches COPY_MIN_ROWS rows.
+BULK_PARAMS = 999
+COPY_MIN_ROWS = 1000
+
+def _copy_buffer(rows):
+    # CSV with every value quoted, so only None - left empty and unquoted - loads as NULL
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(
+            '' if value is None else '"' + str(int(value) if isinstance(value, bool) else value).replace('"', '""') + '"'
+            for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+def _bulk_insert(cursor, table, columns, rows):
+    """Insert rows into table (names are ours, never user input) in as few statements as possible"""
+    head = f'INSERT INTO {table} ({", ".join(columns)}) VALUES '
+    if USE_POSTGRES:
+        if len(rows) >= COPY_MIN_ROWS:
+            cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', _copy_buffer(rows))
         else:
-            cursor = conn.cursor()
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        if USE_POSTGRES:
-            return [dict(row) for row in rows]
-        return [dict(row) for row in rows]
+            execute_values(cursor, head + '%s', rows, page_size=max(1, BULK_PARAMS // len(columns)))
+        return
+    per_statement = max(1, BULK_PARAMS // len(columns))
+    row_marks = '(' + queries.placeholders(len(columns)) + ')'
+    for i in range(0, len(rows), per_statement):
+        batch = rows[i:i + per_statement]
+        cursor.execute(head + ', '.join([row_marks] * len(batch)), [value for row in batch for value in row])
+
+def insert_rows(table, columns, rows, tx=None):
+    """Insert many rows with _bulk_insert, in tx or a transaction of their own; returns the count"""
+    rows = list(rows)
+    if not rows:
+        return 0
+    return offload(_insert_rows, table, columns, rows, tx)
+
+def _insert_rows(table, columns, rows, tx):
+    with _connection(tx) as conn:
+        if USE_POSTGRES and tx is None:
+            conn.autocommit = False
+        _bulk_insert(conn.cursor(), table, columns, rows)
+        if tx is None:
+            conn.commit()
+    return len(rows)
 
 # ==================== USER FUNCTIONS ====================
 
+CREATE_USER = queries.define('create_user', """
+    INSERT INTO users (id, username, email, password_hash, gender, age, country, state)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+""")
+GET_USER_BY_ID = queries.define('get_user_by_id', 'SELECT * FROM users WHERE id = ?')
+GET_USER_BY_USERNAME = queries.define('get_user_by_username', 'SELECT * FROM users WHERE username = ?')
+GET_USER_BY_EMAIL = queries.define('get_user_by_email', 'SELECT * FROM users WHERE email = ?')
+GET_USER_BY_USERNAME_KEY = queries.define('get_user_by_username_key', 'SELECT * FROM users WHERE LOWER(username) = ?')
+GET_RECENT_USERS = queries.define('get_recent_users', """
+    SELECT * FROM users ORDER BY COALESCE(last_seen, '') DESC, created_at DESC LIMIT ?
+""")
+UPDATE_USER_ONLINE_STATUS = queries.define('update_user_online_status', """
+    UPDATE users SET is_online = ?, last_seen = ? WHERE id = ?
+""")
+SEARCH_USERS = queries.define('search_users', 'SELECT * FROM users WHERE username LIKE ? LIMIT ?')
+ONLINE_USER_COLUMNS = 'id, username, gender, age, country, state, bio, avatar, is_online, last_seen, created_at'
+GET_ONLINE_USERS = queries.define('get_online_users', f"""
+    SELECT {ONLINE_USER_COLUMNS} FROM users
+    WHERE is_online = 1 ORDER BY last_seen DESC LIMIT ?
+""")
+GET_ONLINE_USERS_EXCEPT = queries.define('get_online_users_except', f"""
+    SELECT {ONLINE_USER_COLUMNS} FROM users
+    WHERE is_online = 1 AND id != ? ORDER BY last_seen DESC LIMIT ?
+""")
+
 def create_user(username, email, password_hash, gender=None, age=None, country=None, state=None):
     """Create a new user"""
     user_id = str(uuid.uuid4())
-    if USE_POSTGRES:
-        execute_query('''
-            INSERT INTO users (id, username, email, password_hash, gender, age, country, state)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ''', (user_id, username, email, password_hash, gender, age, country, state))
-    else:
-        execute_query('''
-            INSERT INTO users (id, username, email, password_hash, gender, age, country, state)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, email, password_hash, gender, age, country, state))
+    execute_query(CREATE_USER, (user_id, username, email, password_hash, gender, age, country, state))
     return user_id
 
-def get_user_by_id(user_id):
+def get_user_by_id(user_id, tx=None):
     """Get user by ID"""
-    return fetch_one('SELECT * FROM users WHERE id = %s' if USE_POSTGRES else 'SELECT * FROM users WHERE id = ?', (user_id,))
+    return fetch_one(GET_USER_BY_ID, (user_id,), tx)
 
 def get_user_by_username(username):
     """Get user by username"""
-    return fetch_one('SELECT * FROM users WHERE username = %s' if USE_POSTGRES else 'SELECT * FROM users WHERE username = ?', (username,))
+    return fetch_one(GET_USER_BY_USERNAME, (username,))
 
 def get_user_by_email(email):
     """Get user by email"""
-    return fetch_one('SELECT * FROM users WHERE email = %s' if USE_POSTGRES else 'SELECT * FROM users WHERE email = ?', (email,))
+    return fetch_one(GET_USER_BY_EMAIL, (email,))
+
+def get_user_by_username_key(key):
+    """Get user by case-insensitive username (key is already lower-cased)"""
+    return fetch_one(GET_USER_BY_USERNAME_KEY, (key,))
+
+# Bound parameters per IN (...) query; SQLite's default limit is 999
+ID_BATCH_SIZE = 500
+
+def get_users_by_ids(user_ids, tx=None):
+    """Get many users in batches of ID_BATCH_SIZE"""
+    user_ids = list(user_ids)
+    rows = []
+    for i in range(0, len(user_ids), ID_BATCH_SIZE):
+        batch = user_ids[i:i + ID_BATCH_SIZE]
+        rows.extend(fetch_all(f'SELECT * FROM users WHERE id IN ({queries.placeholders(len(batch))})', tuple(batch), tx))
+    return rows
+
+def get_recent_users(limit=1000):
+    """Get the most recently seen users (for cache warm-up)"""
+    return fetch_all(GET_RECENT_USERS, (limit,))
 
 def update_user_online_status(user_id, is_online):
     """Update user's online status"""
-    execute_query('''
-        UPDATE users SET is_online = %s, last_seen = %s WHERE id = %s
-    ''' if USE_POSTGRES else '''
-        UPDATE users SET is_online = ?, last_seen = ? WHERE id = ?
-    ''', (is_online, datetime.utcnow().isoformat(), user_id))
+    execute_query(UPDATE_USER_ONLINE_STATUS, (is_online, datetime.utcnow().isoformat(), user_id))
 
 def search_users(query, limit=20):
     """Search users by username"""
-    return fetch_all(
-        'SELECT * FROM users WHERE username LIKE %s LIMIT %s' if USE_POSTGRES else 'SELECT * FROM users WHERE username LIKE ? LIMIT ?',
-        (f'%{query}%', limit)
-    )
+    return fetch_all(SEARCH_USERS, (f'%{query}%', limit))
+
+def find_online_users(exclude_user_id=None, limit=50):
+    """Get the most recently seen online users, optionally leaving one out"""
+    if exclude_user_id:
+        return fetch_all(GET_ONLINE_USERS_EXCEPT, (exclude_user_id, limit))
+    return fetch_all(GET_ONLINE_USERS, (limit,))
 
 # ==================== MESSAGE FUNCTIONS ====================
 
-def create_message(sender_id, receiver_id, content, room_id=None):
+CREATE_MESSAGE = queries.define('create_message', """
+    INSERT INTO messages (sender_id, receiver_id, room_id, content)
+    VALUES (?, ?, ?, ?)
+""")
+GET_RECEIVED_MESSAGES = queries.define('get_received_messages', f"""
+    SELECT *, {ROW_ID} AS id FROM messages WHERE receiver_id = ?
+    ORDER BY created_at DESC, {ROW_ID} DESC LIMIT ?
+""")
+GET_RECEIVED_MESSAGES_BEFORE = queries.define('get_received_messages_before', f"""
+    SELECT *, {ROW_ID} AS id FROM messages WHERE receiver_id = ? AND (created_at, {ROW_ID}) < (?, ?)
+    ORDER BY created_at DESC, {ROW_ID} DESC LIMIT ?
+""")
+GET_SENT_MESSAGES = queries.define('get_sent_messages', f"""
+    SELECT *, {ROW_ID} AS id FROM messages WHERE sender_id = ?
+    ORDER BY created_at DESC, {ROW_ID} DESC LIMIT ?
+""")
+GET_SENT_MESSAGES_BEFORE = queries.define('get_sent_messages_before', f"""
+    SELECT *, {ROW_ID} AS id FROM messages WHERE sender_id = ? AND (created_at, {ROW_ID}) < (?, ?)
+    ORDER BY created_at DESC, {ROW_ID} DESC LIMIT ?
+""")
+
+MESSAGE_COLUMNS = ('sender_id', 'receiver_id', 'room_id', 'content')
+
+def create_message(sender_id, receiver_id, content, room_id=None, tx=None):
     """Create a new message"""
-    return execute_query('''
-        INSERT INTO messages (sender_id, receiver_id, room_id, content)
-        VALUES (%s, %s, %s, %s)
-    ''' if USE_POSTGRES else '''
-        INSERT INTO messages (sender_id, receiver_id, room_id, content)
-        VALUES (?, ?, ?, ?)
-    ''', (sender_id, receiver_id, room_id, content))
-
-def get_messages(user_id, message_type='received', limit=50):
-    """Get user's messages"""
+    return execute_query(CREATE_MESSAGE, (sender_id, receiver_id, room_id, content), tx=tx)
+
+def create_messages(rows, tx=None):
+    """Create (sender_id, receiver_id, room_id, content) messages in one transaction"""
+    return insert_rows('messages', MESSAGE_COLUMNS, rows, tx)
+
+def get_messages(user_id, message_type='received', limit=50, before=None):
+    """Get user's messages, newest first; before is a (created_at, id) key to page back from"""
     if message_type == 'received':
-        return fetch_all(
-            'SELECT * FROM messages WHERE receiver_id = %s ORDER BY created_at DESC LIMIT %s' if USE_POSTGRES else 'SELECT * FROM messages WHERE receiver_id = ? ORDER BY created_at DESC LIMIT ?',
-            (user_id, limit)
-        )
+        if before:
+            return fetch_all(GET_RECEIVED_MESSAGES_BEFORE, (user_id, *before, limit))
+        return fetch_all(GET_RECEIVED_MESSAGES, (user_id, limit))
     else:
-        return fetch_all(
-            'SELECT * FROM messages WHERE sender_id = %s ORDER BY created_at DESC LIMIT %s' if USE_POSTGRES else 'SELECT * FROM messages WHERE sender_id = ? ORDER BY created_at DESC LIMIT ?',
-            (user_id, limit)
-        )
+        if before:
+            return fetch_all(GET_SENT_MESSAGES_BEFORE, (user_id, *before, limit))
+        return fetch_all(GET_SENT_MESSAGES, (user_id, limit))
+
+# ==================== RANDOM CHAT LOG ====================
+
+# journal durability -> SQLite synchronous / Postgres synchronous_commit
+SQLITE_SYNCHRONOUS = {'off': 'OFF', 'normal': 'NORMAL', 'full': 'FULL'}
+POSTGRES_SYNCHRONOUS_COMMIT = {'off': 'off', 'normal': 'local', 'full': 'on'}
+
+CHAT_MESSAGE_COLUMNS = ('room_id', 'sender_id', 'receiver_id', 'sender_name', 'sender_ip', 'content', 'created_at')
+GET_CHAT_MESSAGES = queries.define('get_chat_messages', """
+    SELECT * FROM chat_messages WHERE room_id = ? ORDER BY created_at LIMIT ?
+""")
+GET_USER_CHAT_MESSAGES = queries.define('get_user_chat_messages', """
+    SELECT * FROM chat_messages WHERE sender_id = ? ORDER BY created_at DESC LIMIT ?
+""")
+
+def _insert_batch(table, columns, rows, durability):
+    """Bulk insert rows in a single transaction at the given durability"""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if USE_POSTGRES:
+            conn.autocommit = False
+            cursor.execute('SET LOCAL synchronous_commit = ' + POSTGRES_SYNCHRONOUS_COMMIT[durability])
+            _bulk_insert(cursor, table, columns, rows)
+            conn.commit()
+            return len(rows)
+        # PRAGMA synchronous outlives the transaction; put the pooled connection back as it was
+        cursor.execute('PRAGMA synchronous=' + SQLITE_SYNCHRONOUS[durability])
+        try:
+            _bulk_insert(cursor, table, columns, rows)
+            conn.commit()
+        finally:
+            cursor.execute('PRAGMA synchronous=NORMAL')
+    return len(rows)
+
+def insert_chat_messages(rows, durability='normal'):
+    """Insert (room_id, sender_id, receiver_id, sender_name, sender_ip, content, created_at)
+    rows in one transaction"""
+    return offload(_insert_batch, 'chat_messages', CHAT_MESSAGE_COLUMNS, rows, durability)
+
+def get_chat_messages(room_id, limit=200):
+    """Get a random chat's logged messages, oldest first"""
+    return fetch_all(GET_CHAT_MESSAGES, (room_id, limit))
+
+def get_user_chat_messages(user_id, limit=200):
+    """Get the latest random chat messages sent by a user"""
+    return fetch_all(GET_USER_CHAT_MESSAGES, (user_id, limit))
 
 # ==================== FRIEND FUNCTIONS ====================
 
-def create_friend_request(user_id, friend_id):
-    """Create a friend request"""
-    try:
-        execute_query('''
-            INSERT INTO friends (user_id, friend_id, status)
-            VALUES (%s, %s, 'pending')
-        ''' if USE_POSTGRES else '''
-            INSERT INTO friends (user_id, friend_id, status)
-            VALUES (?, ?, 'pending')
-        ''', (user_id, friend_id))
-        return True
-    except Exception:
-        return False
+# A duplicate is skipped rather than raised, which would abort a caller's
+# PostgreSQL transaction
+CREATE_FRIEND_REQUEST = queries.define('create_friend_request', """
+    INSERT INTO friends (user_id, friend_id, status) VALUES (?, ?, 'pending')
+    ON CONFLICT (user_id, friend_id) DO NOTHING
+""")
+GET_FRIENDS = queries.define('get_friends', """
+    SELECT u.* FROM users u
+    JOIN friends f ON (f.friend_id = u.id OR f.user_id = u.id)
+    WHERE (f.user_id = ? OR f.friend_id = ?) AND f.status = 'accepted' AND u.id != ?
+""")
+GET_PENDING_FRIEND_REQUESTS = queries.define('get_pending_friend_requests', """
+    SELECT u.*, f.id as request_id, f.created_at as request_time
+    FROM users u
+    JOIN friends f ON f.user_id = u.id
+    WHERE f.friend_id = ? AND f.status = 'pending'
+""")
+GET_FRIEND_IDS = queries.define('get_friend_ids', """
+    SELECT friend_id AS id FROM friends WHERE user_id = ? AND status = 'accepted'
+    UNION
+    SELECT user_id AS id FROM friends WHERE friend_id = ? AND status = 'accepted'
+""")
+GET_PENDING_REQUESTER_IDS = queries.define('get_pending_requester_ids', """
+    SELECT user_id FROM friends WHERE friend_id = ? AND status = 'pending'
+""")
+ACCEPT_FRIEND_REQUEST = queries.define('accept_friend_request', """
+    UPDATE friends SET status = 'accepted' WHERE user_id = ? AND friend_id = ?
+""")
+REJECT_FRIEND_REQUEST = queries.define('reject_friend_request', """
+    DELETE FROM friends WHERE user_id = ? AND friend_id = ? AND status = 'pending'
+""")
+
+def create_friend_request(user_id, friend_id, tx=None):
+    """Create a friend request; False if one already exists in that direction"""
+    return offload(_create_friend_request, user_id, friend_id, tx)
+
+def _create_friend_request(user_id, friend_id, tx):
+    with _connection(tx) as conn:
+        cursor = _cursor(conn)
+        _run(cursor, CREATE_FRIEND_REQUEST, (user_id, friend_id))
+        created = cursor.rowcount > 0
+        if not USE_POSTGRES and tx is None:
+            conn.commit()
+        return created
 
 def get_friends(user_id):
     """Get user's friends"""
-    return fetch_all('''
-        SELECT u.* FROM users u
-        JOIN friends f ON (f.friend_id = u.id OR f.user_id = u.id)
-        WHERE (f.user_id = %s OR f.friend_id = %s) AND f.status = 'accepted' AND u.id != %s
-    ''' if USE_POSTGRES else '''
-        SELECT u.* FROM users u
-        JOIN friends f ON (f.friend_id = u.id OR f.user_id = u.id)
-        WHERE (f.user_id = ? OR f.friend_id = ?) AND f.status = 'accepted' AND u.id != ?
-    ''', (user_id, user_id, user_id))
+    return fetch_all(GET_FRIENDS, (user_id, user_id, user_id))
 
 def get_pending_friend_requests(user_id):
     """Get pending friend requests"""
-    return fetch_all('''
-        SELECT u.*, f.id as request_id, f.created_at as request_time
-        FROM users u
-        JOIN friends f ON f.user_id = u.id
-        WHERE f.friend_id = %s AND f.status = 'pending'
-    ''' if USE_POSTGRES else '''
-        SELECT u.*, f.id as request_id, f.created_at as request_time
-        FROM users u
-        JOIN friends f ON f.user_id = u.id
-        WHERE f.friend_id = ? AND f.status = 'pending'
-    ''', (user_id,))
-
-def accept_friend_request(user_id, requester_id):
+    return fetch_all(GET_PENDING_FRIEND_REQUESTS, (user_id,))
+
+def get_friend_ids(user_id):
+    """Get the ids of a user's accepted friends, in either direction"""
+    return [row[0] for row in fetch_all(GET_FRIEND_IDS, (user_id, user_id))]
+
+def get_pending_requester_ids(user_id):
+    """Get the ids of users with a pending request to user_id"""
+    return [row[0] for row in fetch_all(GET_PENDING_REQUESTER_IDS, (user_id,))]
+
+def get_friend_edges(user_ids):
+    """Get (user_id, friend_id, status) rows touching any of user_ids, in batches"""
+    user_ids = list(user_ids)
+    rows = []
+    for i in range(0, len(user_ids), ID_BATCH_SIZE // 2):
+        batch = user_ids[i:i + ID_BATCH_SIZE // 2]
+        marks = queries.placeholders(len(batch))
+        rows.extend(fetch_all(
+            f'SELECT user_id, friend_id, status FROM friends WHERE user_id IN ({marks}) OR friend_id IN ({marks})',
+            tuple(batch) * 2
+        ))
+    return rows
+
+def accept_friend_request(user_id, requester_id, tx=None):
     """Accept a friend request"""
-    execute_query('''
-        UPDATE friends SET status = 'accepted'
-        WHERE user_id = %s AND friend_id = %s
-    ''' if USE_POSTGRES else '''
-        UPDATE friends SET status = 'accepted'
-        WHERE user_id = ? AND friend_id = ?
-    ''', (requester_id, user_id))
+    execute_query(ACCEPT_FRIEND_REQUEST, (requester_id, user_id), tx=tx)
 
 def reject_friend_request(user_id, requester_id):
     """Reject a friend request"""
-    execute_query('''
-        DELETE FROM friends WHERE user_id = %s AND friend_id = %s AND status = 'pending'
-    ''' if USE_POSTGRES else '''
-        DELETE FROM friends WHERE user_id = ? AND friend_id = ? AND status = 'pending'
-    ''', (requester_id, user_id))
+    execute_query(REJECT_FRIEND_REQUEST, (requester_id, user_id))
 
 # ==================== ROOM FUNCTIONS ====================
 
+CREATE_ROOM = queries.define('create_room', """
+    INSERT INTO rooms (id, name, description, room_type, category, created_by)
+    VALUES (?, ?, ?, ?, ?, ?)
+""")
+ADD_ROOM_MEMBER = queries.define('add_room_member', """
+    INSERT INTO room_members (room_id, user_id, role) VALUES (?, ?, ?)
+""")
+GET_ROOMS = queries.define('get_rooms', 'SELECT * FROM rooms WHERE is_active = 1')
+GET_ROOMS_IN_CATEGORY = queries.define('get_rooms_in_category', """
+    SELECT * FROM rooms WHERE category = ? AND is_active = 1
+""")
+GET_ROOM_BY_ID = queries.define('get_room_by_id', 'SELECT * FROM rooms WHERE id = ?')
+REMOVE_ROOM_MEMBER = queries.define('remove_room_member', """
+    DELETE FROM room_members WHERE room_id = ? AND user_id = ?
+""")
+GET_ROOM_MESSAGES = queries.define('get_room_messages', f"""
+    SELECT rm.*, rm.{ROW_ID} AS id, u.username, u.gender FROM room_messages rm
+    JOIN users u ON rm.user_id = u.id
+    WHERE rm.room_id = ?
+    ORDER BY rm.created_at DESC, rm.{ROW_ID} DESC LIMIT ?
+""")
+GET_ROOM_MESSAGES_BEFORE = queries.define('get_room_messages_before', f"""
+    SELECT rm.*, rm.{ROW_ID} AS id, u.username, u.gender FROM room_messages rm
+    JOIN users u ON rm.user_id = u.id
+    WHERE rm.room_id = ? AND (rm.created_at, rm.{ROW_ID}) < (?, ?)
+    ORDER BY rm.created_at DESC, rm.{ROW_ID} DESC LIMIT ?
+""")
+CREATE_ROOM_MESSAGE = queries.define('create_room_message', """
+    INSERT INTO room_messages (room_id, user_id, content) VALUES (?, ?, ?)
+""")
+ROOM_MESSAGE_COLUMNS = ('room_id', 'user_id', 'content')
+SEQUENCED_ROOM_MESSAGE_COLUMNS = ('room_id', 'user_id', 'content', 'seq', 'created_at')
+GET_ROOM_LAST_SEQ = queries.define('get_room_last_seq', 'SELECT MAX(seq) FROM room_messages WHERE room_id = ?')
+GET_ROOM_MESSAGES_AFTER = queries.define('get_room_messages_after', """
+    SELECT rm.room_id, rm.seq, rm.user_id, u.username, rm.content, rm.created_at FROM room_messages rm
+    LEFT JOIN users u ON rm.user_id = u.id
+    WHERE rm.room_id = ? AND rm.seq > ?
+    ORDER BY rm.seq LIMIT ?
+""")
+
 def create_room(name, description, room_type, category, created_by):
     """Create a new room"""
     room_id = str(uuid.uuid4())
-    execute_query('''
-        INSERT INTO rooms (id, name, description, room_type, category, created_by)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    ''' if USE_POSTGRES else '''
-        INSERT INTO rooms (id, name, description, room_type, category, created_by)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (room_id, name, description, room_type, category, created_by))
+    execute_query(CREATE_ROOM, (room_id, name, description, room_type, category, created_by))
 
     # Add creator as admin
-    execute_query('''
-        INSERT INTO room_members (room_id, user_id, role)
-        VALUES (%s, %s, 'admin')
-    ''' if USE_POSTGRES else '''
-        INSERT INTO room_members (room_id, user_id, role)
-        VALUES (?, ?, 'admin')
-    ''', (room_id, created_by))
+    execute_query(ADD_ROOM_MEMBER, (room_id, created_by, 'admin'))
 
     return room_id
 
 def get_rooms(category='all'):
     """Get all rooms"""
     if category == 'all':
-        return fetch_all('SELECT * FROM rooms WHERE is_active = 1')
-    return fetch_all(
-        'SELECT * FROM rooms WHERE category = %s AND is_active = 1' if USE_POSTGRES else 'SELECT * FROM rooms WHERE category = ? AND is_active = 1',
-        (category,)
-    )
+        return fetch_all(GET_ROOMS)
+    return fetch_all(GET_ROOMS_IN_CATEGORY, (category,))
 
 def get_room_by_id(room_id):
     """Get room by ID"""
-    return fetch_one('SELECT * FROM rooms WHERE id = %s' if USE_POSTGRES else 'SELECT * FROM rooms WHERE id = ?', (room_id,))
+    return fetch_one(GET_ROOM_BY_ID, (room_id,))
 
 def join_room(room_id, user_id):
     """Join a room"""
     try:
-        execute_query('''
-            INSERT INTO room_members (room_id, user_id, role)
-            VALUES (%s, %s, 'member')
-        ''' if USE_POSTGRES else '''
-            INSERT INTO room_members (room_id, user_id, role)
-            VALUES (?, ?, 'member')
-        ''', (room_id, user_id))
+        execute_query(ADD_ROOM_MEMBER, (room_id, user_id, 'member'))
         return True
     except Exception:
         return False
 
 def leave_room(room_id, user_id):
     """Leave a room"""
-    execute_query('''
-        DELETE FROM room_members WHERE room_id = %s AND user_id = %s
-    ''' if USE_POSTGRES else '''
-        DELETE FROM room_members WHERE room_id = ? AND user_id = ?
-    ''', (room_id, user_id))
-
-def get_room_messages(room_id, limit=50):
-    """Get room messages"""
-    return fetch_all('''
-        SELECT rm.*, u.username, u.gender FROM room_messages rm
-        JOIN users u ON rm.user_id = u.id
-        WHERE rm.room_id = %s
-        ORDER BY rm.created_at DESC LIMIT %s
-    ''' if USE_POSTGRES else '''
-        SELECT rm.*, u.username, u.gender FROM room_messages rm
-        JOIN users u ON rm.user_id = u.id
-        WHERE rm.room_id = ?
-        ORDER BY rm.created_at DESC LIMIT ?
-    ''', (room_id, limit))
-
-def create_room_message(room_id, user_id, content):
+    execute_query(REMOVE_ROOM_MEMBER, (room_id, user_id))
+
+def get_room_messages(room_id, limit=50, before=None):
+    """Get room messages, newest first; before is a (created_at, id) key to page back from"""
+    if before:
+        return fetch_all(GET_ROOM_MESSAGES_BEFORE, (room_id, *before, limit))
+    return fetch_all(GET_ROOM_MESSAGES, (room_id, limit))
+
+def create_room_message(room_id, user_id, content, tx=None):
     """Create a room message"""
-    return execute_query('''
-        INSERT INTO room_messages (room_id, user_id, content)
-        VALUES (%s, %s, %s)
-    ''' if USE_POSTGRES else '''
-        INSERT INTO room_messages (room_id, user_id, content)
-        VALUES (?, ?, ?)
-    ''', (room_id, user_id, content))
+    return execute_query(CREATE_ROOM_MESSAGE, (room_id, user_id, content), tx=tx)
+
+def create_room_messages(rows, tx=None):
+    """Create (room_id, user_id, content) room messages in one transaction"""
+    return insert_rows('room_messages', ROOM_MESSAGE_COLUMNS, rows, tx)
+
+def insert_room_messages(rows, durability='normal'):
+    """Insert (room_id, user_id, content, seq, created_at) rows in one transaction"""
+    return offload(_insert_batch, 'room_messages', SEQUENCED_ROOM_MESSAGE_COLUMNS, rows, durability)
+
+def get_room_last_seq(room_id):
+    """Get the highest sequence number stored for a room (0 if none)"""
+    return fetch_value(GET_ROOM_LAST_SEQ, (room_id,), 0)
+
+def get_room_messages_after(room_id, after_seq, limit=100):
+    """Get a room's sequenced messages after after_seq, oldest first"""
+    return fetch_all(GET_ROOM_MESSAGES_AFTER, (room_id, after_seq, limit))
 
 # ==================== NOTIFICATION FUNCTIONS ====================
 
-def create_notification(user_id, notification_type, title, content, link=None):
+CREATE_NOTIFICATION = queries.define('create_notification', """
+    INSERT INTO notifications (user_id, notification_type, title, content, link)
+    VALUES (?, ?, ?, ?, ?)
+""")
+GET_NOTIFICATIONS = queries.define('get_notifications', f"""
+    SELECT *, {ROW_ID} AS id FROM notifications WHERE user_id = ?
+    ORDER BY created_at DESC, {ROW_ID} DESC LIMIT ?
+""")
+GET_NOTIFICATIONS_BEFORE = queries.define('get_notifications_before', f"""
+    SELECT *, {ROW_ID} AS id FROM notifications WHERE user_id = ? AND (created_at, {ROW_ID}) < (?, ?)
+    ORDER BY created_at DESC, {ROW_ID} DESC LIMIT ?
+""")
+MARK_NOTIFICATION_READ = queries.define('mark_notification_read', f"""
+    UPDATE notifications SET is_read = 1 WHERE {ROW_ID} = ? AND user_id = ?
+""")
+# The casts let PostgreSQL type parameters that only appear in the select list
+NOTIFY_ROOM_MEMBERS = queries.define('notify_room_members', """
+    INSERT INTO notifications (user_id, notification_type, title, content, link)
+    SELECT user_id, CAST(? AS TEXT), CAST(? AS TEXT), CAST(? AS TEXT), CAST(? AS TEXT)
+    FROM room_members WHERE room_id = ?
+""")
+NOTIFY_ROOM_MEMBERS_EXCEPT = queries.define('notify_room_members_except', """
+    INSERT INTO notifications (user_id, notification_type, title, content, link)
+    SELECT user_id, CAST(? AS TEXT), CAST(? AS TEXT), CAST(? AS TEXT), CAST(? AS TEXT)
+    FROM room_members WHERE room_id = ? AND user_id != ?
+""")
+NOTIFICATION_COLUMNS = ('user_id', 'notification_type', 'title', 'content', 'link')
+
+def create_notification(user_id, notification_type, title, content, link=None, tx=None):
     """Create a notification"""
-    execute_query('''
-        INSERT INTO notifications (user_id, notification_type, title, content, link)
-        VALUES (%s, %s, %s, %s, %s)
-    ''' if USE_POSTGRES else '''
-        INSERT INTO notifications (user_id, notification_type, title, content, link)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, notification_type, title, content, link))
-
-def get_notifications(user_id, limit=20):
-    """Get user notifications"""
-    return fetch_all('''
-        SELECT * FROM notifications WHERE user_id = %s
-        ORDER BY created_at DESC LIMIT %s
-    ''' if USE_POSTGRES else '''
-        SELECT * FROM notifications WHERE user_id = ?
-        ORDER BY created_at DESC LIMIT ?
-    ''', (user_id, limit))
+    execute_query(CREATE_NOTIFICATION, (user_id, notification_type, title, content, link), tx=tx)
+
+def create_notifications(rows, tx=None):
+    """Create (user_id, notification_type, title, content, link) notifications in one transaction"""
+    return insert_rows('notifications', NOTIFICATION_COLUMNS, rows, tx)
+
+def notify_users(user_ids, notification_type, title, content, link=None, tx=None):
+    """Send the same notification to many users with bulk inserts"""
+    return create_notifications([(user_id, notification_type, title, content, link) for user_id in user_ids], tx)
+
+def notify_room_members(room_id, notification_type, title, content, link=None, exclude_user_id=None, tx=None):
+    """Notify every member of a room (but exclude_user_id) with one INSERT ... SELECT"""
+    params = (notification_type, title, content, link, room_id)
+    if exclude_user_id:
+        execute_query(NOTIFY_ROOM_MEMBERS_EXCEPT, params + (exclude_user_id,), tx=tx)
+    else:
+        execute_query(NOTIFY_ROOM_MEMBERS, params, tx=tx)
+
+def get_notifications(user_id, limit=20, before=None):
+    """Get user notifications, newest first; before is a (created_at, id) key to page back from"""
+    if before:
+        return fetch_all(GET_NOTIFICATIONS_BEFORE, (user_id, *before, limit))
+    return fetch_all(GET_NOTIFICATIONS, (user_id, limit))
 
 def mark_notification_read(notification_id, user_id):
     """Mark notification as read"""
-    execute_query('''
-        UPDATE notifications SET is_read = 1
-        WHERE id = %s AND user_id = %s
-    ''' if USE_POSTGRES else '''
-        UPDATE notifications SET is_read = 1
-        WHERE id = ? AND user_id = ?
-    ''', (notification_id, user_id))
+    execute_query(MARK_NOTIFICATION_READ, (notification_id, user_id))
+
+# ==================== SEARCH FUNCTIONS ====================
+
+# A search runs in two steps: rank every match and keep one page of
+# (score, id) - lower scores first, keyset-paged like the listings above -
+# then load just those messages with their highlighted snippets.
+SEARCH_MESSAGE_COLUMNS = (f'm.{ROW_ID} AS id, m.sender_id, m.receiver_id, m.room_id, m.content, '
+                          'm.message_type, m.is_read, m.created_at, u.username AS sender_name')
+SEARCH_START = (float('-inf'), 0)   # sorts before every (score, id)
+
+if USE_POSTGRES:
+    _SEARCH_MATCHES = f"""
+        SELECT m.id, -ts_rank(m.content_tsv, query) AS score
+        FROM messages m, to_tsquery('{SEARCH_CONFIG}', ?) query
+        WHERE m.content_tsv @@ query
+    """
+    _SEARCH_SNIPPET = (f"ts_headline('{SEARCH_CONFIG}', m.content, to_tsquery('{SEARCH_CONFIG}', %s), "
+                       "'MaxFragments=1, MaxWords=24, MinWords=8, StartSel=' || chr(2) || ', StopSel=' || chr(3))")
+    _SEARCH_ROWS = f"""
+        SELECT {SEARCH_MESSAGE_COLUMNS}, {_SEARCH_SNIPPET} AS snippet
+        FROM messages m LEFT JOIN users u ON u.id = m.sender_id
+        WHERE m.id IN ({{ids}})
+    """
+    _SEARCH_USER_MATCHES = _SEARCH_MATCHES
+elif FULL_TEXT_SEARCH:
+    # Everyone's messages rank straight off the index, without visiting the table
+    _SEARCH_MATCHES = """
+        SELECT rowid AS id, bm25(messages_fts) AS score FROM messages_fts WHERE messages_fts MATCH ?
+    """
+    _SEARCH_USER_MATCHES = """
+        SELECT messages_fts.rowid AS id, bm25(messages_fts) AS score
+        FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+        WHERE messages_fts MATCH ?
+    """
+    _SEARCH_ROWS = f"""
+        SELECT {SEARCH_MESSAGE_COLUMNS},
+               snippet(messages_fts, 0, char(2), char(3), '…', 16) AS snippet
+        FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+        LEFT JOIN users u ON u.id = m.sender_id
+        WHERE messages_fts MATCH ? AND messages_fts.rowid IN ({{ids}})
+    """
+else:
+    # No FTS5: every message is scanned, newest first, and the snippet is the whole message
+    _SEARCH_MATCHES = """
+        SELECT m.rowid AS id, -m.rowid AS score FROM messages m
+        WHERE m.content LIKE ?
+    """
+    _SEARCH_USER_MATCHES = _SEARCH_MATCHES
+    _SEARCH_ROWS = f"""
+        SELECT {SEARCH_MESSAGE_COLUMNS}, m.content AS snippet
+        FROM messages m LEFT JOIN users u ON u.id = m.sender_id
+        WHERE m.content LIKE ? AND m.rowid IN ({{ids}})
+    """
+
+SEARCH_MESSAGES = queries.define('search_messages', f"""
+    SELECT id, score FROM ({_SEARCH_MATCHES}) found
+    WHERE (score, id) > (?, ?) ORDER BY score, id LIMIT ?
+""")
+SEARCH_USER_MESSAGES = queries.define('search_user_messages', f"""
+    SELECT id, score FROM ({_SEARCH_USER_MATCHES} AND (m.sender_id = ? OR m.receiver_id = ?)) found
+    WHERE (score, id) > (?, ?) ORDER BY score, id LIMIT ?
+""")
+
+def _search_pattern(terms):
+    """What the match step binds: an FTS5 or tsquery expression, or a LIKE pattern"""
+    if USE_POSTGRES:
+        return tsquery(terms)
+    if FULL_TEXT_SEARCH:
+        return fts5_query(terms)
+    return '%' + ' '.join(terms) + '%'     # terms are letters and digits, never LIKE wildcards
+
+def search_messages(user_id, query, limit=20, after=None):
+    """Search message text, best match first. user_id limits it to that user's
+    conversations (None searches everyone's, for moderators); after is a
+    (score, id) key to page on from. Returns dicts with a highlighted snippet."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    pattern = _search_pattern(terms)
+    start = tuple(after) if after else SEARCH_START
+    if user_id is None:
+        page = fetch_all(SEARCH_MESSAGES, (pattern, *start, limit))
+    else:
+        page = fetch_all(SEARCH_USER_MESSAGES, (pattern, user_id, user_id, *start, limit))
+    if not page:
+        return []
+
+    rows = fetch_all(_SEARCH_ROWS.format(ids=queries.placeholders(len(page))),
+                     (pattern, *[match['id'] for match in page]))
+    by_id = {row['id']: row for row in rows}
+    results = []
+    for match in page:
+        row = by_id.get(match['id'])
+        if row is not None:
+            results.append(dict(row._asdict(), snippet=highlight(row['snippet']), score=match['score']))
+    return results
+
+BACKFILL_BOUND = queries.define('search_backfill_bound', f"""
+    SELECT MAX({ROW_ID}) FROM (
+        SELECT {ROW_ID} FROM messages WHERE {ROW_ID} > ? AND {ROW_ID} <= ? ORDER BY {ROW_ID} LIMIT ?
+    ) batch
+""")
+SET_BACKFILL_PROGRESS = queries.define('search_backfill_progress', """
+    UPDATE search_index_state SET last_id = ? WHERE name = 'messages'
+""")
+if USE_POSTGRES:
+    BACKFILL_STATE = queries.define('search_backfill_state', """
+        SELECT end_id, last_id FROM search_index_state WHERE name = 'messages' FOR UPDATE
+    """)
+    BACKFILL_BATCH = queries.define('search_backfill_batch', f"""
+        UPDATE messages SET content_tsv = to_tsvector('{SEARCH_CONFIG}', COALESCE(content, ''))
+        WHERE id > ? AND id <= ? AND content_tsv IS NULL
+    """)
+else:
+    BACKFILL_STATE = queries.define('search_backfill_state', """
+        SELECT end_id, last_id FROM search_index_state WHERE name = 'messages'
+    """)
+    BACKFILL_BATCH = queries.define('search_backfill_batch', """
+        INSERT INTO messages_fts (rowid, content)
+        SELECT rowid, content FROM messages WHERE rowid > ? AND rowid <= ?
+    """)
+
+def backfill_message_search(batch=5000):
+    """Index up to `batch` messages that predate the search index; returns (indexed, any left)"""
+    if not FULL_TEXT_SEARCH:
+        return 0, False
+    return offload(_backfill_message_search, batch)
+
+def _backfill_message_search(batch):
+    with get_db() as conn:
+        cursor = _cursor(conn)
+        # Hold the progress row (SQLite: the write lock) so workers take turns
+        # and no trigger sees last_id mid-batch
+        if USE_POSTGRES:
+            conn.autocommit = False
+        else:
+            cursor.execute('BEGIN IMMEDIATE')
+        _run(cursor, BACKFILL_STATE, ())
+        state = cursor.fetchone()
+        if state is None or state[1] >= state[0]:
+            conn.commit()
+            return 0, False
+        end_id, last_id = state
+
+        _run(cursor, BACKFILL_BOUND, (last_id, end_id, batch))
+        upto = cursor.fetchone()[0] or end_id
+        _run(cursor, BACKFILL_BATCH, (last_id, upto))
+        indexed = max(cursor.rowcount, 0)
+        _run(cursor, SET_BACKFILL_PROGRESS, (upto,))
+        conn.commit()
+        return indexed, upto < end_id
 
 # ==================== STATS FUNCTIONS ====================
 
+COUNT_USERS = queries.define('count_users', 'SELECT COUNT(*) FROM users')
+COUNT_ONLINE_USERS = queries.define('count_online_users', 'SELECT COUNT(*) FROM users WHERE is_online = 1')
+COUNT_ROOMS = queries.define('count_rooms', 'SELECT COUNT(*) FROM rooms WHERE is_active = 1')
+COUNT_MESSAGES = queries.define('count_messages', 'SELECT COUNT(*) FROM messages')
+
 def get_stats():
     """Get platform statistics"""
-    total_users = fetch_one('SELECT COUNT(*) as count FROM users')
-    online_users = fetch_one('SELECT COUNT(*) as count FROM users WHERE is_online = 1')
-    total_rooms = fetch_one('SELECT COUNT(*) as count FROM rooms WHERE is_active = 1')
-    total_messages = fetch_one('SELECT COUNT(*) as count FROM messages')
-
     return {
-        'total_users': total_users['count'] if total_users else 0,
-        'online_users': online_users['count'] if online_users else 0,
-        'total_rooms': total_users['count'] if total_rooms else 0,
-        'total_messages': total_messages['count'] if total_messages else 0
+        'total_users': fetch_value(COUNT_USERS, default=0),
+        'online_users': fetch_value(COUNT_ONLINE_USERS, default=0),
+        'total_rooms': fetch_value(COUNT_ROOMS, default=0),
+        'total_messages': fetch_value(COUNT_MESSAGES, default=0)
     }
 
 # Initialize database on import
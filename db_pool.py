@@ -0,0 +1,173 @@
+# Database Pool Module
+# Keeps database connections open between queries. Opening a connection per
+# query costs a connect (a TCP + auth round trip on PostgreSQL; a file open
+# and three PRAGMAs on SQLite) and throws away SQLite's page cache, so it
+# never warms up. Connections are created on demand up to `size`, handed
+# out one caller at a time and reset before they go back.
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """No connection came free within the pool's timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of connections made by `connect()`.
+
+    `reset(conn)` runs when a connection comes back (roll back anything the
+    caller left open, restore session settings); if it raises, or the
+    caller's block raised one of `broken_errors`, the connection is closed
+    instead of reused. A connection idle for more than `check_after`
+    seconds is tested with `check(conn)` before it is handed out again, so
+    callers don't get one the server has since dropped.
+    """
+
+    def __init__(self, connect, size=10, timeout=30.0, reset=None, check=None, check_after=30.0,
+                 broken_errors=(), name=None, clock=time.monotonic):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.reset = reset
+        self.check = check
+        self.check_after = check_after
+        self.broken_errors = tuple(broken_errors)
+        self.name = name
+        self.clock = clock
+        self.idle = []              # [(conn, returned_at)], most recently returned last
+        self.open_count = 0         # connections created and not yet closed
+        self.in_use = 0
+        self.closed = False
+        self.cond = threading.Condition()
+        self.stats = {
+            'checkouts': 0,
+            'created': 0,
+            'waits': 0,             # checkouts that found the pool exhausted
+            'timeouts': 0,
+            'discarded': 0,         # broken, failed a check or reset, or left over after close()
+            'check_failures': 0,
+            'peak_in_use': 0,
+            'checkout_ms_total': 0.0,
+            'checkout_ms_max': 0.0
+        }
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self.stats['discarded'] += 1
+
+    def acquire(self):
+        """Borrow a connection, waiting up to `timeout` seconds for one to come free"""
+        start = self.clock()
+        conn = None
+        with self.cond:
+            if self.closed:
+                raise PoolTimeout('Connection pool is closed')
+            self.stats['checkouts'] += 1
+            waited = False
+            while True:
+                if self.idle:
+                    conn, returned_at = self.idle.pop()
+                    break
+                if self.open_count < self.size:
+                    self.open_count += 1
+                    break
+                if not waited:
+                    self.stats['waits'] += 1
+                    waited = True
+                remaining = self.timeout - (self.clock() - start)
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection free after {self.timeout}s ({self.size} in use)')
+                self.cond.wait(remaining)
+            self.in_use += 1
+            self.stats['peak_in_use'] = max(self.stats['peak_in_use'], self.in_use)
+
+        try:
+            if conn is not None and self.check and self.clock() - returned_at > self.check_after:
+                try:
+                    self.check(conn)
+                except Exception:
+                    self.stats['check_failures'] += 1
+                    self._discard(conn)
+                    conn = None
+            if conn is None:
+                conn = self.connect()
+                self.stats['created'] += 1
+        except Exception:
+            with self.cond:
+                self.in_use -= 1
+                self.open_count -= 1
+                self.cond.notify()
+            raise
+
+        elapsed_ms = (self.clock() - start) * 1000
+        with self.cond:
+            self.stats['checkout_ms_total'] += elapsed_ms
+            self.stats['checkout_ms_max'] = max(self.stats['checkout_ms_max'], elapsed_ms)
+        return conn
+
+    def release(self, conn, broken=False):
+        """Return a borrowed connection (closed instead if broken or it can't be reset)"""
+        broken = broken or self.closed
+        if not broken and self.reset:
+            try:
+                self.reset(conn)
+            except Exception:
+                broken = True
+        if broken:
+            self._discard(conn)
+        with self.cond:
+            self.in_use -= 1
+            if broken:
+                self.open_count -= 1
+            else:
+                self.idle.append((conn, self.clock()))
+            self.cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ... - returned to the pool on exit"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except self.broken_errors:
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """Close the idle connections; borrowed ones are closed when they come back"""
+        with self.cond:
+            idle, self.idle = self.idle, []
+            self.open_count -= len(idle)
+            self.closed = True
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def get_stats(self):
+        """Get pool statistics"""
+        with self.cond:
+            checkouts = self.stats['checkouts']
+            return {
+                'size': self.size,
+                'open': self.open_count,
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'peak_in_use': self.stats['peak_in_use'],
+                'checkouts': checkouts,
+                'created': self.stats['created'],
+                'waits': self.stats['waits'],
+                'timeouts': self.stats['timeouts'],
+                'discarded': self.stats['discarded'],
+                'check_failures': self.stats['check_failures'],
+                'checkout_ms_avg': round(self.stats['checkout_ms_total'] / checkouts, 3) if checkouts else None,
+                'checkout_ms_max': round(self.stats['checkout_ms_max'], 3)
+            }
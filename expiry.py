@@ -0,0 +1,106 @@
+# Expiry Scheduler Module
+# Hashed timing wheel for expiring idle keys (stale sockets, idle IP counters)
+# without scanning every entry.
+import math
+import threading
+import time
+
+
+class TimingWheel:
+    """Expires keys that have not been touched for `timeout` seconds.
+
+    Deadlines are rounded up to a `tick` boundary and keys are bucketed by
+    tick number, so touch() and cancel() are O(1) and advance() only visits
+    the buckets that have come due. Keys expire between timeout and
+    timeout + tick seconds after their last touch.
+    """
+
+    def __init__(self, timeout, tick=5.0, clock=time.time):
+        self.timeout = timeout
+        self.tick = tick
+        self.clock = clock
+        self.slots = {}         # {tick_number: set(keys)}
+        self.deadlines = {}     # {key: tick_number}
+        self.current = self._slot(clock())
+        self.lock = threading.Lock()
+        self.expired_total = 0
+
+    def _slot(self, when):
+        return math.ceil(when / self.tick)
+
+    def touch(self, key, now=None):
+        """(Re)start the idle timer for key"""
+        slot = self._slot((self.clock() if now is None else now) + self.timeout)
+        with self.lock:
+            old = self.deadlines.get(key)
+            if old == slot:
+                return
+            if old is not None:
+                self._discard(key, old)
+            self.deadlines[key] = slot
+            self.slots.setdefault(slot, set()).add(key)
+
+    def refresh(self, key, now=None):
+        """Restart key's idle timer if it is still tracked; returns whether it was"""
+        slot = self._slot((self.clock() if now is None else now) + self.timeout)
+        with self.lock:
+            old = self.deadlines.get(key)
+            if old is None:
+                return False
+            if old != slot:
+                self._discard(key, old)
+                self.deadlines[key] = slot
+                self.slots.setdefault(slot, set()).add(key)
+            return True
+
+    def cancel(self, key):
+        """Stop tracking key; returns True if it was scheduled"""
+        with self.lock:
+            slot = self.deadlines.pop(key, None)
+            if slot is None:
+                return False
+            self._discard(key, slot)
+            return True
+
+    def _discard(self, key, slot):
+        keys = self.slots.get(slot)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.slots[slot]
+
+    def advance(self, now=None):
+        """Pop and return every key whose deadline has passed"""
+        target = math.floor((self.clock() if now is None else now) / self.tick)
+        expired = []
+        with self.lock:
+            if target - self.current > len(self.slots):
+                # Long gap since the last advance: visit only occupied slots
+                due = sorted(slot for slot in self.slots if slot <= target)
+            else:
+                due = range(self.current, target + 1)
+            for slot in due:
+                keys = self.slots.pop(slot, None)
+                if keys:
+                    for key in keys:
+                        del self.deadlines[key]
+                    expired.extend(keys)
+            self.current = max(self.current, target + 1)
+        self.expired_total += len(expired)
+        return expired
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def get_stats(self):
+        """Get scheduler statistics"""
+        return {
+            'tracked': len(self.deadlines),
+            'slots': len(self.slots),
+            'expired_total': self.expired_total,
+            'timeout': self.timeout,
+            'tick': self.tick
+        }
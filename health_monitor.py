@@ -66,12 +66,12 @@ def check_memory():
 def check_socket_connections():
     """Check Socket.IO connections"""
     try:
-        total = len(active_connections)
+        stats = presence.get_stats()
         return {
             'status': 'healthy',
-            'total_connections': total,
-            'guests': sum(1 for c in active_connections.values() if c.get('is_guest')),
-            'registered': total - sum(1 for c in active_connections.values() if c.get('is_guest'))
+            'total_connections': stats['total'],
+            'guests': stats['guests'],
+            'registered': stats['registered']
         }
     except Exception as e:
         return {'status': 'error', 'message': str(e)}
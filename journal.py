@@ -0,0 +1,157 @@
+# Message Journal Module
+# Write-behind persistence for random 1-on-1 chat messages. Handlers append
+# to a bounded in-memory queue; a background writer inserts whatever has
+# accumulated in one transaction every `interval` seconds, or as soon as
+# `batch_rows` rows are waiting.
+import threading
+import time
+from collections import deque
+
+DURABILITY_LEVELS = ('off', 'normal', 'full')
+
+
+class MessageJournal:
+    """Bounded write-behind queue in front of a batch insert.
+
+    `write(rows, durability)` persists a list of row tuples in one
+    transaction. When the queue is full the oldest unwritten rows are
+    dropped (and counted) so a stalled database can't grow memory without
+    bound. A failed flush puts its rows back at the front of the queue.
+    After `max_attempts` failures in a row the batch is bisected to find
+    the rows the database rejects on their own; those are logged, counted
+    as rejected and dropped, and the rest are written. If no part of the
+    batch can be written the database is taken to be down and the whole
+    batch is requeued instead.
+    """
+
+    def __init__(self, write, interval=0.2, batch_rows=500, max_rows=50000, durability='normal', max_attempts=3):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f'Unknown durability: {durability} (choose from {", ".join(DURABILITY_LEVELS)})')
+        self.write = write
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self.max_rows = max_rows
+        self.durability = durability
+        self.max_attempts = max_attempts
+        self.attempts = 0       # consecutive failed writes of the batch at the front
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # one writer at a time (background task or close)
+        self.wake = threading.Event()
+        self.running = False
+        self.stats = {
+            'queued': 0,        # rows accepted
+            'written': 0,       # rows committed
+            'dropped': 0,       # rows discarded because the queue was full
+            'flushes': 0,       # committed batches
+            'failures': 0,      # batches that raised and were requeued
+            'rejected': 0,      # rows dropped because they failed even when written alone
+            'last_flush_ms': 0.0
+        }
+
+    def record(self, *row):
+        """Queue one row; never touches the database"""
+        with self.lock:
+            if len(self.queue) >= self.max_rows:
+                self.queue.popleft()
+                self.stats['dropped'] += 1
+            self.queue.append(row)
+            self.stats['queued'] += 1
+            full = len(self.queue) >= self.batch_rows
+        if full:
+            self.wake.set()
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        with self.flush_lock:
+            written = 0
+            while True:
+                with self.lock:
+                    if not self.queue:
+                        return written
+                    batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.batch_rows))]
+
+                start = time.perf_counter()
+                try:
+                    self.write(batch, self.durability)
+                    count = len(batch)
+                except Exception:
+                    self.attempts += 1
+                    if self.attempts < self.max_attempts:
+                        self._requeue(batch)
+                        raise
+                    self.attempts = 0
+                    count, rejected = self._isolate(batch)
+                    if not count:
+                        self._requeue(batch)
+                        raise
+                    for row, error in rejected:
+                        print(f"Message journal rejected row {row!r}: {error}")
+                    with self.lock:
+                        self.stats['rejected'] += len(rejected)
+                self.attempts = 0
+
+                with self.lock:
+                    self.stats['written'] += count
+                    self.stats['flushes'] += 1
+                    self.stats['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 2)
+                written += count
+
+    def _requeue(self, batch):
+        """Put a failed batch back at the front, dropping the oldest rows past max_rows"""
+        with self.lock:
+            self.stats['failures'] += 1
+            self.queue.extendleft(reversed(batch))
+            overflow = len(self.queue) - self.max_rows
+            for _ in range(max(overflow, 0)):
+                self.queue.popleft()
+                self.stats['dropped'] += 1
+
+    def _isolate(self, batch):
+        """Bisect a failing batch, writing every half the database accepts;
+        returns (rows written, [(row, error)] for rows that fail on their own)"""
+        written, rejected = 0, []
+        mid = len(batch) // 2
+        for half in (batch[:mid], batch[mid:]):
+            if not half:
+                continue
+            try:
+                self.write(half, self.durability)
+                written += len(half)
+            except Exception as e:
+                if len(half) == 1:
+                    rejected.append((half[0], e))
+                else:
+                    count, bad = self._isolate(half)
+                    written += count
+                    rejected.extend(bad)
+        return written, rejected
+
+    def run(self):
+        """Writer loop - start with socketio.start_background_task(run)"""
+        self.running = True
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Message journal flush error: {e}")
+
+    def close(self):
+        """Stop the writer and drain the queue (call on shutdown)"""
+        self.running = False
+        self.wake.set()
+        try:
+            return self.flush()
+        except Exception as e:
+            print(f"Message journal drain error: {e}")
+            return 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def get_stats(self):
+        """Get journal statistics"""
+        with self.lock:
+            return dict(self.stats, pending=len(self.queue), durability=self.durability)
@@ -0,0 +1,349 @@
+# Rate Limiter Module
+# GCRA (generic cell rate algorithm) limiter shared by the Socket.IO handlers
+# and the REST decorator. Each tracked key costs one float (its theoretical
+# arrival time), and keys whose allowance has fully refilled are evicted.
+# SharedRateLimiter and SharedBanList extend limits and bans across workers.
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from blocklist import CidrTable, parse_network
+from state_backend import create_client
+
+Policy = namedtuple('Policy', ['limit', 'window'])
+
+POLICIES = {
+    'request': Policy(30, 60),         # 30 requests per minute
+    'message': Policy(20, 60),         # 20 messages per minute
+    'connect': Policy(3, 60),          # 3 socket connections per minute
+    'login': Policy(5, 300),           # 5 login attempts per 5 minutes
+    'admin_login': Policy(5, 300),     # 5 admin login attempts per 5 minutes
+    'register': Policy(3, 600),        # 3 registrations per 10 minutes
+}
+
+# Idle keys evicted per check, so eviction cost stays O(1) per call
+EVICT_PER_CHECK = 4
+
+
+class RateLimiter:
+    """Named-policy GCRA limiter (one process).
+
+    A policy allows `limit` hits per `window` seconds, as a burst or spread
+    out. Per key we keep only the theoretical arrival time (tat); a key whose
+    tat is in the past has a full allowance and can be forgotten. Keys are
+    kept in least-recently-hit order so idle ones are evicted from the front.
+    """
+
+    shared = False
+
+    def __init__(self, policies=None, clock=time.time):
+        self.policies = dict(POLICIES if policies is None else policies)
+        self.clock = clock
+        self.state = {action: OrderedDict() for action in self.policies}    # {action: {key: tat}}
+        self.lock = threading.Lock()
+        self.stats = {'allowed': 0, 'limited': 0, 'evicted': 0}
+
+    def check_rate_limit(self, key, action='request', now=None):
+        """Record a hit; returns (allowed, retry_after_seconds)"""
+        if action not in self.policies:
+            action = 'request'
+        limit, window = self.policies[action]
+        interval = window / limit
+        now = self.clock() if now is None else now
+
+        with self.lock:
+            keys = self.state[action]
+            self._evict(keys, now, EVICT_PER_CHECK)
+            tat = max(keys.get(key, now), now) + interval
+            if tat - now > window:
+                self.stats['limited'] += 1
+                return False, tat - now - window
+            keys[key] = tat
+            keys.move_to_end(key)
+            self.stats['allowed'] += 1
+            return True, 0
+
+    def _evict(self, keys, now, budget):
+        while keys and budget:
+            key, tat = next(iter(keys.items()))
+            if tat > now:
+                return
+            del keys[key]
+            self.stats['evicted'] += 1
+            budget -= 1
+
+    def evict_idle(self, now=None):
+        """Forget every key at the front whose allowance has fully refilled"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            before = self.stats['evicted']
+            for keys in self.state.values():
+                self._evict(keys, now, -1)
+            return self.stats['evicted'] - before
+
+    def reset(self, key):
+        """Reset rate limit for a key"""
+        with self.lock:
+            for keys in self.state.values():
+                keys.pop(key, None)
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.state.values())
+
+    def get_stats(self):
+        """Get limiter statistics"""
+        return dict(self.stats, tracked={action: len(keys) for action, keys in self.state.items()})
+
+
+class SharedRateLimiter:
+    """Cluster-wide limiter over a Redis-protocol store.
+
+    Uses a sliding-window counter per key: hits in the current fixed window
+    plus the previous window's count weighted by how much of it still
+    overlaps. Checks never touch the network - each worker adds its hits to
+    local pending counts and sync() pushes them with INCRBY every `interval`
+    seconds, one pipelined round trip for all keys hit since the last sync.
+    INCRBY returns the cluster-wide count, which refreshes the local view of
+    that key. A worker can overshoot by the hits other workers have not
+    pushed yet, or made since this worker last hit the key.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix='ratelimit', policies=None, interval=0.1, clock=time.time):
+        self.client = client
+        self.prefix = prefix
+        self.policies = dict(POLICIES if policies is None else policies)
+        self.interval = interval
+        self.clock = clock
+        self.pending = {}       # {(action, key, window_no): hits not yet pushed}
+        self.counts = OrderedDict()     # {(action, key): [window_no, current, previous, last_hit]}, LRU order
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {'allowed': 0, 'limited': 0, 'evicted': 0, 'syncs': 0}
+
+    def _key(self, action, key, window_no):
+        return f'{self.prefix}:{action}:{key}:{window_no}'
+
+    def check_rate_limit(self, key, action='request', now=None):
+        """Record a hit; returns (allowed, retry_after_seconds)"""
+        if action not in self.policies:
+            action = 'request'
+        limit, window = self.policies[action]
+        now = self.clock() if now is None else now
+        window_no = int(now // window)
+        elapsed = now / window - window_no
+
+        with self.lock:
+            snapshot = self.counts.get((action, key))
+            current = previous = 0
+            if snapshot is not None:
+                if snapshot[0] == window_no:
+                    current, previous = snapshot[1], snapshot[2]
+                elif snapshot[0] == window_no - 1:
+                    previous = snapshot[1]
+            current += self.pending.get((action, key, window_no), 0)
+
+            if previous * (1 - elapsed) + current >= limit:
+                self.stats['limited'] += 1
+                if current >= limit or not previous:
+                    return False, (1 - elapsed) * window
+                return False, ((1 - (limit - current) / previous) - elapsed) * window
+
+            pending_key = (action, key, window_no)
+            self.pending[pending_key] = self.pending.get(pending_key, 0) + 1
+            if snapshot is None:
+                self.counts[(action, key)] = [window_no, 0, 0, now]
+            else:
+                snapshot[3] = now
+                self.counts.move_to_end((action, key))
+            self.stats['allowed'] += 1
+            return True, 0
+
+    def sync(self, now=None):
+        """Push pending hits and refresh the counts of the keys they touched"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            # Keys idle for two windows carry no weight any more
+            while self.counts:
+                action_key, snapshot = next(iter(self.counts.items()))
+                if now - snapshot[3] <= 2 * self.policies[action_key[0]].window:
+                    break
+                del self.counts[action_key]
+                self.stats['evicted'] += 1
+
+        if pending:
+            pipe = self.client.pipeline(transaction=False)
+            for (action, key, window_no), hits in pending.items():
+                name = self._key(action, key, window_no)
+                pipe.incrby(name, hits)
+                pipe.expire(name, 2 * self.policies[action].window)
+                pipe.get(self._key(action, key, window_no - 1))
+            results = pipe.execute()
+
+            with self.lock:
+                for i, (action, key, window_no) in enumerate(pending):
+                    snapshot = self.counts.get((action, key))
+                    if snapshot is not None and snapshot[0] <= window_no:
+                        current, previous = results[3 * i], results[3 * i + 2]
+                        snapshot[:3] = [window_no, int(current), int(previous or 0)]
+
+        self.stats['syncs'] += 1
+
+    def evict_idle(self, now=None):
+        """Idle keys are dropped by sync(); kept for RateLimiter compatibility"""
+        return 0
+
+    def reset(self, key):
+        """Reset rate limit for a key on every worker"""
+        with self.lock:
+            for action_key in [ak for ak in self.counts if ak[1] == key]:
+                del self.counts[action_key]
+            for pending_key in [pk for pk in self.pending if pk[1] == key]:
+                del self.pending[pending_key]
+        window_nos = {action: int(self.clock() // policy.window) for action, policy in self.policies.items()}
+        self.client.delete(*[self._key(action, key, window_no - offset)
+                             for action, window_no in window_nos.items() for offset in (0, 1)])
+
+    def run(self, sleep):
+        """Sync loop - start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            sleep(self.interval)
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Rate limiter sync error: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def __len__(self):
+        return len(self.counts)
+
+    def get_stats(self):
+        """Get limiter statistics"""
+        return dict(self.stats, tracked=len(self.counts), pending=len(self.pending))
+
+
+# ==================== IP BANS ====================
+
+class BanList:
+    """IP and CIDR bans with an optional expiry (one process)"""
+
+    shared = False
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.bans = {}              # {cidr: unban_time, 0 = permanent}
+        self.table = CidrTable()    # same bans, indexed for lookups
+        self.lock = threading.Lock()
+
+    def ban(self, ip, duration_seconds=3600):
+        """Ban an IP or CIDR range; duration_seconds=None bans permanently.
+
+        Returns the normalised CIDR that was banned.
+        """
+        cidr = str(parse_network(ip))
+        unban_time = self.clock() + duration_seconds if duration_seconds else 0
+        with self.lock:
+            self.bans[cidr] = unban_time
+            self.table.add(cidr, unban_time)
+        return cidr
+
+    def unban(self, ip):
+        cidr = str(parse_network(ip))
+        with self.lock:
+            self.bans.pop(cidr, None)
+            self.table.discard(cidr)
+        return cidr
+
+    def is_banned(self, ip):
+        """True if ip falls in a ban that has not expired"""
+        return self.table.match(ip, self.clock()) is not None
+
+    def cleanup(self):
+        """Drop expired bans; returns how many were removed"""
+        now = self.clock()
+        expired = [cidr for cidr, unban_time in list(self.bans.items()) if unban_time and now > unban_time]
+        for cidr in expired:
+            self.unban(cidr)
+        return len(expired)
+
+    def __len__(self):
+        return len(self.bans)
+
+
+class SharedBanList(BanList):
+    """BanList kept in one Redis hash, with a local copy for lookups.
+
+    ban()/unban() write through immediately; run() reloads the local copy
+    every `interval` seconds in the background, so a ban made on another
+    worker applies here within that interval and lookups never wait on the
+    store.
+    """
+
+    shared = True
+
+    def __init__(self, client, key='ratelimit:bans', interval=1.0, clock=time.time):
+        super().__init__(clock)
+        self.client = client
+        self.key = key
+        self.interval = interval
+        self.loaded_at = None
+        self.running = False
+
+    def refresh(self):
+        """Reload the local copy from the store"""
+        bans = {cidr: float(unban_time) for cidr, unban_time in self.client.hgetall(self.key).items()}
+        table = CidrTable()
+        for cidr, unban_time in bans.items():
+            table.add(cidr, unban_time)
+        with self.lock:
+            self.bans, self.table = bans, table
+            self.loaded_at = self.clock()
+
+    def ban(self, ip, duration_seconds=3600):
+        cidr = super().ban(ip, duration_seconds)
+        self.client.hset(self.key, cidr, self.bans[cidr])
+        return cidr
+
+    def unban(self, ip):
+        cidr = super().unban(ip)
+        self.client.hdel(self.key, cidr)
+        return cidr
+
+    def cleanup(self):
+        """Drop expired bans from the store; returns how many were removed"""
+        self.refresh()
+        return super().cleanup()
+
+    def run(self, sleep):
+        """Reload loop - start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Ban list refresh error: {e}")
+            sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+
+
+def create_rate_limiter(url='', interval=0.1):
+    """RateLimiter for ''/memory://, SharedRateLimiter otherwise (see create_client)"""
+    client = create_client(url)
+    if client is None:
+        return RateLimiter()
+    return SharedRateLimiter(client, interval=interval)
+
+
+def create_ban_list(url=''):
+    """BanList for ''/memory://, SharedBanList otherwise (see create_client)"""
+    client = create_client(url)
+    if client is None:
+        return BanList()
+    return SharedBanList(client)
@@ -0,0 +1,372 @@
+# Load Test Module
+# In-process load generator for the Socket.IO chat server. Thousands of
+# simulated clients go through guest login, connect, find_partner, typing,
+# send_message, next_person and disconnect against the real app.py handlers
+# via Flask-SocketIO's test client, so every packet is still encoded and
+# decoded but nothing touches the network.
+#
+#   python loadtest.py [scenario] [--clients N] [--seed S] [--json out.json]
+#                      [--baseline base.json] [--tolerance 0.25] [--min-delta-ms 1]
+#
+# Client actions follow a seeded virtual-time schedule, so a scenario always
+# produces the same sequence of events; latencies are real wall-clock time.
+import argparse
+import heapq
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+Scenario = namedtuple('Scenario', [
+    'clients',      # simulated users
+    'ramp',         # virtual seconds over which clients arrive
+    'rounds',       # chats per user before it disconnects
+    'messages',     # messages each side sends per chat
+    'keystrokes',   # typing events sent before each message
+    'think',        # mean virtual seconds between a user's actions
+    'seed'
+])
+
+SCENARIOS = {
+    'smoke': Scenario(clients=200, ramp=10, rounds=2, messages=3, keystrokes=3, think=1.0, seed=42),
+    'chat': Scenario(clients=2000, ramp=60, rounds=3, messages=5, keystrokes=4, think=2.0, seed=42),
+    'churn': Scenario(clients=5000, ramp=30, rounds=6, messages=1, keystrokes=1, think=0.5, seed=42),
+}
+
+GENDERS = ['male', 'female']
+PREFERENCES = ['any', 'opposite', 'same']
+
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) chat-online-loadtest'
+
+# Latency metrics compared against a baseline run
+TRACKED = ('connect', 'time_to_match', 'message_rtt')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples):
+    """Count and p50/p95/p99 in milliseconds"""
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50) * 1000,
+        'p95': percentile(values, 95) * 1000,
+        'p99': percentile(values, 99) * 1000,
+    }
+
+
+def current_rss():
+    """Resident set size in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return peak_rss()
+
+
+def peak_rss():
+    """Peak resident set size in bytes (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def load_app():
+    """Import app.py against a throwaway database and in-process state"""
+    os.environ.setdefault('DATABASE_URL', os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'chat_online.db'))
+    for name in ('REDIS_URL', 'STATE_BACKEND_URL', 'SOCKETIO_MESSAGE_QUEUE', 'RATELIMIT_STORAGE_URL',
+                 'SNAPSHOT_PATH'):
+        os.environ[name] = ''
+    import app
+    return app
+
+
+class SimulatedClient:
+    """One user: an HTTP cookie jar plus a Socket.IO test client"""
+
+    def __init__(self, index, rng):
+        self.index = index
+        self.username = f'lt{index}'
+        self.ip = f'10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}'
+        self.gender = rng.choice(GENDERS)
+        self.preference = rng.choice(PREFERENCES)
+        self.http = None
+        self.socket = None
+        self.partner = None         # SimulatedClient currently paired with
+        self.generation = 0         # bumped on every pairing change; stale actions are skipped
+        self.rounds_left = 0
+        self.messages_left = 0
+        self.searching_since = None
+
+    def drain(self):
+        """Take every event received so far (the test client's get_received is O(n^2))"""
+        events, self.socket.queue = self.socket.queue, []
+        return events
+
+
+class LoadGenerator:
+    """Replays a seeded scenario against the app and collects latencies"""
+
+    def __init__(self, scenario, app_module=None):
+        self.scenario = scenario
+        self.app = app_module or load_app()
+        self.rng = random.Random(scenario.seed)
+        self.clients = {}           # {username: SimulatedClient}
+        self.schedule = []          # heap of (virtual_time, seq, action, client, generation)
+        self.seq = 0
+        self.samples = {name: [] for name in TRACKED}
+        self.counts = {'matches': 0, 'messages': 0, 'lost_messages': 0, 'typing': 0,
+                       'next': 0, 'errors': 0, 'exceptions': 0, 'unmatched': 0}
+        self.failures = []          # first few exceptions, for the report
+
+    # ---- scheduling ----
+
+    def at(self, when, action, client):
+        self.seq += 1
+        heapq.heappush(self.schedule, (when, self.seq, action, client, client.generation))
+
+    def later(self, now, action, client):
+        self.at(now + self.rng.expovariate(1.0 / self.scenario.think), action, client)
+
+    def call(self, fn, *args):
+        """Run one client operation; handler exceptions count as errors"""
+        try:
+            fn(*args)
+            return True
+        except Exception as e:
+            self.counts['exceptions'] += 1
+            if len(self.failures) < 5:
+                self.failures.append(f'{fn.__name__}: {type(e).__name__}: {e}')
+            return False
+
+    def events(self, client, name):
+        """Drain a client's events and return the args of those named `name`"""
+        found = []
+        for event in client.drain():
+            if event['name'] == name:
+                found.append(event['args'][0] if event['args'] else None)
+            elif event['name'] == 'error':
+                self.counts['errors'] += 1
+        return found
+
+    # ---- pairing bookkeeping ----
+
+    def paired(self, now, client, partner_name):
+        """Record a match reported to `client` and start both sides chatting"""
+        partner = self.clients.get(partner_name)
+        if partner is None or partner is client:
+            return
+        finished = time.perf_counter()
+        for side, other in ((client, partner), (partner, client)):
+            if side.searching_since is not None:
+                self.samples['time_to_match'].append(finished - side.searching_since)
+                side.searching_since = None
+            side.partner = other
+            side.generation += 1
+            side.rounds_left -= 1
+            side.messages_left = self.scenario.messages
+            side.drain()
+            self.later(now, 'say', side)
+        self.counts['matches'] += 1
+
+    def abandoned(self, now, client):
+        """`client`'s partner left: search again or leave"""
+        client.partner = None
+        client.generation += 1
+        self.later(now, 'find' if client.rounds_left > 0 else 'disconnect', client)
+
+    # ---- actions ----
+
+    def connect(self, now, client):
+        started = time.perf_counter()
+        client.http = self.app.app.test_client()
+        client.http.post('/guest-login', data={
+            'username': client.username, 'gender': client.gender, 'age': '25', 'country': 'US'
+        }, headers={'User-Agent': USER_AGENT, 'X-Forwarded-For': client.ip})
+        client.socket = self.app.socketio.test_client(
+            self.app.app, flask_test_client=client.http,
+            headers={'User-Agent': USER_AGENT, 'X-Forwarded-For': client.ip})
+        if not client.socket.is_connected():
+            self.counts['errors'] += 1
+            return
+        self.samples['connect'].append(time.perf_counter() - started)
+        client.rounds_left = self.scenario.rounds
+        client.drain()
+        self.later(now, 'find', client)
+
+    def find(self, now, client):
+        client.searching_since = time.perf_counter()
+        client.socket.emit('find_partner', {
+            'username': client.username, 'gender': client.gender, 'partner_pref': client.preference,
+            'age': '25', 'country': 'US', 'is_guest': True
+        })
+        for found in self.events(client, 'partner_found'):
+            self.paired(now, client, found['partner_name'])
+
+    def say(self, now, client):
+        partner = client.partner
+        for _ in range(self.scenario.keystrokes):
+            client.socket.emit('typing', {'is_typing': True})
+        client.socket.emit('typing', {'is_typing': False})
+        self.counts['typing'] += self.scenario.keystrokes + 1
+
+        text = f'{client.username}:{self.seq}'
+        started = time.perf_counter()
+        client.socket.emit('send_message', {'message': text})
+        received = [m for m in self.events(partner, 'new_message') if m['message'] == text]
+        if received:
+            self.samples['message_rtt'].append(time.perf_counter() - started)
+            self.counts['messages'] += 1
+        else:
+            self.counts['lost_messages'] += 1
+        self.events(client, None)
+
+        client.messages_left -= 1
+        if client.messages_left > 0:
+            self.later(now, 'say', client)
+        else:
+            self.later(now, 'next' if client.rounds_left > 0 else 'disconnect', client)
+
+    def next(self, now, client):
+        partner = client.partner
+        client.partner = None
+        client.generation += 1
+        self.counts['next'] += 1
+        client.searching_since = time.perf_counter()
+        client.socket.emit('next_person')
+        if partner is not None:
+            self.abandoned(now, partner)
+        for found in self.events(client, 'partner_found'):
+            self.paired(now, client, found['partner_name'])
+
+    def disconnect(self, now, client):
+        partner = client.partner
+        if client.searching_since is not None:
+            self.counts['unmatched'] += 1
+        client.socket.disconnect()
+        del self.clients[client.username]
+        if partner is not None:
+            self.abandoned(now, partner)
+
+    # ---- driver ----
+
+    def run(self):
+        """Play the whole scenario; returns the report dict"""
+        scenario = self.scenario
+        for i in range(scenario.clients):
+            client = SimulatedClient(i, self.rng)
+            self.clients[client.username] = client
+            self.at(scenario.ramp * i / scenario.clients, 'connect', client)
+
+        actions = {'connect': self.connect, 'find': self.find, 'say': self.say,
+                   'next': self.next, 'disconnect': self.disconnect}
+        rss_before = current_rss()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        peak_clients = 0
+
+        while self.schedule:
+            now, _, action, client, generation = heapq.heappop(self.schedule)
+            if client.username not in self.clients:
+                continue
+            if action in ('say', 'next') and (generation != client.generation or client.partner is None):
+                continue
+            if action == 'find' and (client.partner is not None or client.searching_since is not None):
+                continue
+            if not self.call(actions[action], now, client) and action == 'connect':
+                del self.clients[client.username]
+            peak_clients = max(peak_clients, len(self.clients))
+
+        # Whoever is still connected never found a partner
+        for client in list(self.clients.values()):
+            if client.socket is not None and client.socket.is_connected():
+                self.call(self.disconnect, 0, client)
+
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        return {
+            'scenario': scenario._asdict(),
+            'elapsed_seconds': elapsed,
+            'cpu_seconds': cpu,
+            'cpu_percent': 100.0 * cpu / elapsed if elapsed else 0.0,
+            'rss_mb': current_rss() / 1048576,
+            'rss_growth_mb': (current_rss() - rss_before) / 1048576,
+            'peak_rss_mb': peak_rss() / 1048576,
+            'peak_clients': peak_clients,
+            'latency_ms': {name: summarize(values) for name, values in self.samples.items()},
+            'counts': dict(self.counts),
+            'failures': self.failures,
+        }
+
+
+def print_report(name, result):
+    print(f'loadtest: {name} - {result["scenario"]["clients"]:,} clients, seed {result["scenario"]["seed"]}, '
+          f'{result["elapsed_seconds"]:.1f} s wall')
+    for metric, stats in result['latency_ms'].items():
+        print(f'  {metric:<14} p50 {stats["p50"]:>8.2f} ms  p95 {stats["p95"]:>8.2f} ms  '
+              f'p99 {stats["p99"]:>8.2f} ms  ({stats["count"]:,} samples)')
+    print(f'  cpu {result["cpu_seconds"]:.1f} s ({result["cpu_percent"]:.0f}%), '
+          f'rss {result["rss_mb"]:.0f} MB (+{result["rss_growth_mb"]:.0f} MB, peak {result["peak_rss_mb"]:.0f} MB), '
+          f'peak {result["peak_clients"]:,} clients')
+    print('  ' + ', '.join(f'{key} {value:,}' for key, value in result['counts'].items()))
+    for failure in result['failures']:
+        print(f'  failure: {failure}')
+
+
+def compare(result, baseline, tolerance, min_delta_ms=1.0):
+    """p95/p99 latencies that grew by more than `tolerance` and at least `min_delta_ms`"""
+    regressions = []
+    for metric in TRACKED:
+        for pct in ('p95', 'p99'):
+            before = baseline['latency_ms'].get(metric, {}).get(pct)
+            after = result['latency_ms'][metric][pct]
+            if before and after > before * (1 + tolerance) and after - before >= min_delta_ms:
+                regressions.append(f'{metric} {pct}: {before:.2f} ms -> {after:.2f} ms')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='In-process load test for the chat server')
+    parser.add_argument('scenario', nargs='?', default='smoke', choices=sorted(SCENARIOS))
+    parser.add_argument('--clients', type=int, help='override the scenario client count')
+    parser.add_argument('--seed', type=int, help='override the scenario seed')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline', help='fail if p95/p99 latencies regressed against this report')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed latency growth (0.25 = 25%%)')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='ignore smaller growth (timer noise)')
+    args = parser.parse_args(argv)
+
+    scenario = SCENARIOS[args.scenario]
+    if args.clients:
+        scenario = scenario._replace(clients=args.clients)
+    if args.seed is not None:
+        scenario = scenario._replace(seed=args.seed)
+
+    result = LoadGenerator(scenario).run()
+    print_report(args.scenario, result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f'  regression: {line}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+# Matchmaking Module
+import bisect
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+PREFERENCES = ('any', 'opposite', 'same')
+
+# Returned by a shared matchmaker's match() when another worker has just
+# claimed the caller; its partner_found is on the way, so don't queue them
+ALREADY_CLAIMED = object()
+
+
+def accepts(gender, preference, other_gender):
+    """Check if a user with this gender/preference accepts other_gender"""
+    if preference == 'same':
+        return other_gender == gender
+    if preference == 'opposite':
+        return other_gender != gender
+    return True
+
+
+class MatchmakingEngine:
+    """Waiting queues for random chat, indexed by (gender, preference).
+
+    Each bucket is an OrderedDict of user_id -> ticket, so enqueue, dequeue
+    and cancel are all O(1). Tickets come from a global counter, which lets
+    a match pick the longest-waiting compatible user across buckets.
+    """
+
+    def __init__(self):
+        self.buckets = {}       # {(gender, preference): OrderedDict(user_id -> ticket)}
+        self.waiting = {}       # {user_id: (gender, preference)}
+        self.tickets = itertools.count()
+        self.lock = threading.Lock()
+        self.matches = 0
+
+    def enqueue(self, user_id, gender, preference, country=None, age=None):
+        """Add a user to the back of their bucket (country/age are not used here)"""
+        with self.lock:
+            self._cancel(user_id)
+            key = (gender, preference)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = OrderedDict()
+            bucket[user_id] = next(self.tickets)
+            self.waiting[user_id] = key
+
+    def cancel(self, user_id):
+        """Remove a user from whichever bucket they are waiting in"""
+        with self.lock:
+            return self._cancel(user_id)
+
+    def _cancel(self, user_id):
+        key = self.waiting.pop(user_id, None)
+        if key is None:
+            return False
+        del self.buckets[key][user_id]
+        return True
+
+    def match(self, user_id, gender, preference, country=None, age=None):
+        """Pop the longest-waiting user compatible with this one, or None"""
+        with self.lock:
+            # A user looking for a partner is no longer waiting themselves
+            self._cancel(user_id)
+
+            best_bucket = None
+            best_ticket = None
+            for (other_gender, other_pref), bucket in self.buckets.items():
+                if not bucket:
+                    continue
+                if not accepts(gender, preference, other_gender):
+                    continue
+                if not accepts(other_gender, other_pref, gender):
+                    continue
+                ticket = bucket[next(iter(bucket))]
+                if best_ticket is None or ticket < best_ticket:
+                    best_bucket = bucket
+                    best_ticket = ticket
+
+            if best_bucket is None:
+                return None
+
+            partner_id, _ = best_bucket.popitem(last=False)
+            del self.waiting[partner_id]
+            self.matches += 1
+            return partner_id
+
+    def is_waiting(self, user_id):
+        """Check if a user is in any queue"""
+        return user_id in self.waiting
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def get_stats(self):
+        """Get queue statistics"""
+        with self.lock:
+            return {
+                'waiting': len(self.waiting),
+                'matches': self.matches,
+                'buckets': {f'{g}:{p}': len(b) for (g, p), b in self.buckets.items()}
+            }
+
+
+# ==================== NEARBY MATCHMAKING ====================
+
+# Lower bounds of the age bands; an age below the first is its own band
+AGE_BANDS = (18, 25, 35, 45)
+
+# Upper bounds (seconds) of the time-to-match histogram buckets
+WAIT_BOUNDS = (1, 2, 5, 10, 15, 30, 60, 120, float('inf'))
+
+# Time-to-match histograms kept per bucket label; waits in any further
+# buckets are counted under OVERFLOW_LABEL
+MAX_HISTOGRAMS = 1000
+OVERFLOW_LABEL = '*'
+
+
+def age_band(age):
+    """Age band label for an age given as int or string, '?' when unknown"""
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return '?'
+    band = bisect.bisect_right(AGE_BANDS, age)
+    if band == 0:
+        return f'<{AGE_BANDS[0]}'
+    if band == len(AGE_BANDS):
+        return f'{AGE_BANDS[-1]}+'
+    return f'{AGE_BANDS[band - 1]}-{AGE_BANDS[band] - 1}'
+
+
+class WaitHistogram:
+    """Fixed-bucket histogram of time-to-match in seconds"""
+
+    def __init__(self):
+        self.counts = [0] * len(WAIT_BOUNDS)
+        self.total = 0
+        self.sum = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(WAIT_BOUNDS, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def to_dict(self):
+        buckets = {('+Inf' if bound == float('inf') else f'{bound:g}'): count
+                   for bound, count in zip(WAIT_BOUNDS, self.counts)}
+        return {'count': self.total, 'sum': round(self.sum, 3), 'le': buckets}
+
+
+class NearbyMatchmaker:
+    """Waiting queues indexed by gender, preference, country and age band.
+
+    Every waiter sits in one FIFO bucket per level:
+        0  (gender, preference, country, age band)
+        1  (gender, preference, country)
+        2  (gender, preference)
+    A match tries level 0 first and only widens when nothing compatible is
+    waiting there. A waiter may be matched at level L once it has waited
+    relax[L - 1] seconds, so a newcomer first gets partners from its own
+    country and age band, and long waiters accept anyone compatible. Bucket
+    heads are the longest waiters, so a lookup is O(levels x gender/preference
+    pairs) whatever the queue size.
+
+    Waiters only meet newcomers in match(); sweep() pairs waiters with each
+    other once their wait has crossed a relaxation step. Time-to-match is
+    recorded per level-0 bucket, for at most `max_histograms` buckets.
+    """
+
+    LEVELS = 3
+
+    def __init__(self, relax=(5.0, 15.0), clock=time.time, max_histograms=MAX_HISTOGRAMS):
+        if len(relax) != self.LEVELS - 1:
+            raise ValueError(f'relax needs {self.LEVELS - 1} steps, got {len(relax)}')
+        self.relax = (0.0,) + tuple(relax)     # minimum wait before level L applies
+        self.clock = clock
+        self.buckets = [{} for _ in range(self.LEVELS)]    # per level: {key: OrderedDict(user_id -> enqueued_at)}
+        self.waiting = {}       # {user_id: (gender, preference, country, band, enqueued_at)}
+        self.combos = {}        # {(gender, preference): waiters} - pairs worth looking up
+        self.promotions = [deque() for _ in range(self.LEVELS)]   # per level: (due, user_id, enqueued_at)
+        self.lock = threading.Lock()
+        self.matches = 0
+        self.level_matches = [0] * self.LEVELS
+        self.histograms = {}    # {level-0 bucket label: WaitHistogram}
+        self.max_histograms = max_histograms
+
+    @staticmethod
+    def _keys(gender, preference, country, band):
+        return ((gender, preference, country, band), (gender, preference, country), (gender, preference))
+
+    def enqueue(self, user_id, gender, preference, country=None, age=None, now=None):
+        """Add a user to the back of their buckets"""
+        now = self.clock() if now is None else now
+        country = country or ''
+        band = age_band(age)
+        with self.lock:
+            self._cancel(user_id)
+            for level, key in enumerate(self._keys(gender, preference, country, band)):
+                bucket = self.buckets[level].get(key)
+                if bucket is None:
+                    bucket = self.buckets[level][key] = OrderedDict()
+                bucket[user_id] = now
+            for level in range(1, self.LEVELS):
+                self.promotions[level].append((now + self.relax[level], user_id, now))
+            self.waiting[user_id] = (gender, preference, country, band, now)
+            self.combos[(gender, preference)] = self.combos.get((gender, preference), 0) + 1
+
+    def cancel(self, user_id):
+        """Remove a user from whichever buckets they are waiting in"""
+        with self.lock:
+            return self._cancel(user_id)
+
+    def _cancel(self, user_id):
+        entry = self.waiting.pop(user_id, None)
+        if entry is None:
+            return False
+        gender, preference, country, band, _ = entry
+        for level, key in enumerate(self._keys(gender, preference, country, band)):
+            bucket = self.buckets[level][key]
+            del bucket[user_id]
+            if not bucket:
+                del self.buckets[level][key]
+        remaining = self.combos[(gender, preference)] - 1
+        if remaining:
+            self.combos[(gender, preference)] = remaining
+        else:
+            del self.combos[(gender, preference)]
+        # Stale promotion entries are skipped by sweep() (enqueued_at no longer matches)
+        return True
+
+    def _find(self, user_id, gender, preference, country, band, level, now):
+        """Longest waiter at `level` compatible with this profile that has waited long enough"""
+        cutoff = now - self.relax[level]
+        best_id = best_at = None
+        for other_gender, other_pref in self.combos:
+            if not accepts(gender, preference, other_gender):
+                continue
+            if not accepts(other_gender, other_pref, gender):
+                continue
+            key = self._keys(other_gender, other_pref, country, band)[level]
+            bucket = self.buckets[level].get(key)
+            if not bucket:
+                continue
+            for candidate, enqueued_at in bucket.items():
+                if candidate != user_id:
+                    break
+            else:
+                continue
+            if enqueued_at <= cutoff and (best_at is None or enqueued_at < best_at):
+                best_id, best_at = candidate, enqueued_at
+        return best_id
+
+    def _record(self, entry, now):
+        gender, preference, country, band, enqueued_at = entry
+        label = f'{gender}:{preference}:{country or "*"}:{band}'
+        histogram = self.histograms.get(label)
+        if histogram is None:
+            if len(self.histograms) >= self.max_histograms:
+                label = OVERFLOW_LABEL
+                histogram = self.histograms.get(label)
+            if histogram is None:
+                histogram = self.histograms[label] = WaitHistogram()
+        histogram.add(max(now - enqueued_at, 0.0))
+
+    def match(self, user_id, gender, preference, country=None, age=None, now=None):
+        """Pop the best compatible waiter for a newcomer, or None"""
+        now = self.clock() if now is None else now
+        country = country or ''
+        band = age_band(age)
+        with self.lock:
+            # A user looking for a partner is no longer waiting themselves
+            self._cancel(user_id)
+            for level in range(self.LEVELS):
+                partner_id = self._find(user_id, gender, preference, country, band, level, now)
+                if partner_id is not None:
+                    entry = self.waiting[partner_id]
+                    self._cancel(partner_id)
+                    self._record(entry, now)
+                    self._record((gender, preference, country, band, now), now)
+                    self.matches += 1
+                    self.level_matches[level] += 1
+                    return partner_id
+            return None
+
+    def sweep(self, now=None):
+        """Pair waiters whose wait just crossed a relaxation step; returns [(user_id, partner_id)]"""
+        now = self.clock() if now is None else now
+        pairs = []
+        with self.lock:
+            for level in range(1, self.LEVELS):
+                queue = self.promotions[level]
+                while queue and queue[0][0] <= now:
+                    _, user_id, enqueued_at = queue.popleft()
+                    entry = self.waiting.get(user_id)
+                    if entry is None or entry[4] != enqueued_at:
+                        continue
+                    gender, preference, country, band, _ = entry
+                    partner_id = self._find(user_id, gender, preference, country, band, level, now)
+                    if partner_id is None:
+                        continue
+                    partner_entry = self.waiting[partner_id]
+                    self._cancel(user_id)
+                    self._cancel(partner_id)
+                    self._record(entry, now)
+                    self._record(partner_entry, now)
+                    self.matches += 1
+                    self.level_matches[level] += 1
+                    pairs.append((user_id, partner_id))
+        return pairs
+
+    def is_waiting(self, user_id):
+        """Check if a user is in any queue"""
+        return user_id in self.waiting
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def get_stats(self):
+        """Queue sizes, matches per relaxation level and time-to-match histograms"""
+        with self.lock:
+            return {
+                'waiting': len(self.waiting),
+                'matches': self.matches,
+                'matches_by_level': dict(zip(('exact', 'country', 'any'), self.level_matches)),
+                'buckets': {':'.join(key): len(b) for key, b in self.buckets[0].items()},
+                'time_to_match': {label: h.to_dict() for label, h in self.histograms.items()}
+            }
@@ -0,0 +1,183 @@
+# Outbound Queue Module
+# Bounds what the server buffers for each client. Every packet for a sid goes
+# through the Engine.IO socket's send queue; a client that stops reading
+# (dead mobile link, frozen tab) lets that queue grow without limit. Past a
+# high-water mark, typing indicators are dropped, count updates are
+# coalesced to the latest value, and a client that stays slow or reaches the
+# hard limit is disconnected.
+import threading
+import time
+
+from socketio import packet
+
+# Dropped outright for a slow client - the next one supersedes them
+LOSSY_EVENTS = frozenset(['partner_typing'])
+
+# Only the latest is kept for a slow client: {event: payload field that
+# tells updates apart (None = one per event)}
+COALESCED_EVENTS = {
+    'online_count_update': None,
+    'room_count_update': 'room_id',
+}
+
+
+class OutboundQueues:
+    """Per-connection backpressure for a python-socketio Server.
+
+    install() wraps the server's packet send hooks. Below `high_water`
+    queued packets a send costs one queue-size check; above it, packets are
+    classified (decoded once per emit, not per recipient) and lossy or
+    coalescable events are held back. Anything else is still queued until
+    `max_depth`, at which point the client is disconnected, as is a client
+    that stays above `high_water` for `slow_timeout` seconds. Held-back
+    count updates are sent once the queue drains below `low_water`.
+    """
+
+    def __init__(self, server, high_water=64, low_water=16, max_depth=256, slow_timeout=30.0,
+                 interval=1.0, clock=time.time):
+        self.server = server
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_depth = max_depth
+        self.slow_timeout = slow_timeout
+        self.interval = interval
+        self.clock = clock
+        self.pending = {}           # {eio_sid: {coalesce_key: eio_pkt}} held-back count updates
+        self.slow_since = {}        # {eio_sid: when it first went over high_water}
+        self.evict = set()          # eio_sids to disconnect on the next tick
+        self.memo = (None, None)    # (last classified eio packet, its (event, key))
+        self.lock = threading.Lock()
+        self.running = False
+        self.send_eio_packet = None
+        self.send_packet = None
+        self.stats = {
+            'dropped': 0,       # lossy events and packets for clients being evicted
+            'coalesced': 0,     # count updates held back or replaced by a newer one
+            'flushed': 0,       # held-back updates sent after a client caught up
+            'evicted': 0,       # slow clients disconnected
+        }
+
+    def install(self):
+        """Route the server's outgoing packets through the queue limits"""
+        self.send_eio_packet = self.server._send_eio_packet
+        self.send_packet = self.server._send_packet
+        self.server._send_eio_packet = self.send
+        self.server._send_packet = self.send_control
+
+    def depth(self, eio_sid):
+        socket = self.server.eio.sockets.get(eio_sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    def send(self, eio_sid, eio_pkt):
+        """Emit path: one encoded packet for one recipient"""
+        depth = self.depth(eio_sid)
+        if depth < self.high_water:
+            self.send_eio_packet(eio_sid, eio_pkt)
+            return
+
+        with self.lock:
+            self.slow_since.setdefault(eio_sid, self.clock())
+            if depth >= self.max_depth or eio_sid in self.evict:
+                self.evict.add(eio_sid)
+                self.stats['dropped'] += 1
+                return
+            event, key = self.classify(eio_pkt)
+            if event in LOSSY_EVENTS:
+                self.stats['dropped'] += 1
+                return
+            if key is not None:
+                self.pending.setdefault(eio_sid, {})[key] = eio_pkt
+                self.stats['coalesced'] += 1
+                return
+        self.send_eio_packet(eio_sid, eio_pkt)
+
+    def send_control(self, eio_sid, pkt):
+        """Connect, ack and callback packets are never dropped, only bounded"""
+        if self.depth(eio_sid) >= self.max_depth:
+            with self.lock:
+                self.slow_since.setdefault(eio_sid, self.clock())
+                self.evict.add(eio_sid)
+                self.stats['dropped'] += 1
+            return
+        self.send_packet(eio_sid, pkt)
+
+    def classify(self, eio_pkt):
+        """(event, coalesce_key) of an encoded packet; room emits reuse one packet object"""
+        last, info = self.memo
+        if last is eio_pkt:
+            return info
+
+        info = (None, None)
+        try:
+            pkt = self.server.packet_class(encoded_packet=eio_pkt.data)
+        except Exception:
+            pkt = None
+        if pkt is not None and pkt.packet_type == packet.EVENT and pkt.data:
+            event = pkt.data[0]
+            key = None
+            if event in COALESCED_EVENTS:
+                field = COALESCED_EVENTS[event]
+                payload = pkt.data[1] if len(pkt.data) > 1 else None
+                key = (event, payload.get(field) if field and isinstance(payload, dict) else None)
+            info = (event, key)
+
+        self.memo = (eio_pkt, info)
+        return info
+
+    def tick(self, now=None):
+        """Flush clients that caught up, evict those that didn't"""
+        now = self.clock() if now is None else now
+        flush = []
+        with self.lock:
+            for eio_sid, since in list(self.slow_since.items()):
+                if eio_sid not in self.server.eio.sockets:
+                    self.forget(eio_sid)
+                elif self.depth(eio_sid) < self.low_water:
+                    flush.extend((eio_sid, pkt) for pkt in self.pending.pop(eio_sid, {}).values())
+                    del self.slow_since[eio_sid]
+                elif now - since >= self.slow_timeout:
+                    self.evict.add(eio_sid)
+            evict, self.evict = self.evict, set()
+            for eio_sid in evict:
+                self.forget(eio_sid)
+            self.stats['flushed'] += len(flush)
+            self.stats['evicted'] += len(evict)
+
+        for eio_sid, pkt in flush:
+            self.send_eio_packet(eio_sid, pkt)
+        for eio_sid in evict:
+            self.server.eio.disconnect(eio_sid)
+        return len(evict)
+
+    def forget(self, eio_sid):
+        self.pending.pop(eio_sid, None)
+        self.slow_since.pop(eio_sid, None)
+
+    def run(self, sleep):
+        """Flush/evict loop - start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Outbound queue tick error: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        """Queue depth across connections - O(connections), meant for the health endpoint"""
+        depths = [socket.queue.qsize() for socket in list(self.server.eio.sockets.values())]
+        with self.lock:
+            return dict(
+                self.stats,
+                connections=len(depths),
+                queued_packets=sum(depths),
+                max_depth=max(depths, default=0),
+                over_high_water=sum(1 for d in depths if d >= self.high_water),
+                slow=len(self.slow_since),
+                held_back=sum(len(p) for p in self.pending.values()),
+                high_water=self.high_water,
+                limit=self.max_depth
+            )
@@ -0,0 +1,156 @@
+# Presence Index Module
+# Online counters and per-room member sets, updated incrementally on
+# connect/disconnect/profile/room events so stats never scan every connection.
+import itertools
+import threading
+from collections import Counter
+
+GENDERS = ('male', 'female', 'other')
+PUBLIC_FIELDS = ('user_id', 'username', 'gender', 'country', 'is_guest')
+
+
+def gender_key(gender):
+    """Bucket a gender value into male/female/other"""
+    return gender if gender in ('male', 'female') else 'other'
+
+
+def username_key(username):
+    """Normalise a username for case-insensitive lookups"""
+    return (username or '').strip().casefold()
+
+
+class PresenceIndex:
+    """In-process presence counters.
+
+    entries keeps a small public snapshot per sid in connection order (dicts
+    preserve insertion order), which is what paginated user lists read from.
+    """
+
+    def __init__(self):
+        self.entries = {}           # {sid: {user_id, username, gender, country, is_guest, room}}
+        self.genders = Counter()
+        self.guests = 0
+        self.rooms = {}             # {room_id: set(sid)}
+        self.room_genders = {}      # {room_id: Counter(gender)}
+        self.lock = threading.Lock()
+
+    # ---------- updates ----------
+
+    def add(self, sid, info, room='lobby'):
+        """Register a new connection"""
+        with self.lock:
+            if sid in self.entries:
+                self._remove(sid)
+            entry = {field: info.get(field) for field in PUBLIC_FIELDS}
+            entry['room'] = room
+            self.entries[sid] = entry
+            self.genders[gender_key(entry['gender'])] += 1
+            if entry['is_guest']:
+                self.guests += 1
+            self._enter(sid, room, entry['gender'])
+
+    def remove(self, sid):
+        """Forget a connection; returns its last snapshot or None"""
+        with self.lock:
+            return self._remove(sid)
+
+    def _remove(self, sid):
+        entry = self.entries.pop(sid, None)
+        if entry is None:
+            return None
+        self.genders[gender_key(entry['gender'])] -= 1
+        if entry['is_guest']:
+            self.guests -= 1
+        self._leave(sid, entry['room'], entry['gender'])
+        return entry
+
+    def update(self, sid, **fields):
+        """Update public profile fields of a connection"""
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None:
+                return
+            if 'gender' in fields and gender_key(fields['gender']) != gender_key(entry['gender']):
+                old, new = gender_key(entry['gender']), gender_key(fields['gender'])
+                self.genders[old] -= 1
+                self.genders[new] += 1
+                room_genders = self.room_genders[entry['room']]
+                room_genders[old] -= 1
+                room_genders[new] += 1
+            if 'is_guest' in fields and bool(fields['is_guest']) != bool(entry['is_guest']):
+                self.guests += 1 if fields['is_guest'] else -1
+            entry.update((k, v) for k, v in fields.items() if k in PUBLIC_FIELDS)
+
+    def move(self, sid, room):
+        """Move a connection to another room; returns the previous room"""
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None:
+                return None
+            previous = entry['room']
+            if previous != room:
+                self._leave(sid, previous, entry['gender'])
+                self._enter(sid, room, entry['gender'])
+                entry['room'] = room
+            return previous
+
+    def _enter(self, sid, room, gender):
+        members = self.rooms.get(room)
+        if members is None:
+            members = self.rooms[room] = set()
+            self.room_genders[room] = Counter()
+        members.add(sid)
+        self.room_genders[room][gender_key(gender)] += 1
+
+    def _leave(self, sid, room, gender):
+        members = self.rooms.get(room)
+        if members is None:
+            return
+        members.discard(sid)
+        if members:
+            self.room_genders[room][gender_key(gender)] -= 1
+        else:
+            del self.rooms[room]
+            del self.room_genders[room]
+
+    # ---------- reads ----------
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, sid):
+        return sid in self.entries
+
+    def get_stats(self):
+        """Total/guest/registered counts - O(1)"""
+        total = len(self.entries)
+        return {'total': total, 'guests': self.guests, 'registered': total - self.guests}
+
+    def gender_counts(self):
+        """Online users by gender - O(1)"""
+        return {g: self.genders[g] for g in GENDERS}
+
+    def room_size(self, room):
+        """Number of connections in a room - O(1)"""
+        return len(self.rooms.get(room, ()))
+
+    def room_members(self, room):
+        """Set of sids in a room"""
+        return set(self.rooms.get(room, ()))
+
+    def room_stats(self):
+        """Users and gender split per room - O(rooms)"""
+        with self.lock:
+            return {
+                room: {
+                    'users': len(members),
+                    'gender_counts': {g: self.room_genders[room][g] for g in GENDERS}
+                }
+                for room, members in self.rooms.items()
+            }
+
+    def list_users(self, offset=0, limit=50):
+        """A page of (sid, snapshot) pairs in connection order"""
+        with self.lock:
+            return [(sid, dict(entry)) for sid, entry in
+                    itertools.islice(self.entries.items(), offset, offset + limit)]
@@ -0,0 +1,211 @@
+# Query Registry Module
+# Each SQL statement is written once, with ? placeholders, and compiled for
+# the configured driver when it is defined at import: SQLite runs the text
+# as written (and its per-connection statement cache keeps it compiled),
+# PostgreSQL gets a PREPARE for each session plus an EXECUTE that binds the
+# parameters. Rows come back as Records - the row tuple plus a column index
+# shared by every row of the same shape - instead of a dict per row.
+# Listings page by keyset: a cursor carries the sort key of the last row
+# sent, so the next page seeks straight to it in an index however deep the
+# client has scrolled, where OFFSET reads and skips every earlier row.
+import base64
+import json
+from collections.abc import Mapping
+
+DIALECTS = ('sqlite', 'postgres')
+
+
+class Record:
+    """Read-only row: record['column'], record[0], record.get(), dict(record).
+
+    Subclasses made by record_type() carry the column names and their
+    positions; a record itself holds just the row tuple.
+    """
+
+    __slots__ = ('_values',)
+    _fields = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._values[key]
+        return self._values[self._index[key]]
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        return default if position is None else self._values[position]
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return [self._values[position] for position in self._index.values()]
+
+    def items(self):
+        return [(field, self._values[position]) for field, position in self._index.items()]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._fields == other._fields and self._values == other._values
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def _asdict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f'Record({self._asdict()!r})'
+
+
+Mapping.register(Record)
+
+_record_types = {}
+
+
+def record_type(columns):
+    """Record subclass for a tuple of column names (cached; a repeated name keeps its last position)"""
+    cls = _record_types.get(columns)
+    if cls is None:
+        index = {column: position for position, column in enumerate(columns)}
+        cls = type('Record', (Record,), {'__slots__': (), '_fields': columns, '_index': index})
+        _record_types[columns] = cls
+    return cls
+
+
+def records(cursor, rows, query=None):
+    """Wrap fetched row tuples in the Record type for the cursor's columns.
+
+    A Statement remembers its type, so only the first fetch reads the
+    column names (and any fetch after the column count changes).
+    """
+    description = cursor.description
+    cls = query.row_type if isinstance(query, Statement) else None
+    if cls is None or len(cls._fields) != len(description):
+        cls = record_type(tuple(column[0] for column in description))
+        if isinstance(query, Statement):
+            query.row_type = cls
+    return [cls(row) for row in rows]
+
+
+def split_placeholders(sql):
+    """Pieces of `sql` between ? placeholders (quoted literals are left alone)"""
+    pieces, current, quote = [], [], None
+    for char in sql:
+        if quote:
+            current.append(char)
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+            current.append(char)
+        elif char == '?':
+            pieces.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    pieces.append(''.join(current))
+    return pieces
+
+
+class Statement:
+    """One named query compiled for a dialect.
+
+    text:    the SQL to run directly (? for SQLite, %s for psycopg2)
+    prepare: PostgreSQL only - PREPARE name AS ... with $1..$n parameters
+    execute: PostgreSQL only - EXECUTE name (%s, ...) binding the parameters
+    """
+
+    __slots__ = ('name', 'sql', 'dialect', 'param_count', 'text', 'prepare', 'execute', 'row_type')
+
+    def __init__(self, name, sql, dialect):
+        self.name = name
+        self.row_type = None        # Record type of its rows, set by records()
+        self.sql = ' '.join(sql.split())
+        self.dialect = dialect
+        pieces = split_placeholders(self.sql)
+        self.param_count = len(pieces) - 1
+        if dialect == 'postgres':
+            # psycopg2 treats % as a format character whenever parameters are passed
+            self.text = '%s'.join(piece.replace('%', '%%') for piece in pieces)
+            self.prepare = f'PREPARE {name} AS ' + ''.join(
+                piece + (f'${i + 1}' if i < self.param_count else '') for i, piece in enumerate(pieces))
+            self.execute = f'EXECUTE {name}' + (f' ({", ".join(["%s"] * self.param_count)})' if self.param_count else '')
+        else:
+            self.text = self.sql
+            self.prepare = self.execute = None
+
+    def __repr__(self):
+        return f'Statement({self.name!r}, {self.sql!r})'
+
+
+class QueryRegistry:
+    """Named statements for one dialect, compiled as they are defined"""
+
+    def __init__(self, dialect):
+        if dialect not in DIALECTS:
+            raise ValueError(f'Unknown dialect: {dialect} (choose from {", ".join(DIALECTS)})')
+        self.dialect = dialect
+        self.statements = {}
+
+    def define(self, name, sql):
+        """Register and compile a statement; names are unique"""
+        if name in self.statements:
+            raise ValueError(f'Query already defined: {name}')
+        statement = self.statements[name] = Statement(name, sql, self.dialect)
+        return statement
+
+    @property
+    def mark(self):
+        """The driver's placeholder, for SQL built at run time"""
+        return '%s' if self.dialect == 'postgres' else '?'
+
+    def placeholders(self, count):
+        """'?, ?, ?' (or '%s, ...') for an IN list of `count` values"""
+        return ', '.join([self.mark] * count)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+# ==================== KEYSET PAGINATION ====================
+
+def encode_cursor(key):
+    """Opaque page token for a row's sort key (a list of JSON-able values)"""
+    data = json.dumps(list(key), separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def decode_cursor(token, size=2):
+    """The sort key in a page token (None for no token); ValueError if it isn't one of ours"""
+    if not token:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+def next_page(rows, limit, key=('created_at', 'id')):
+    """Trim a fetch of limit + 1 rows to one page: (rows, cursor for the next page or None)"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([rows[-1][column] for column in key])
@@ -0,0 +1,164 @@
+# Session Resume Module
+# Keeps a paired user's slot for a few seconds after their socket drops, so
+# a network blip doesn't end the chat and send both people back through
+# matchmaking. The client reconnects with the resume token it was given on
+# connect; whatever its partner sent in the meantime is replayed from a
+# small per-user buffer.
+import secrets
+import threading
+import time
+from collections import deque
+
+from expiry import TimingWheel
+
+# Disconnect reasons (python-socketio >= 5.12) that mean the client or the
+# server ended the session on purpose; anything else may be a network blip.
+# Older versions report no reason, which is treated as a possible blip.
+DELIBERATE_DISCONNECTS = frozenset(['client disconnect', 'server disconnect'])
+
+
+class ResumeWindow:
+    """Held slots for disconnected users, keyed by user id.
+
+    hold() parks a user under their token for `window` seconds; claim()
+    hands the slot and its buffered events to a new connection presenting
+    the same token from the same browser session. A client usually
+    reconnects before the server has noticed its old socket is gone, so
+    claim() also takes over a live user whose token was issued to that
+    session and has not been held yet. Slots that are not claimed in time
+    come back from expire() for the caller to release. Buffers keep the
+    latest `buffer_size` events.
+    """
+
+    def __init__(self, window=10.0, buffer_size=50, tick=1.0, clock=time.time):
+        self.window = window
+        self.buffer_size = buffer_size
+        self.clock = clock
+        self.held = {}          # {user_id: {token, session_id, since, events}}
+        self.tokens = {}        # {token: user_id} for held users only
+        self.live = {}          # {token: (user_id, session_id)} for connected users
+        self.wheel = TimingWheel(window, tick=tick, clock=clock)
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {
+            'held': 0,
+            'resumed': 0,
+            'taken_over': 0,            # resumes of a slot whose old socket hadn't dropped yet
+            'expired': 0,
+            'rematches_avoided': 0,     # resumes that found their pairing intact
+            'replayed': 0,
+            'dropped': 0                # events pushed out of a full buffer
+        }
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def issue(self, user_id, session_id):
+        """New resume token for a user's connection from this browser session"""
+        token = secrets.token_urlsafe(16)
+        if self.enabled:
+            with self.lock:
+                self.live[token] = (user_id, session_id)
+        return token
+
+    def forget(self, token):
+        """Retire a token whose user has been released or given a new one"""
+        with self.lock:
+            self.live.pop(token, None)
+
+    def hold(self, user_id, token, session_id, now=None):
+        """Park a disconnected user; returns False if resume is off or there is no token.
+        A user already held keeps their slot, window and buffer."""
+        if not self.enabled or not token:
+            return False
+        now = self.clock() if now is None else now
+        with self.lock:
+            if user_id in self.held:
+                return True
+            self.live.pop(token, None)
+            self.held[user_id] = {
+                'token': token,
+                'session_id': session_id,
+                'since': now,
+                'events': deque(maxlen=self.buffer_size)
+            }
+            self.tokens[token] = user_id
+            self.stats['held'] += 1
+        self.wheel.touch(user_id, now)
+        return True
+
+    def is_held(self, user_id):
+        return user_id in self.held
+
+    def buffer(self, user_id, event, payload):
+        """Keep an event for a held user; returns False if they aren't held"""
+        with self.lock:
+            entry = self.held.get(user_id)
+            if entry is None:
+                return False
+            events = entry['events']
+            if len(events) == events.maxlen:
+                self.stats['dropped'] += 1
+            events.append((event, payload))
+            return True
+
+    def claim(self, token, session_id):
+        """(user_id, buffered events) for a valid token, else (None, [])"""
+        with self.lock:
+            user_id = self.tokens.get(token)
+            entry = self.held.get(user_id)
+            if entry is None:
+                # Not held (yet): the old socket may still be timing out
+                live = self.live.get(token)
+                if live is None or live[1] != session_id:
+                    return None, []
+                del self.live[token]
+                self.stats['resumed'] += 1
+                self.stats['taken_over'] += 1
+                return live[0], []
+            if entry['session_id'] != session_id:
+                return None, []
+            del self.tokens[token]
+            del self.held[user_id]
+            self.stats['resumed'] += 1
+            self.stats['replayed'] += len(entry['events'])
+        self.wheel.cancel(user_id)
+        return user_id, list(entry['events'])
+
+    def pairing_kept(self):
+        with self.lock:
+            self.stats['rematches_avoided'] += 1
+
+    def expire(self, now=None):
+        """Drop slots whose window ran out; returns their user ids"""
+        expired = []
+        for user_id in self.wheel.advance(now):
+            with self.lock:
+                entry = self.held.pop(user_id, None)
+                if entry is None:
+                    continue
+                self.tokens.pop(entry['token'], None)
+                self.stats['expired'] += 1
+            expired.append(user_id)
+        return expired
+
+    def run(self, sleep, on_expire):
+        """Expiry loop - start with socketio.start_background_task(run, socketio.sleep, release)"""
+        self.running = True
+        while self.running:
+            sleep(self.wheel.tick)
+            try:
+                for user_id in self.expire():
+                    on_expire(user_id)
+            except Exception as e:
+                print(f"Resume window expiry error: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        """Get resume statistics"""
+        with self.lock:
+            return dict(self.stats, waiting=len(self.held), live_tokens=len(self.live),
+                        window_seconds=self.window)
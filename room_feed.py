@@ -0,0 +1,255 @@
+# Room Feed Module
+# Real-time delivery for group chat rooms (/chat-rooms). Each room keeps a
+# ring buffer of its latest messages, numbered by a per-room sequence, so a
+# joining client gets recent history without a query and a reconnecting one
+# asks only for what came after the last sequence it saw. New messages are
+# fanned out in batches - one packet per room per interval, however many
+# messages arrived - and persisted to room_messages by a write-behind
+# journal. With several workers, SharedRoomFeed keeps the sequences and
+# buffers in the shared store and the batches go out through the Socket.IO
+# message queue.
+import json
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+
+class RoomLog:
+    """Sequence counter and ring buffer for one room"""
+
+    __slots__ = ('room_id', 'seq', 'buffer', 'pending')
+
+    def __init__(self, room_id, seq=0, buffer_size=100):
+        self.room_id = room_id
+        self.seq = seq                              # last sequence number handed out
+        self.buffer = deque(maxlen=buffer_size)     # latest messages, oldest first
+        self.pending = []                           # published since the last flush
+
+    def since(self, after_seq):
+        """(messages with seq > after_seq, whether the buffer covered them all)"""
+        if after_seq >= self.seq:
+            return [], True
+        if not self.buffer:
+            return [], False
+        start = after_seq + 1 - self.buffer[0]['seq']
+        if start < 0:
+            return list(self.buffer), False
+        return list(islice(self.buffer, start, None)), True
+
+
+class RoomFeed:
+    """Per-room ring buffers, sequence numbers and batched fan-out.
+
+    open() loads a room once per process via `load(room_id, limit)`, which
+    returns (last seq, recent messages oldest first) or None for a room that
+    doesn't exist; the other methods expect an opened room. publish()
+    numbers a message, buffers it, hands it to `record` for persistence and
+    queues it for the next flush(), which calls `emit(room_id, messages)`
+    once per room with pending messages. Sequences and buffers are per
+    process; SharedRoomFeed shares them between workers.
+    """
+
+    def __init__(self, emit, load, record=None, buffer_size=100, interval=0.05, clock=time.time):
+        self.emit = emit
+        self.load = load
+        self.record = record
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.clock = clock
+        self.rooms = {}         # {room_id: RoomLog}
+        self.dirty = set()      # room ids with pending messages
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {
+            'published': 0,
+            'batches': 0,           # packets emitted (one per room per flush)
+            'backfills': 0,         # history requests answered from a buffer
+            'backfill_misses': 0,   # ... that reached past it
+            'loaded_rooms': 0
+        }
+
+    def open(self, room_id):
+        """The room's log, loading its sequence and recent history on first use (None if no such room)"""
+        log = self.rooms.get(room_id)
+        if log is not None:
+            return log
+        loaded = self.load(room_id, self.buffer_size)
+        if loaded is None:
+            return None
+        seq, recent = loaded
+        with self.lock:
+            log = self.rooms.get(room_id)
+            if log is None:
+                log = RoomLog(room_id, seq, self.buffer_size)
+                log.buffer.extend(recent)
+                self.rooms[room_id] = log
+                self.stats['loaded_rooms'] += 1
+        return log
+
+    def publish(self, room_id, user_id, username, content, now=None):
+        """Number, buffer and queue a message; returns it"""
+        log = self.rooms[room_id]
+        now = self.clock() if now is None else now
+        with self.lock:
+            log.seq += 1
+            message = {
+                'room_id': room_id,
+                'seq': log.seq,
+                'user_id': user_id,
+                'username': username,
+                'content': content,
+                'timestamp': now
+            }
+            log.buffer.append(message)
+            log.pending.append(message)
+            self.dirty.add(room_id)
+            self.stats['published'] += 1
+        if self.record:
+            self.record(room_id, user_id, content, message['seq'], now)
+        return message
+
+    def recent(self, room_id):
+        """The buffered messages, oldest first"""
+        with self.lock:
+            return list(self.rooms[room_id].buffer)
+
+    def since(self, room_id, after_seq):
+        """(messages after after_seq, complete) - complete is False when the
+        client is further behind than the buffer and must page the rest"""
+        with self.lock:
+            messages, complete = self.rooms[room_id].since(after_seq)
+            self.stats['backfills' if complete else 'backfill_misses'] += 1
+        return messages, complete
+
+    def last_seq(self, room_id):
+        log = self.rooms.get(room_id)
+        return log.seq if log else 0
+
+    def flush(self):
+        """Emit each room's pending messages as one batch; returns packets sent"""
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            batches = []
+            for room_id in dirty:
+                log = self.rooms[room_id]
+                batches.append((room_id, log.pending))
+                log.pending = []
+
+        for room_id, messages in batches:
+            self.emit(room_id, messages)
+        self.stats['batches'] += len(batches)
+        return len(batches)
+
+    def run(self, sleep):
+        """Fan-out loop - start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Room feed flush error: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        """Get room feed statistics"""
+        return dict(self.stats, rooms=len(self.rooms), pending_rooms=len(self.dirty),
+                    interval_ms=int(self.interval * 1000))
+
+
+class SharedRoomFeed(RoomFeed):
+    """RoomFeed whose sequences and buffers live in a Redis-protocol store.
+
+    Each room's seq is an INCR counter and its buffer a capped list, so
+    every worker numbers messages from the same counter and backfills
+    joining clients with what was posted on any worker. A worker still
+    batches the messages it published itself; emit() must reach the other
+    workers' members (Socket.IO message queue).
+    """
+
+    def __init__(self, client, emit, load, record=None, buffer_size=100, interval=0.05,
+                 clock=time.time, prefix='rooms'):
+        super().__init__(emit, load, record, buffer_size, interval, clock)
+        self.client = client
+        self.prefix = prefix
+
+    def _seq_key(self, room_id):
+        return f'{self.prefix}:{room_id}:seq'
+
+    def _buffer_key(self, room_id):
+        return f'{self.prefix}:{room_id}:buffer'
+
+    def open(self, room_id):
+        """The room's local log, seeding the shared counter and buffer on first use anywhere"""
+        log = self.rooms.get(room_id)
+        if log is not None:
+            return log
+        loaded = self.load(room_id, self.buffer_size)
+        if loaded is None:
+            return None
+        seq, recent = loaded
+        # Whoever creates the counter seeds the buffer; everyone else reuses both
+        # (prepended, so a message another worker publishes meanwhile stays newest)
+        if self.client.set(self._seq_key(room_id), seq, nx=True) and recent:
+            pipe = self.client.pipeline()
+            pipe.lpush(self._buffer_key(room_id), *(json.dumps(message) for message in reversed(recent)))
+            pipe.ltrim(self._buffer_key(room_id), -self.buffer_size, -1)
+            pipe.execute()
+        with self.lock:
+            log = self.rooms.get(room_id)
+            if log is None:
+                log = self.rooms[room_id] = RoomLog(room_id, buffer_size=0)
+                self.stats['loaded_rooms'] += 1
+        return log
+
+    def publish(self, room_id, user_id, username, content, now=None):
+        """Number a message from the shared counter, buffer it for every worker and queue it here"""
+        log = self.rooms[room_id]
+        now = self.clock() if now is None else now
+        message = {
+            'room_id': room_id,
+            'seq': self.client.incr(self._seq_key(room_id)),
+            'user_id': user_id,
+            'username': username,
+            'content': content,
+            'timestamp': now
+        }
+        pipe = self.client.pipeline()
+        pipe.rpush(self._buffer_key(room_id), json.dumps(message))
+        pipe.ltrim(self._buffer_key(room_id), -self.buffer_size, -1)
+        pipe.execute()
+        with self.lock:
+            log.seq = max(log.seq, message['seq'])
+            log.pending.append(message)
+            self.dirty.add(room_id)
+            self.stats['published'] += 1
+        if self.record:
+            self.record(room_id, user_id, content, message['seq'], now)
+        return message
+
+    def _buffer(self, room_id):
+        # Workers can push out of seq order; clients expect it sorted
+        messages = [json.loads(raw) for raw in self.client.lrange(self._buffer_key(room_id), 0, -1)]
+        return sorted(messages, key=lambda message: message['seq'])
+
+    def recent(self, room_id):
+        """The shared buffer, oldest first"""
+        return self._buffer(room_id)
+
+    def since(self, room_id, after_seq):
+        """(messages after after_seq, complete) from the shared buffer"""
+        if after_seq >= self.last_seq(room_id):
+            messages, complete = [], True
+        else:
+            buffer = self._buffer(room_id)
+            messages = [message for message in buffer if message['seq'] > after_seq]
+            complete = bool(buffer) and buffer[0]['seq'] <= after_seq + 1
+        with self.lock:
+            self.stats['backfills' if complete else 'backfill_misses'] += 1
+        return messages, complete
+
+    def last_seq(self, room_id):
+        return int(self.client.get(self._seq_key(room_id)) or 0)
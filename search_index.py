@@ -0,0 +1,95 @@
+# Search Index Module
+# Full-text search over direct messages. SQLite keeps an FTS5 table over
+# messages.content and PostgreSQL a GIN-indexed tsvector column; both are
+# set up by database.init_database and kept current by triggers, so a
+# search reads an index instead of scanning every message with LIKE.
+# Messages written before the index existed are added by SearchBackfill, a
+# batch per interval, so writers are never held up for long.
+import html
+import re
+import time
+
+# Words are runs of letters and digits; anything else separates them
+TERM = re.compile(r'[^\W_]+')
+MAX_TERMS = 8
+
+# The database wraps matched words in these; highlight() turns them into <mark>
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+
+def search_terms(text):
+    """The lower-cased words of a search box query (at most MAX_TERMS)"""
+    return TERM.findall(text.lower())[:MAX_TERMS]
+
+
+def fts5_query(terms):
+    """FTS5 MATCH expression for messages with every term, each quoted so none reads as an operator"""
+    return ' '.join(f'"{term}"' for term in terms)
+
+
+def tsquery(terms):
+    """to_tsquery() expression for messages with every term"""
+    return ' & '.join(terms)
+
+
+def highlight(snippet):
+    """HTML for a snippet: the message text escaped, matched words in <mark>"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>')
+
+
+class SearchBackfill:
+    """Indexes the messages that predate the search index, a batch at a time.
+
+    `step(batch)` indexes up to `batch` of them and returns (rows indexed,
+    whether any are left). run() calls it every `interval` seconds until
+    nothing is left; several workers can run it at once, as each step locks
+    the shared progress row.
+    """
+
+    def __init__(self, step, batch=5000, interval=0.1, clock=time.time):
+        self.step = step
+        self.batch = batch
+        self.interval = interval
+        self.clock = clock
+        self.running = False
+        self.done = False
+        self.stats = {
+            'indexed': 0,
+            'batches': 0,
+            'errors': 0,
+            'started_at': None,
+            'finished_at': None
+        }
+
+    def run_once(self):
+        """Index one batch; returns True while rows are left"""
+        indexed, remaining = self.step(self.batch)
+        self.stats['indexed'] += indexed
+        self.stats['batches'] += 1
+        if not remaining:
+            self.done = True
+            self.stats['finished_at'] = self.clock()
+        return remaining
+
+    def run(self, sleep):
+        """Backfill loop - start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        self.stats['started_at'] = self.clock()
+        while self.running and not self.done:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Search backfill error: {e}")
+            sleep(self.interval)
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def get_stats(self):
+        """Get backfill statistics"""
+        return dict(self.stats, done=self.done, batch=self.batch, interval_ms=int(self.interval * 1000))
@@ -0,0 +1,221 @@
+# Snapshot Module
+# Warm restarts for state that otherwise lives only in process memory
+# (such as the set of taken guest names). The tables are written to one
+# binary file every `interval` seconds when they have changed, and loaded
+# back before the server starts accepting clients.
+#
+# File layout: MAGIC, then length-prefixed marshal blobs - a header naming
+# each table with its kind and chunk count, followed by the chunks in order.
+# Dicts of dicts are stored column-wise (one list per field), which is about
+# a third of the size of marshalling the dicts themselves and loads faster.
+import gc
+import marshal
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+MAGIC = b'CHATSNAP'
+VERSION = 1
+
+LENGTH = struct.Struct('<I')
+MISSING = ...   # field absent from a record (marshal can store Ellipsis)
+
+
+@contextmanager
+def collector_paused():
+    """Hold off the cyclic GC: bulk encoding/decoding allocates a container per
+    row, and the full collections that triggers scan the whole heap while
+    holding the GIL - a stall for every thread, not just this one"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def encode_table(table, chunk_rows):
+    """(kind, chunks) for a dict or set; each chunk is small enough to marshal quickly"""
+    if isinstance(table, (set, frozenset)):
+        items = list(table)
+        return 'set', [items[i:i + chunk_rows] for i in range(0, len(items), chunk_rows)]
+
+    items = list(table.items())
+    if items and all(isinstance(value, dict) for _, value in items):
+        fields = list(dict.fromkeys(field for _, value in items for field in value))
+        chunks = []
+        for i in range(0, len(items), chunk_rows):
+            rows = items[i:i + chunk_rows]
+            columns = [[value.get(field, MISSING) for _, value in rows] for field in fields]
+            chunks.append(([key for key, _ in rows], fields, columns))
+        return 'records', chunks
+
+    return 'dict', [([key for key, _ in items[i:i + chunk_rows]], [value for _, value in items[i:i + chunk_rows]])
+                    for i in range(0, len(items), chunk_rows)]
+
+
+def decode_chunk(kind, chunk, table):
+    """Add one decoded chunk to `table` in place"""
+    if kind == 'set':
+        # A table that has become a dict since the file was written gets None values
+        table.update(chunk if isinstance(table, (set, frozenset)) else dict.fromkeys(chunk))
+    elif kind == 'records':
+        keys, fields, columns = chunk
+        if any(MISSING in column for column in columns):
+            table.update((key, {f: v for f, v in zip(fields, row) if v is not MISSING})
+                         for key, row in zip(keys, zip(*columns)))
+        else:
+            table.update(zip(keys, (dict(zip(fields, row)) for row in zip(*columns))))
+    else:
+        keys, values = chunk
+        table.update(zip(keys, values))
+
+
+class StateSnapshot:
+    """Periodic snapshot of named in-memory tables.
+
+    `tables` maps a name to a dict or set that handlers mutate in place;
+    restore() refills those same objects, so module-level references stay
+    valid. Handlers call changed() after a mutation - an unchanged state is
+    not rewritten. save() copies each table's top level first (one C-level
+    call per table) and encodes from that copy in `chunk_rows` pieces, so
+    handlers keep running while it works; the file is replaced atomically,
+    never half-written.
+    """
+
+    def __init__(self, path, tables, interval=30.0, chunk_rows=2000, clock=time.time):
+        self.path = path
+        self.tables = tables
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.clock = clock
+        self.version = 0            # bumped by changed()
+        self.saved_version = 0      # version covered by the last save or restore
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {
+            'saves': 0,
+            'skipped': 0,           # intervals with nothing new to write
+            'failures': 0,
+            'last_save_ms': 0.0,
+            'last_save_at': None,
+            'last_size': 0,
+            'restored_rows': 0,
+            'restore_ms': 0.0
+        }
+
+    def changed(self):
+        self.version += 1
+
+    def save(self, force=False):
+        """Write a snapshot if anything changed since the last one; returns rows written"""
+        with self.lock:
+            version = self.version
+            if not force and version == self.saved_version:
+                self.stats['skipped'] += 1
+                return 0
+
+            start = time.perf_counter()
+            with collector_paused():
+                encoded = {name: encode_table(table, self.chunk_rows) for name, table in self.tables.items()}
+            rows = sum(len(table) for table in self.tables.values())
+            header = {
+                'version': VERSION,
+                'taken_at': self.clock(),
+                'tables': [(name, kind, len(chunks)) for name, (kind, chunks) in encoded.items()]
+            }
+
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            size = len(MAGIC)
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC)
+                for obj in [header] + [chunk for _, chunks in encoded.values() for chunk in chunks]:
+                    blob = marshal.dumps(obj)
+                    f.write(LENGTH.pack(len(blob)))
+                    f.write(blob)
+                    size += LENGTH.size + len(blob)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+            self.saved_version = version
+            self.stats['saves'] += 1
+            self.stats['last_save_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self.stats['last_save_at'] = header['taken_at']
+            self.stats['last_size'] = size
+            return rows
+
+    def restore(self):
+        """Refill the tables from the snapshot file; returns rows restored (0 if there is none)"""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+
+        start = time.perf_counter()
+        with open(self.path, 'rb') as f:
+            data = memoryview(f.read())
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{self.path} is not a state snapshot')
+
+        offset = len(MAGIC)
+
+        def read():
+            nonlocal offset
+            (length,) = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            obj = marshal.loads(data[offset:offset + length])
+            offset += length
+            return obj
+
+        header = read()
+        if header.get('version') != VERSION:
+            raise ValueError(f'Unsupported snapshot version: {header.get("version")}')
+
+        rows = 0
+        with collector_paused():
+            for name, kind, chunk_count in header['tables']:
+                table = self.tables.get(name)
+                chunks = [read() for _ in range(chunk_count)]
+                if table is None:
+                    continue
+                table.clear()
+                for chunk in chunks:
+                    decode_chunk(kind, chunk, table)
+                rows += len(table)
+
+        self.saved_version = self.version
+        self.stats['restored_rows'] = rows
+        self.stats['restore_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        return rows
+
+    def run(self, sleep, offload=None):
+        """Save loop - start with socketio.start_background_task(run, socketio.sleep, offload)"""
+        self.running = True
+        while self.running:
+            sleep(self.interval)
+            try:
+                if offload:
+                    offload(self.save)
+                else:
+                    self.save()
+            except Exception as e:
+                self.stats['failures'] += 1
+                print(f"State snapshot error: {e}")
+
+    def close(self):
+        """Stop the loop and write any last changes (call on shutdown)"""
+        self.running = False
+        try:
+            return self.save()
+        except Exception as e:
+            print(f"State snapshot error on shutdown: {e}")
+            return 0
+
+    def get_stats(self):
+        """Get snapshot statistics"""
+        return dict(self.stats, path=self.path, pending_changes=self.version != self.saved_version)
@@ -0,0 +1,902 @@
+# Shared State Module
+# Users, connections, matchmaking queues and presence for the Socket.IO server.
+# InMemoryStateBackend keeps everything in plain dicts for a single worker;
+# SharedStateBackend keeps it in a Redis-protocol store so several gunicorn
+# workers or hosts can serve one user population.
+import json
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+
+from matchmaking import MatchmakingEngine, NearbyMatchmaker, ALREADY_CLAIMED, accepts
+from presence import PresenceIndex, PUBLIC_FIELDS, GENDERS, gender_key
+
+
+# ==================== LOCAL REDIS STAND-IN ====================
+
+class LocalRedis:
+    """In-process stand-in for the subset of Redis commands used here.
+
+    Behaves like redis.Redis(decode_responses=True) so SharedStateBackend can
+    be exercised without a server (STATE_BACKEND_URL=local://).
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}       # {name: deadline} set by expire()
+        self.lock = threading.RLock()
+
+    def _purge(self, name):
+        deadline = self.expires.get(name)
+        if deadline is not None and deadline <= time.time():
+            del self.expires[name]
+            self.data.pop(name, None)
+
+    def _get(self, name, factory):
+        value = self.data.get(name)
+        if value is None:
+            value = self.data[name] = factory()
+        return value
+
+    # Keys
+    def delete(self, *names):
+        with self.lock:
+            for name in names:
+                self.expires.pop(name, None)
+            return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+    def exists(self, *names):
+        with self.lock:
+            for name in names:
+                self._purge(name)
+            return sum(1 for name in names if name in self.data)
+
+    def expire(self, name, seconds):
+        with self.lock:
+            if name not in self.data:
+                return False
+            self.expires[name] = time.time() + seconds
+            return True
+
+    def get(self, name):
+        with self.lock:
+            self._purge(name)
+            return self.data.get(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        with self.lock:
+            self._purge(name)
+            if nx and name in self.data:
+                return None
+            self.data[name] = str(value)
+            self.expires.pop(name, None)
+            if ex is not None:
+                self.expires[name] = time.time() + ex
+            return True
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self._purge(name)
+            value = int(self.data.get(name, 0)) + amount
+            self.data[name] = str(value)
+            return value
+
+    incrby = incr
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+    # Hashes
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self.lock:
+            h = self._get(name, dict)
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for k in items if k not in h)
+            h.update({k: str(v) for k, v in items.items()})
+            return added
+
+    def hincrby(self, name, key, amount=1):
+        with self.lock:
+            h = self._get(name, dict)
+            value = int(h.get(key, 0)) + amount
+            h[key] = str(value)
+            return value
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.data.get(name, {}).get(key)
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.data.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            h = self.data.get(name, {})
+            removed = sum(1 for k in keys if h.pop(k, None) is not None)
+            if name in self.data and not h:
+                del self.data[name]
+            return removed
+
+    def hexists(self, name, key):
+        with self.lock:
+            return key in self.data.get(name, {})
+
+    def hlen(self, name):
+        with self.lock:
+            return len(self.data.get(name, {}))
+
+    # Sets
+    def sadd(self, name, *values):
+        with self.lock:
+            s = self._get(name, set)
+            added = sum(1 for v in values if v not in s)
+            s.update(values)
+            return added
+
+    def srem(self, name, *values):
+        with self.lock:
+            s = self.data.get(name, set())
+            removed = sum(1 for v in values if v in s)
+            s.difference_update(values)
+            if name in self.data and not s:
+                del self.data[name]
+            return removed
+
+    def sismember(self, name, value):
+        with self.lock:
+            return value in self.data.get(name, set())
+
+    def smembers(self, name):
+        with self.lock:
+            return set(self.data.get(name, set()))
+
+    def scard(self, name):
+        with self.lock:
+            return len(self.data.get(name, set()))
+
+    # Lists
+    def lpush(self, name, *values):
+        with self.lock:
+            items = self._get(name, list)
+            items[:0] = reversed(values)
+            return len(items)
+
+    def rpush(self, name, *values):
+        with self.lock:
+            items = self._get(name, list)
+            items.extend(values)
+            return len(items)
+
+    def ltrim(self, name, start, end):
+        with self.lock:
+            items = self.data.get(name)
+            if items is None:
+                return True
+            items[:] = items[start:len(items) if end == -1 else end + 1]
+            if not items:
+                del self.data[name]
+            return True
+
+    def lrange(self, name, start, end):
+        with self.lock:
+            items = self.data.get(name, [])
+            return list(items[start:len(items) if end == -1 else end + 1])
+
+    # Sorted sets
+    def zadd(self, name, mapping):
+        with self.lock:
+            z = self._get(name, dict)
+            added = sum(1 for k in mapping if k not in z)
+            z.update({k: float(v) for k, v in mapping.items()})
+            return added
+
+    def zrem(self, name, *values):
+        with self.lock:
+            z = self.data.get(name, {})
+            removed = sum(1 for v in values if z.pop(v, None) is not None)
+            if name in self.data and not z:
+                del self.data[name]
+            return removed
+
+    def zcard(self, name):
+        with self.lock:
+            return len(self.data.get(name, {}))
+
+    def zrange(self, name, start, end, withscores=False):
+        with self.lock:
+            items = sorted(self.data.get(name, {}).items(), key=lambda kv: (kv[1], kv[0]))
+        end = len(items) if end == -1 else end + 1
+        items = items[start:end]
+        return items if withscores else [k for k, _ in items]
+
+
+class LocalPipeline:
+    """Queues LocalRedis commands and runs them together on execute()"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, command):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.client, command), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client.lock:
+            commands, self.commands = self.commands, []
+            return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+# ==================== SHARED RECORDS ====================
+
+def _encode(value):
+    return json.dumps(value)
+
+def _decode(value):
+    return json.loads(value) if value is not None else None
+
+
+class SharedRecord(dict):
+    """A dict whose writes go straight through to a Redis hash"""
+
+    def __init__(self, client, key, data):
+        super().__init__(data)
+        self.client = client
+        self.key = key
+
+    def __setitem__(self, field, value):
+        super().__setitem__(field, value)
+        self.client.hset(self.key, field, _encode(value))
+
+    def __delitem__(self, field):
+        super().__delitem__(field)
+        self.client.hdel(self.key, field)
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super().update(changes)
+        if changes:
+            self.client.hset(self.key, mapping={k: _encode(v) for k, v in changes.items()})
+
+    def setdefault(self, field, default=None):
+        if field not in self:
+            self[field] = default
+        return self[field]
+
+    def pop(self, field, *default):
+        if field in self:
+            self.client.hdel(self.key, field)
+        return super().pop(field, *default)
+
+
+class SharedHashMap(MutableMapping):
+    """Mapping of id -> SharedRecord, one Redis hash per record.
+
+    Reads always hit the store, so a record changed by another worker is seen
+    on the next lookup. Values must be JSON-serialisable scalars.
+    """
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+        self.index_key = f'{prefix}:ids'
+
+    def _key(self, record_id):
+        return f'{self.prefix}:{record_id}'
+
+    def __getitem__(self, record_id):
+        raw = self.client.hgetall(self._key(record_id))
+        if not raw:
+            raise KeyError(record_id)
+        return SharedRecord(self.client, self._key(record_id),
+                            {k: _decode(v) for k, v in raw.items()})
+
+    def __setitem__(self, record_id, data):
+        key = self._key(record_id)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if data:
+            pipe.hset(key, mapping={k: _encode(v) for k, v in data.items()})
+        pipe.sadd(self.index_key, record_id)
+        pipe.execute()
+
+    def __delitem__(self, record_id):
+        pipe = self.client.pipeline()
+        pipe.srem(self.index_key, record_id)
+        pipe.delete(self._key(record_id))
+        if not pipe.execute()[0]:
+            raise KeyError(record_id)
+
+    def __contains__(self, record_id):
+        return bool(self.client.sismember(self.index_key, record_id))
+
+    def __iter__(self):
+        return iter(self.client.smembers(self.index_key))
+
+    def __len__(self):
+        return self.client.scard(self.index_key)
+
+    def items(self):
+        """Yield (id, record) pairs, skipping records deleted mid-iteration"""
+        for record_id in self:
+            try:
+                yield record_id, self[record_id]
+            except KeyError:
+                continue
+
+    def values(self):
+        return (record for _, record in self.items())
+
+
+class SharedIndex(MutableMapping):
+    """Mapping of string -> string kept in a single Redis hash (lookup indexes)"""
+
+    def __init__(self, client, key):
+        self.client = client
+        self.key = key
+
+    def __getitem__(self, name):
+        value = self.client.hget(self.key, name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        self.client.hset(self.key, name, value)
+
+    def __delitem__(self, name):
+        if not self.client.hdel(self.key, name):
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return bool(self.client.hexists(self.key, name))
+
+    def __iter__(self):
+        return iter(self.client.hgetall(self.key))
+
+    def __len__(self):
+        return self.client.hlen(self.key)
+
+
+# ==================== SHARED MATCHMAKING ====================
+
+def register_script(client, lua, local):
+    """A callable script(keys=[...], args=[...]) that runs atomically in the store.
+
+    On Redis this is the Lua source; LocalRedis can't run Lua, so `local`,
+    a Python function (client, keys, args) doing the same thing, is run
+    under its lock instead.
+    """
+    if isinstance(client, LocalRedis):
+        def run(keys=(), args=()):
+            with client.lock:
+                return local(client, list(keys), list(args))
+        return run
+    return client.register_script(lua)
+
+
+# In the where hash, a user claimed by another's match() maps to '' until
+# the claimer has paired them and cancel()s the entry, or until the user's
+# own racing match() consumes it (so a claimer that dies mid-pairing blocks
+# at most one match)
+
+# KEYS: where. ARGV: user_id. Takes the user out of the bucket it waits in.
+CANCEL_LUA = """
+local bucket = redis.call('HGET', KEYS[1], ARGV[1])
+if not bucket then return 0 end
+redis.call('HDEL', KEYS[1], ARGV[1])
+if bucket == '' then return 0 end
+redis.call('ZREM', bucket, ARGV[1])
+return 1
+"""
+
+# KEYS: where, buckets, ticket, bucket. ARGV: user_id, bucket name.
+ENQUEUE_LUA = """
+local old = redis.call('HGET', KEYS[1], ARGV[1])
+if old then redis.call('ZREM', old, ARGV[1]) end
+local ticket = redis.call('INCR', KEYS[3])
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('ZADD', KEYS[4], ticket, ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], KEYS[4])
+return ticket
+"""
+
+# KEYS: where, matches, candidate buckets... ARGV: user_id.
+# Dequeues the caller, then claims the longest-waiting head of the
+# candidate buckets, all in one step. Returns '' if the caller has itself
+# just been claimed.
+MATCH_LUA = """
+local own = redis.call('HGET', KEYS[1], ARGV[1])
+if own == '' then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return ''
+end
+if own then
+    redis.call('ZREM', own, ARGV[1])
+    redis.call('HDEL', KEYS[1], ARGV[1])
+end
+local best, best_bucket, best_score
+for i = 3, #KEYS do
+    local head = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+    if head[1] and (best == nil or tonumber(head[2]) < best_score) then
+        best, best_bucket, best_score = head[1], KEYS[i], tonumber(head[2])
+    end
+end
+if not best then return false end
+redis.call('ZREM', best_bucket, best)
+redis.call('HSET', KEYS[1], best, '')
+redis.call('INCR', KEYS[2])
+return best
+"""
+
+
+def _cancel_local(client, keys, args):
+    where, (user_id,) = keys[0], args
+    bucket = client.hget(where, user_id)
+    if bucket is None:
+        return 0
+    client.hdel(where, user_id)
+    if bucket == '':
+        return 0
+    client.zrem(bucket, user_id)
+    return 1
+
+
+def _enqueue_local(client, keys, args):
+    where, buckets, ticket_key, bucket = keys
+    user_id, name = args
+    old = client.hget(where, user_id)
+    if old is not None:
+        client.zrem(old, user_id)
+    ticket = client.incr(ticket_key)
+    client.sadd(buckets, name)
+    client.zadd(bucket, {user_id: ticket})
+    client.hset(where, user_id, bucket)
+    return ticket
+
+
+def _match_local(client, keys, args):
+    where, matches, candidates = keys[0], keys[1], keys[2:]
+    user_id, = args
+    if client.hget(where, user_id) == '':
+        client.hdel(where, user_id)
+        return ''
+    _cancel_local(client, [where], [user_id])
+    best = None
+    for bucket in candidates:
+        head = client.zrange(bucket, 0, 0, withscores=True)
+        if head and (best is None or head[0][1] < best[2]):
+            best = (bucket, head[0][0], head[0][1])
+    if best is None:
+        return None
+    bucket, partner_id, _ = best
+    client.zrem(bucket, partner_id)
+    client.hset(where, partner_id, '')
+    client.incr(matches)
+    return partner_id
+
+
+class SharedMatchmaker:
+    """MatchmakingEngine counterpart backed by Redis sorted sets.
+
+    Each (gender, preference) bucket is a sorted set scored by a global ticket
+    counter, so strangers connected to different workers queue together.
+    enqueue, cancel and match each run as one script, so a user is never
+    claimed by two workers: match takes the caller out of the queue and its
+    partner with it in one step. The partner stays marked as claimed until
+    the claimer has paired them and calls cancel(partner); a match() the
+    partner started meanwhile returns ALREADY_CLAIMED instead of pairing
+    them a second time.
+    """
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+        self.where_key = f'{prefix}:where'
+        self.buckets_key = f'{prefix}:buckets'
+        self.ticket_key = f'{prefix}:ticket'
+        self.matches_key = f'{prefix}:matches'
+        self._cancel = register_script(client, CANCEL_LUA, _cancel_local)
+        self._enqueue = register_script(client, ENQUEUE_LUA, _enqueue_local)
+        self._match = register_script(client, MATCH_LUA, _match_local)
+
+    def _bucket(self, gender, preference):
+        return f'{self.prefix}:q:{gender}:{preference}'
+
+    def enqueue(self, user_id, gender, preference, country=None, age=None):
+        """Add a user to the back of their bucket (country/age are not used here)"""
+        self._enqueue(keys=[self.where_key, self.buckets_key, self.ticket_key, self._bucket(gender, preference)],
+                      args=[user_id, f'{gender}:{preference}'])
+
+    def cancel(self, user_id):
+        """Remove a user from whichever bucket they are waiting in"""
+        return bool(self._cancel(keys=[self.where_key], args=[user_id]))
+
+    def match(self, user_id, gender, preference, country=None, age=None):
+        """Claim the longest-waiting user compatible with this one, or None
+        (ALREADY_CLAIMED if someone has just claimed this user)"""
+        candidates = []
+        for name in self.client.smembers(self.buckets_key):
+            other_gender, other_pref = name.split(':', 1)
+            if accepts(gender, preference, other_gender) and accepts(other_gender, other_pref, gender):
+                candidates.append(self._bucket(other_gender, other_pref))
+        partner_id = self._match(keys=[self.where_key, self.matches_key] + candidates, args=[user_id])
+        return ALREADY_CLAIMED if partner_id == '' else partner_id
+
+    def is_waiting(self, user_id):
+        """Check if a user is in any queue"""
+        return bool(self.client.hget(self.where_key, user_id))
+
+    def __len__(self):
+        return self.client.hlen(self.where_key)
+
+    def get_stats(self):
+        """Get queue statistics"""
+        buckets = {}
+        for name in self.client.smembers(self.buckets_key):
+            gender, preference = name.split(':', 1)
+            buckets[name] = self.client.zcard(self._bucket(gender, preference))
+        return {
+            'waiting': len(self),
+            'matches': int(self.client.get(self.matches_key) or 0),
+            'buckets': buckets
+        }
+
+
+# ==================== SHARED PRESENCE ====================
+
+class SharedPresenceIndex:
+    """PresenceIndex counterpart kept in Redis.
+
+    All counters live in one hash updated with HINCRBY, so every stats read
+    is a single HGETALL no matter how many users are online. Each update
+    reads the connection's entry once and sends its writes as one MULTI
+    pipeline.
+    """
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+        self.counts_key = f'{prefix}:counts'
+        self.order_key = f'{prefix}:order'
+        self.ticket_key = f'{prefix}:ticket'
+        self.rooms_key = f'{prefix}:rooms'
+
+    def _entry_key(self, sid):
+        return f'{self.prefix}:s:{sid}'
+
+    def _room_key(self, room):
+        return f'{self.prefix}:room:{room}'
+
+    def _entry(self, sid):
+        raw = self.client.hgetall(self._entry_key(sid))
+        return {k: _decode(v) for k, v in raw.items()} if raw else None
+
+    # ---------- updates ----------
+
+    def add(self, sid, info, room='lobby'):
+        """Register a new connection"""
+        self.remove(sid)
+        entry = {field: info.get(field) for field in PUBLIC_FIELDS}
+        entry['room'] = room
+        ticket = self.client.incr(self.ticket_key)
+        pipe = self.client.pipeline()
+        pipe.hset(self._entry_key(sid), mapping={k: _encode(v) for k, v in entry.items()})
+        pipe.zadd(self.order_key, {sid: ticket})
+        pipe.hincrby(self.counts_key, f'g:{gender_key(entry["gender"])}', 1)
+        if entry['is_guest']:
+            pipe.hincrby(self.counts_key, 'guests', 1)
+        self._enter(pipe, sid, room, entry['gender'])
+        pipe.execute()
+
+    def remove(self, sid):
+        """Forget a connection; returns its last snapshot or None"""
+        entry = self._entry(sid)
+        if entry is None:
+            return None
+        pipe = self.client.pipeline()
+        pipe.delete(self._entry_key(sid))
+        pipe.zrem(self.order_key, sid)
+        pipe.hincrby(self.counts_key, f'g:{gender_key(entry["gender"])}', -1)
+        if entry['is_guest']:
+            pipe.hincrby(self.counts_key, 'guests', -1)
+        self._leave(pipe, sid, entry['room'], entry['gender'])
+        self._forget_room(entry['room'], pipe.execute()[-1])
+        return entry
+
+    def update(self, sid, **fields):
+        """Update public profile fields of a connection"""
+        entry = self._entry(sid)
+        if entry is None:
+            return
+        pipe = self.client.pipeline()
+        if 'gender' in fields and gender_key(fields['gender']) != gender_key(entry['gender']):
+            old, new = gender_key(entry['gender']), gender_key(fields['gender'])
+            pipe.hincrby(self.counts_key, f'g:{old}', -1)
+            pipe.hincrby(self.counts_key, f'g:{new}', 1)
+            pipe.hincrby(self.counts_key, f'rg:{entry["room"]}:{old}', -1)
+            pipe.hincrby(self.counts_key, f'rg:{entry["room"]}:{new}', 1)
+        if 'is_guest' in fields and bool(fields['is_guest']) != bool(entry['is_guest']):
+            pipe.hincrby(self.counts_key, 'guests', 1 if fields['is_guest'] else -1)
+        changes = {k: _encode(v) for k, v in fields.items() if k in PUBLIC_FIELDS}
+        if changes:
+            pipe.hset(self._entry_key(sid), mapping=changes)
+        pipe.execute()
+
+    def move(self, sid, room):
+        """Move a connection to another room; returns the previous room"""
+        entry = self._entry(sid)
+        if entry is None:
+            return None
+        previous = entry['room']
+        if previous != room:
+            pipe = self.client.pipeline()
+            pipe.hset(self._entry_key(sid), 'room', _encode(room))
+            self._enter(pipe, sid, room, entry['gender'])
+            self._leave(pipe, sid, previous, entry['gender'])
+            self._forget_room(previous, pipe.execute()[-1])
+        return previous
+
+    def _enter(self, pipe, sid, room, gender):
+        pipe.sadd(self._room_key(room), sid)
+        pipe.sadd(self.rooms_key, room)
+        pipe.hincrby(self.counts_key, f'r:{room}', 1)
+        pipe.hincrby(self.counts_key, f'rg:{room}:{gender_key(gender)}', 1)
+
+    def _leave(self, pipe, sid, room, gender):
+        """Queue the room decrements; the last result is the room's remaining count"""
+        pipe.srem(self._room_key(room), sid)
+        pipe.hincrby(self.counts_key, f'rg:{room}:{gender_key(gender)}', -1)
+        pipe.hincrby(self.counts_key, f'r:{room}', -1)
+
+    def _forget_room(self, room, remaining):
+        if remaining <= 0:
+            pipe = self.client.pipeline()
+            pipe.srem(self.rooms_key, room)
+            pipe.hdel(self.counts_key, f'r:{room}', *(f'rg:{room}:{g}' for g in GENDERS))
+            pipe.execute()
+
+    # ---------- reads ----------
+
+    def __len__(self):
+        return self.client.zcard(self.order_key)
+
+    def __contains__(self, sid):
+        return bool(self.client.exists(self._entry_key(sid)))
+
+    def get_stats(self):
+        """Total/guest/registered counts"""
+        total = len(self)
+        guests = int(self.client.hget(self.counts_key, 'guests') or 0)
+        return {'total': total, 'guests': guests, 'registered': total - guests}
+
+    def gender_counts(self):
+        """Online users by gender"""
+        counts = self.client.hgetall(self.counts_key)
+        return {g: int(counts.get(f'g:{g}', 0)) for g in GENDERS}
+
+    def room_size(self, room):
+        """Number of connections in a room"""
+        return self.client.scard(self._room_key(room))
+
+    def room_members(self, room):
+        """Set of sids in a room"""
+        return self.client.smembers(self._room_key(room))
+
+    def room_stats(self):
+        """Users and gender split per room - O(rooms)"""
+        counts = self.client.hgetall(self.counts_key)
+        return {
+            room: {
+                'users': int(counts.get(f'r:{room}', 0)),
+                'gender_counts': {g: int(counts.get(f'rg:{room}:{g}', 0)) for g in GENDERS}
+            }
+            for room in self.client.smembers(self.rooms_key)
+        }
+
+    def list_users(self, offset=0, limit=50):
+        """A page of (sid, snapshot) pairs in connection order"""
+        page = []
+        for sid in self.client.zrange(self.order_key, offset, offset + limit - 1):
+            entry = self._entry(sid)
+            if entry is not None:
+                page.append((sid, entry))
+        return page
+
+
+# ==================== WORKER LEASES ====================
+
+class WorkerLease:
+    """Ownership of shared connections and users by the worker serving them.
+
+    Each worker keeps a heartbeat key alive with a TTL and lists the sids
+    and user ids it serves. A worker that crashes or is killed stops
+    renewing its heartbeat; once the key expires, the next live worker to
+    check takes the reaping lock and hands the dead worker's sids to
+    `drop` and its users to `release`, so ghost users, connections and
+    presence counters don't stay in the store forever.
+    """
+
+    def __init__(self, client, prefix, worker_id=None, ttl=30.0, interval=10.0):
+        self.client = client
+        self.prefix = prefix
+        self.worker_id = worker_id or uuid.uuid4().hex
+        self.ttl = ttl
+        self.interval = interval
+        self.workers_key = f'{prefix}:workers'
+        self.running = False
+        self.stats = {
+            'heartbeats': 0,
+            'reaped_workers': 0,
+            'reaped_connections': 0,
+            'reaped_users': 0,
+            'errors': 0
+        }
+
+    def _alive_key(self, worker_id):
+        return f'{self.prefix}:alive:{worker_id}'
+
+    def _conns_key(self, worker_id):
+        return f'{self.prefix}:conns:{worker_id}'
+
+    def _users_key(self, worker_id):
+        return f'{self.prefix}:users:{worker_id}'
+
+    # ---------- ownership ----------
+
+    def claim(self, sid, user_id):
+        """Record that this worker serves sid (and its user)"""
+        self.client.hset(self._conns_key(self.worker_id), sid, user_id)
+        self.client.sadd(self._users_key(self.worker_id), user_id)
+
+    def release(self, sid):
+        """The connection is gone from the store"""
+        self.client.hdel(self._conns_key(self.worker_id), sid)
+
+    def release_user(self, user_id):
+        """The user is gone from the store"""
+        self.client.srem(self._users_key(self.worker_id), user_id)
+
+    # ---------- liveness ----------
+
+    def heartbeat(self):
+        """Renew this worker's heartbeat key"""
+        self.client.set(self._alive_key(self.worker_id), int(time.time()), ex=int(self.ttl))
+        self.client.sadd(self.workers_key, self.worker_id)
+        self.stats['heartbeats'] += 1
+
+    def dead_workers(self):
+        """Ids of registered workers whose heartbeat has expired"""
+        return [worker_id for worker_id in self.client.smembers(self.workers_key)
+                if worker_id != self.worker_id and not self.client.exists(self._alive_key(worker_id))]
+
+    def reap(self, drop, release):
+        """Purge the entries of every dead worker; returns how many workers were reaped"""
+        reaped = 0
+        for worker_id in self.dead_workers():
+            # Only one live worker purges a given dead one
+            if not self.client.set(f'{self.prefix}:reaping:{worker_id}', self.worker_id,
+                                   ex=int(self.ttl), nx=True):
+                continue
+            conns = self.client.hgetall(self._conns_key(worker_id))
+            for sid in conns:
+                drop(sid)
+            user_ids = self.client.smembers(self._users_key(worker_id))
+            for user_id in user_ids:
+                release(user_id)
+            self.client.delete(self._conns_key(worker_id), self._users_key(worker_id))
+            self.client.srem(self.workers_key, worker_id)
+            self.stats['reaped_connections'] += len(conns)
+            self.stats['reaped_users'] += len(user_ids)
+            reaped += 1
+        self.stats['reaped_workers'] += reaped
+        return reaped
+
+    def run(self, sleep, drop, release):
+        """Heartbeat/reap loop - start with socketio.start_background_task(run, socketio.sleep, ...)"""
+        self.running = True
+        while self.running:
+            try:
+                self.heartbeat()
+                self.reap(drop, release)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Worker lease error: {e}")
+            sleep(self.interval)
+
+    def stop(self):
+        """Stop heartbeating and hand this worker's entries to the survivors"""
+        self.running = False
+        self.client.delete(self._alive_key(self.worker_id))
+
+    def get_stats(self):
+        """Get lease statistics"""
+        return dict(self.stats, worker_id=self.worker_id,
+                    connections=self.client.hlen(self._conns_key(self.worker_id)),
+                    users=self.client.scard(self._users_key(self.worker_id)))
+
+
+# ==================== BACKENDS ====================
+
+class InMemoryStateBackend:
+    """Process-local state - the default for single-worker deployments"""
+
+    shared = False
+
+    def __init__(self, matchmaker=None):
+        self.users = {}
+        self.active_connections = {}
+        self.matchmaker = matchmaker if matchmaker is not None else MatchmakingEngine()
+        self.presence = PresenceIndex()
+        # Lookup indexes: session_id -> sid, user_id -> sid, username_key -> user_id
+        self.sessions = {}
+        self.user_sids = {}
+        self.usernames = {}
+        self.lease = None
+
+
+class SharedStateBackend:
+    """State kept in a Redis-protocol store and shared by every worker"""
+
+    shared = True
+
+    def __init__(self, client, prefix='chat', lease_ttl=30.0):
+        self.client = client
+        self.prefix = prefix
+        self.lease = WorkerLease(client, f'{prefix}:lease', ttl=lease_ttl, interval=lease_ttl / 3)
+        self.users = SharedHashMap(client, f'{prefix}:users')
+        self.active_connections = SharedHashMap(client, f'{prefix}:conn')
+        self.matchmaker = SharedMatchmaker(client, f'{prefix}:mm')
+        self.presence = SharedPresenceIndex(client, f'{prefix}:presence')
+        self.sessions = SharedIndex(client, f'{prefix}:idx:sessions')
+        self.user_sids = SharedIndex(client, f'{prefix}:idx:user_sids')
+        self.usernames = SharedIndex(client, f'{prefix}:idx:usernames')
+
+
+def create_client(url=''):
+    """Create a Redis-protocol client from a URL, or None for in-process state.
+
+    ''/memory://        None (single worker)
+    local://            LocalRedis (tests, one process)
+    redis://, rediss:// redis.Redis connected to a server
+    """
+    if not url or url.startswith('memory://'):
+        return None
+
+    if url.startswith('local://'):
+        return LocalRedis()
+
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            print("WARNING: redis not installed, falling back to in-memory state")
+            return None
+        return redis.Redis.from_url(url, decode_responses=True)
+
+    raise ValueError(f'Unsupported state backend URL: {url}')
+
+
+def create_matchmaker(mode='basic', relax=(5.0, 15.0)):
+    """In-process matchmaker: 'basic' (gender/preference) or 'nearby' (+ country, age band)"""
+    if mode == 'nearby':
+        return NearbyMatchmaker(relax=relax)
+    if mode != 'basic':
+        raise ValueError(f'Unsupported matchmaking mode: {mode}')
+    return MatchmakingEngine()
+
+
+def create_state_backend(url='', matchmaking='basic', relax=(5.0, 15.0), lease_ttl=30.0):
+    """Create a state backend from a URL (see create_client)"""
+    client = create_client(url)
+    if client is None:
+        return InMemoryStateBackend(create_matchmaker(matchmaking, relax))
+    if matchmaking != 'basic':
+        print(f"WARNING: {matchmaking} matchmaking is in-process only, shared queues use basic matching")
+    return SharedStateBackend(client, lease_ttl=lease_ttl)
@@ -139,8 +139,32 @@ document.addEventListener('DOMContentLoaded', function() {
     loadDemoUsers();
 });
 
+// Uses the msgpack parser when the server runs in msgpack mode. Reconnects
+// present the last resume token so a chat survives a dropped connection.
+function createSocket() {
+    let resumeToken = null;
+    const options = {
+        auth: (cb) => cb(resumeToken ? { resume_token: resumeToken } : {})
+    };
+    if (window.socketParser) {
+        options.parser = window.socketParser;
+    }
+    const s = io(options);
+    s.on('connected', (data) => {
+        resumeToken = data.resume_token || null;
+    });
+    // Heartbeat so the server's idle reaper keeps this connection, even
+    // while nothing else is sent (e.g. waiting for a partner)
+    setInterval(function() {
+        if (s.connected) {
+            s.emit('ping');
+        }
+    }, 30000); // Every 30 seconds
+    return s;
+}
+
 function initializeSocket() {
-    socket = io();
+    socket = createSocket();
 
     socket.on('connect', () => {
         console.log('Socket connected');
@@ -157,8 +181,6 @@ function initializeSocket() {
         console.log('User connected with ID:', userId);
         // Send tab ID to server so it tracks us as separate user
         socket.emit('register_tab', { tab_id: TAB_ID });
-        // Start heartbeat
-        startHeartbeat();
     });
 
     socket.on('disconnect', () => {
@@ -170,15 +192,6 @@ function initializeSocket() {
         alert(data.message);
     });
 
-    // Heartbeat to keep connection alive
-    function startHeartbeat() {
-        setInterval(function() {
-            if (socket && socket.connected) {
-                socket.emit('ping');
-            }
-        }, 30000); // Every 30 seconds
-    }
-
     socket.on('pong', function() {
         // Server acknowledged ping
         console.log('Heartbeat received');
@@ -211,7 +224,7 @@ function initializeSocket() {
     });
 
     socket.on('new_message', (data) => {
-        addMessage(data.message, data.sender);
+        addMessage(data.message, data.from === socket.id ? 'you' : 'partner');
     });
 
     socket.on('partner_disconnected', () => {
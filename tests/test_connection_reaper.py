@@ -0,0 +1,79 @@
+"""The idle-connection reaper must not tear down chats that are in use.
+
+Run from the repository root: python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.mkdtemp(prefix='reaper-test-'), 'chat.log'))
+
+import loadtest  # noqa: E402
+from expiry import TimingWheel  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def app():
+    return loadtest.load_app()
+
+
+@pytest.fixture(autouse=True)
+def reaper(app, monkeypatch):
+    """A fresh wheel per test, since sweeping ahead in time moves it forward for good"""
+    wheel = TimingWheel(app.config.STALE_CONNECTION_TIMEOUT, tick=app.config.REAPER_TICK_SECONDS)
+    monkeypatch.setattr(app, 'connection_reaper', wheel)
+    return wheel
+
+
+def connect(app, index):
+    http = app.app.test_client()
+    headers = {'User-Agent': loadtest.USER_AGENT, 'X-Forwarded-For': f'10.9.0.{index}'}
+    http.post('/guest-login', data={'username': f'reaper{index}', 'gender': 'male', 'age': '25', 'country': 'US'},
+              headers=headers)
+    client = app.socketio.test_client(app.app, flask_test_client=http, headers=headers)
+    assert client.is_connected()
+    client.get_received()
+    return client
+
+
+def events(client):
+    return [packet['name'] for packet in client.get_received()]
+
+
+def test_silent_connection_is_reaped(app):
+    start = time.time()
+    client = connect(app, 3)
+    sid = next(sid for sid, conn in app.active_connections.items() if conn.get('username') == 'reaper3')
+
+    app.cleanup_stale_connections(start + app.config.STALE_CONNECTION_TIMEOUT + 100)
+    assert sid not in app.active_connections
+    client.disconnect()
+
+
+def test_chatting_pair_survives_reaper_sweep(app, reaper, monkeypatch):
+    start = time.time()
+    a, b = connect(app, 1), connect(app, 2)
+    for client in (a, b):
+        client.emit('find_partner', {'username': 'x', 'gender': 'male', 'partner_pref': 'any'})
+    assert 'partner_found' in events(a)
+    assert 'partner_found' in events(b)
+    paired = len(app.users)
+
+    # Most of the idle timeout later the pair is still talking, without pings
+    later = start + app.config.STALE_CONNECTION_TIMEOUT * 2 / 3
+    monkeypatch.setattr(reaper, 'clock', lambda: later)
+    a.emit('send_message', {'message': 'still here'})
+    b.emit('send_message', {'message': 'me too'})
+
+    # A sweep past the original deadline must leave both connected and paired
+    reaped = app.cleanup_stale_connections(start + app.config.STALE_CONNECTION_TIMEOUT + 100)
+    assert reaped == 0
+    assert len(app.users) == paired
+    assert 'partner_disconnected' not in events(a) + events(b)
+
+    a.disconnect()
+    b.disconnect()
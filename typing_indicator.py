@@ -0,0 +1,102 @@
+# Typing Indicator Module
+# Per-connection typing state machine: only started/stopped transitions are
+# forwarded to the partner, repeats are rate limited, and a connection that
+# goes quiet is reported as stopped after an idle timeout.
+import threading
+import time
+
+from expiry import TimingWheel
+
+
+class TypingTracker:
+    """Decides which client typing events are worth forwarding.
+
+    Clients send a typing event per keystroke. A connection is either idle
+    or typing; a typing=True event while already typing is only forwarded
+    again once `repeat_interval` has passed (a keep-alive for the partner's
+    indicator), and typing=False while idle is dropped. Connections that
+    stop sending typing events are timed out by a TimingWheel and reported
+    through emit_stopped(sid, room).
+    """
+
+    def __init__(self, emit_stopped, idle_timeout=5.0, repeat_interval=3.0, tick=1.0, clock=time.time):
+        self.emit_stopped = emit_stopped
+        self.repeat_interval = repeat_interval
+        self.clock = clock
+        self.typing = {}            # {sid: (room, last_forwarded_at)} for connections currently typing
+        self.idle = TimingWheel(idle_timeout, tick=tick, clock=clock)
+        self.lock = threading.Lock()
+        self.running = False
+        self.stats = {
+            'received': 0,      # typing events from clients
+            'forwarded': 0,     # events passed on to the partner
+            'suppressed': 0,    # repeats and no-op stops dropped
+            'timed_out': 0      # stops sent on behalf of idle connections
+        }
+
+    def update(self, sid, room, is_typing, now=None):
+        """Record a client event; returns True if it should be forwarded"""
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.stats['received'] += 1
+            current = self.typing.get(sid)
+            if current is not None and current[0] != room:
+                # Partner changed since the last event - start over
+                current = None
+                del self.typing[sid]
+
+            if is_typing:
+                self.idle.touch(sid, now)
+                if current is not None and now - current[1] < self.repeat_interval:
+                    self.stats['suppressed'] += 1
+                    return False
+                self.typing[sid] = (room, now)
+            else:
+                if current is None:
+                    self.stats['suppressed'] += 1
+                    return False
+                del self.typing[sid]
+                self.idle.cancel(sid)
+
+            self.stats['forwarded'] += 1
+            return True
+
+    def forget(self, sid):
+        """Drop a connection (disconnect or partner change) without emitting"""
+        with self.lock:
+            self.typing.pop(sid, None)
+            self.idle.cancel(sid)
+
+    def expire(self, now=None):
+        """Emit 'stopped' for every connection idle past the timeout"""
+        stopped = []
+        with self.lock:
+            for sid in self.idle.advance(now):
+                current = self.typing.pop(sid, None)
+                if current is not None:
+                    stopped.append((sid, current[0]))
+            self.stats['timed_out'] += len(stopped)
+
+        for sid, room in stopped:
+            self.emit_stopped(sid, room)
+        return len(stopped)
+
+    def run(self, sleep):
+        """Idle-timeout loop - start with socketio.start_background_task(run, socketio.sleep)"""
+        self.running = True
+        while self.running:
+            sleep(self.idle.tick)
+            try:
+                self.expire()
+            except Exception as e:
+                print(f"Typing expiry error: {e}")
+
+    def stop(self):
+        self.running = False
+
+    def __len__(self):
+        return len(self.typing)
+
+    def get_stats(self):
+        """Get typing indicator statistics"""
+        return dict(self.stats, typing=len(self.typing))